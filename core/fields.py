@@ -0,0 +1,39 @@
+import json
+import zlib
+
+from django.db import models
+
+
+class CompressedTextField(models.BinaryField):
+    """
+    Text field that is stored zlib compressed as an unindexed blob. Suited to
+    large payloads that are only ever read back whole.
+    """
+    def get_prep_value(self, value):
+        if value is None:
+            return None
+        return zlib.compress(self.dumps(value))
+
+    def from_db_value(self, value, expression, connection, context):
+        if value is None:
+            return None
+        return self.loads(zlib.decompress(bytes(value)))
+
+    def dumps(self, value):
+        if isinstance(value, bytes):
+            return value
+        return value.encode('utf-8')
+
+    def loads(self, data):
+        return data.decode('utf-8')
+
+
+class CompressedJSONField(CompressedTextField):
+    """
+    Stores a JSON serializable value zlib compressed as an unindexed blob
+    """
+    def dumps(self, value):
+        return json.dumps(value, separators=(',', ':'))
+
+    def loads(self, data):
+        return json.loads(data)
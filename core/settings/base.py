@@ -122,6 +122,67 @@ SESSION_ENGINE = 'django.contrib.sessions.backends.signed_cookies'
 YOUTUBE_API_KEY = config.youtube_api_key
 CLOUD_NATURAL_LANG_API_KEY = config.cloud_nl_api_key
 
+# YouTube comment import settings - comments are paged through 100 at a time
+# (the API maximum) up to the caps below. None disables a cap.
+YOUTUBE_COMMENTS_PAGE_SIZE = 100
+YOUTUBE_COMMENTS_MAX_PAGES = None
+YOUTUBE_COMMENTS_MAX_RESULTS = 10000
+# the analysis of comment pages after these first few is background work
+YOUTUBE_COMMENTS_INTERACTIVE_PAGES = 2
+
+# YouTube search and video lookups are cached for 15 minutes, with the most
+# recently used responses also held in each instance's memory
+YOUTUBE_SEARCH_CACHE_TIMEOUT = 60 * 15
+YOUTUBE_SEARCH_CACHE_SIZE = 256
+
+# seconds the results of a video search are kept for adding to a project
+VIDEO_SEARCH_TIMEOUT = 60 * 60
+
+# size in seconds of the time windows transcript sentiment is bucketed into
+TRANSCRIPT_TIMELINE_WINDOW = 60
+
+# Cloud NL analysis cache settings - results are held in memcache for a day
+# and in the datastore for 90 days. Only texts up to the length of a YouTube
+# comment are cached, the analyses of longer ones such as transcripts are too
+# big for memcache and are rarely asked for again.
+CLOUD_NATURAL_LANG_CACHE_TIMEOUT = 60 * 60 * 24
+CLOUD_NATURAL_LANG_CACHE_EXPIRY = 60 * 60 * 24 * 90
+CLOUD_NATURAL_LANG_CACHE_MAX_LENGTH = 10000
+
+# deferred tasks that hit a transient error are retried up to this many times
+# with a jittered exponential backoff, starting at the base delay (seconds)
+TASK_RETRY_ATTEMPTS = 5
+TASK_RETRY_BASE_DELAY = 30
+TASK_RETRY_MAX_DELAY = 60 * 60
+
+# seconds each instance buffers its metric counters for before adding them
+# to the shared counters in memcache, see services.metrics
+METRICS_FLUSH_INTERVAL = 10
+
+# API quota token buckets, shared across instances. Rates are in quota units
+# per second: YouTube allows 10,000 units a day and Cloud NL 600 requests a
+# minute by default.
+API_QUOTAS = {
+    'youtube': {'rate': 10000.0 / (60 * 60 * 24), 'capacity': 1000},
+    'language': {'rate': 10.0, 'capacity': 600},
+}
+
+# Adaptive dispatch of the tasks that call each API, see services.throttle.
+# Rates are in tasks per second, starting at `rate` and adjusted between
+# `min_rate` and `max_rate` from the API's responses. The queue.yaml rates
+# are the hard ceiling. Background work gets a share of the rate, and each
+# owner's tasks are dispatched separately so that no one can hog it.
+API_THROTTLES = {
+    'youtube': {'rate': 2.0, 'min_rate': 0.1, 'max_rate': 5.0},
+    'language': {'rate': 2.0, 'min_rate': 0.2, 'max_rate': 10.0},
+}
+
+# Sentiment analysis backend used for projects that dont choose their own.
+# One of 'cloud', 'local' (offline lexicon) or 'hybrid' (local first, with
+# scores closer to neutral than the threshold sent to the cloud)
+SENTIMENT_BACKEND = 'cloud'
+SENTIMENT_HYBRID_THRESHOLD = 0.25
+
 # Oauth2
 GOOGLE_OAUTH2_CLIENT_ID = config.oauth2_client_id
 GOOGLE_OAUTH2_CLIENT_SECRET = config.oauth2_client_secret
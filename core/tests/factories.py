@@ -8,7 +8,7 @@ import pytz
 from factory import fuzzy
 
 from projects.models import Project
-from videos.models import Video, VideoComment
+from videos.models import Video, VideoComment, VideoTranscript
 
 
 class MockCredentials(object):
@@ -70,6 +70,13 @@ class VideoFactory(factory.django.DjangoModelFactory):
         model = Video
 
 
+class VideoTranscriptFactory(factory.django.DjangoModelFactory):
+    video = factory.SubFactory(VideoFactory, has_transcript=True)
+
+    class Meta:
+        model = VideoTranscript
+
+
 class VideoCommentFactory(factory.django.DjangoModelFactory):
     video = factory.SubFactory(VideoFactory)
     published = fuzzy.FuzzyDateTime(
@@ -5,12 +5,17 @@ from django.contrib.staticfiles.views import serve
 
 import session_csrf
 
+from services.views import stats
+
 session_csrf.monkeypatch()
 
 
 urlpatterns = (
+    url(r'^_ah/stats/$', stats, name='stats'),
     url(r'^_ah/', include('djangae.urls')),
     url(r'^accounts/', include('accounts.urls', namespace='accounts')),
+    url(r'^cron/projects/', include('projects.urls', namespace='projects')),
+    url(r'^cron/services/', include('services.urls', namespace='services')),
     url(r'^', include('dashboard.urls', namespace='dashboard'))
 )
 
@@ -1,3 +1,5 @@
+import json
+
 from djangae.test import TestCase
 from django.contrib.auth.models import AnonymousUser
 from django.core.urlresolvers import reverse
@@ -9,7 +11,9 @@ import mock
 from core.tests.factories import (
     AuthenticatedUserFactory,
     ProjectFactory,
-    VideoFactory
+    VideoCommentFactory,
+    VideoFactory,
+    VideoTranscriptFactory
 )
 from dashboard.views import (
     DashboardView,
@@ -18,10 +22,21 @@ from dashboard.views import (
     ProjectUpdateView,
     VideoAddView,
     VideoCommentListView,
+    VideoCommentPageView,
+    VideoCommentResyncView,
     VideoDetailView,
     VideoSearchView,
     VideoTranscriptView
 )
+from services.throttle import BACKGROUND
+from videos.models import VideoComment
+from videos.tasks import youtube_resync_comments
+from videos.utils import (
+    encode_cursor,
+    load_search,
+    save_search,
+    search_result_fields
+)
 
 
 class DashboardViewTestCase(TestCase):
@@ -199,6 +214,36 @@ class ProjectUpdateViewTestCase(TestCase):
         self.assertEqual(project.owner, logged_in_user)
 
 
+def search_result(youtube_id):
+    """
+    Returns a minimal YouTube video resource as returned by search
+    """
+    thumbnail = {'url': 'http://example.com/{}.jpg'.format(youtube_id)}
+    return {
+        'id': youtube_id,
+        'snippet': {
+            'title': youtube_id,
+            'description': '',
+            'publishedAt': '2018-01-01T00:00:00.000Z',
+            'thumbnails': {
+                'default': thumbnail,
+                'medium': thumbnail,
+                'high': thumbnail,
+            },
+        },
+        'statistics': {},
+    }
+
+
+def saved_search(user, project, youtube_ids):
+    """
+    Stores search results for the passed ids, returning their token
+    """
+    return save_search(user.pk, project.pk, [
+        search_result_fields(search_result(youtube_id))
+        for youtube_id in youtube_ids])
+
+
 class VideoSearchViewTestCase(TestCase):
     def setUp(self):
         super(VideoSearchViewTestCase, self).setUp()
@@ -355,13 +400,40 @@ class VideoSearchViewTestCase(TestCase):
             mock_yt.return_value = service
             resp = VideoSearchView.as_view()(request, pk=project.pk)
             self.assertEqual(200, resp.status_code)
-            self.assertEqual(1, len(resp.context_data['formset'].forms))
+            self.assertEqual(1, len(resp.context_data['videos']))
             self.assertEqual(
-                'video1234',
-                resp.context_data['formset'].forms[0].initial['youtube_id'])
+                'video1234', resp.context_data['videos'][0]['youtube_id'])
+            self.assertEqual(9999, resp.context_data['videos'][0]['likes'])
             self.assertNotEqual(
                 existing_video.youtube_id,
-                resp.context_data['formset'].forms[0].initial['youtube_id'])
+                resp.context_data['videos'][0]['youtube_id'])
+
+        # the results are stored under the add form's token
+        token = resp.context_data['add_form'].initial['token']
+        self.assertEqual(
+            resp.context_data['videos'],
+            load_search(token, logged_in_user.pk, project.pk))
+        self.assertEqual(None, load_search(token, logged_in_user.pk, 0))
+
+    def test_post_200_removes_adjacent_existing_videos(self):
+        logged_in_user = AuthenticatedUserFactory()
+        project = ProjectFactory(owner=logged_in_user)
+        VideoFactory(project=project, youtube_id='video1')
+        VideoFactory(project=project, youtube_id='video2')
+        request = self.rf.post(
+            '/project/{}/video/search'.format(project.pk),
+            {'keywords': 'kittens'})
+        request.user = logged_in_user
+        service = mock.Mock()
+        service.search.return_value = [
+            search_result(youtube_id)
+            for youtube_id in ('video1', 'video2', 'video3')]
+        with mock.patch('dashboard.views.youtube.Client') as mock_yt:
+            mock_yt.return_value = service
+            resp = VideoSearchView.as_view()(request, pk=project.pk)
+        self.assertEqual(
+            ['video3'],
+            [v['youtube_id'] for v in resp.context_data['videos']])
 
 
 class VideoAddViewTestCase(TestCase):
@@ -402,48 +474,14 @@ class VideoAddViewTestCase(TestCase):
         project = ProjectFactory(owner=logged_in_user)
         mock_get_user.return_value = logged_in_user
 
+        token = saved_search(
+            logged_in_user, project, ['video1234', 'video5678', 'video9999'])
+
         response = self.client.post(
             reverse('dashboard:video_add', kwargs={'pk': project.pk}), {
-                # management form data
-                'form-TOTAL_FORMS': 2,
-                'form-INITIAL_FORMS': 2,
-                'form-MIN_NUM_FORMS': 0,
-                'form-MAX_NUM_FORMS': 1000,
-                # add these two
-                'form-0-add': True,
-                'form-0-youtube_id': 'video1234',
-                'form-0-name': 'Video 1234',
-                'form-0-published': '2018-05-16 15:30:00',
-                'form-0-description': 'Video 1234 description',
-                'form-0-thumbnail_default': 'http://example.com/default.jpg',
-                'form-0-thumbnail_medium': 'http://example.com/medium.jpg',
-                'form-0-thumbnail_high': 'http://example.com/high.jpg',
-                'form-0-likes': 1,
-                'form-0-dislikes': 1,
-                'form-0-comment_count': 1,
-                'form-1-add': True,
-                'form-1-youtube_id': 'video5678',
-                'form-1-name': 'Video 5678',
-                'form-1-published': '2018-05-16 15:30:00',
-                'form-1-description': 'Video 5678 description',
-                'form-1-thumbnail_default': 'http://example.com/default.jpg',
-                'form-1-thumbnail_medium': 'http://example.com/medium.jpg',
-                'form-1-thumbnail_high': 'http://example.com/high.jpg',
-                'form-1-likes': 1,
-                'form-1-dislikes': 1,
-                'form-1-comment_count': 1,
-                # dont add this one
-                'form-2-add': False,
-                'form-2-youtube_id': 'video9999',
-                'form-2-name': 'Video 9999',
-                'form-2-published': '2018-05-16 15:30:00',
-                'form-2-description': 'Video 9999 description',
-                'form-2-thumbnail_default': 'http://example.com/default.jpg',
-                'form-2-thumbnail_medium': 'http://example.com/medium.jpg',
-                'form-2-thumbnail_high': 'http://example.com/high.jpg',
-                'form-2-likes': 1,
-                'form-2-dislikes': 1,
-                'form-2-comment_count': 1,
+                'token': token,
+                # add these two, but not video9999
+                'youtube_id': ['video1234', 'video5678'],
             })
 
         self.assertEqual(302, response.status_code)
@@ -457,6 +495,51 @@ class VideoAddViewTestCase(TestCase):
         self.assertIn('video5678', video_ids)
         self.assertNotIn('video9999', video_ids)
 
+    @mock.patch('djangae.contrib.gauth.middleware.get_user')
+    def test_post_skips_existing_and_repeated_videos(self, mock_get_user):
+        logged_in_user = AuthenticatedUserFactory()
+        project = ProjectFactory(owner=logged_in_user)
+        VideoFactory(project=project, youtube_id='video1')
+        mock_get_user.return_value = logged_in_user
+        token = saved_search(
+            logged_in_user, project, ['video1', 'video2', 'video2'])
+        response = self.client.post(
+            reverse('dashboard:video_add', kwargs={'pk': project.pk}), {
+                'token': token,
+                'youtube_id': ['video1', 'video2'],
+            })
+        self.assertEqual(302, response.status_code)
+        video_ids = sorted(
+            v.youtube_id for v in VideoFactory._meta.model.objects.filter(
+                project=project))
+        self.assertEqual(['video1', 'video2'], video_ids)
+
+    @mock.patch('djangae.contrib.gauth.middleware.get_user')
+    def test_post_rejects_ids_not_in_search(self, mock_get_user):
+        logged_in_user = AuthenticatedUserFactory()
+        project = ProjectFactory(owner=logged_in_user)
+        mock_get_user.return_value = logged_in_user
+        token = saved_search(logged_in_user, project, ['video1'])
+        self.client.post(
+            reverse('dashboard:video_add', kwargs={'pk': project.pk}), {
+                'token': token,
+                'youtube_id': ['video1', 'video2'],
+            })
+        self.assertFalse(VideoFactory._meta.model.objects.exists())
+
+    @mock.patch('djangae.contrib.gauth.middleware.get_user')
+    def test_post_expired_search(self, mock_get_user):
+        logged_in_user = AuthenticatedUserFactory()
+        project = ProjectFactory(owner=logged_in_user)
+        mock_get_user.return_value = logged_in_user
+        response = self.client.post(
+            reverse('dashboard:video_add', kwargs={'pk': project.pk}), {
+                'token': 'expired',
+                'youtube_id': ['video1'],
+            })
+        self.assertEqual(302, response.status_code)
+        self.assertFalse(VideoFactory._meta.model.objects.exists())
+
 
 class VideoDetailViewTestCase(TestCase):
     def setUp(self):
@@ -493,29 +576,19 @@ class VideoDetailViewTestCase(TestCase):
         logged_in_user = AuthenticatedUserFactory()
         project = ProjectFactory(owner=logged_in_user)
         video = VideoFactory(
-            project=project, owner=logged_in_user,
-            analyzed_transcript={'sentences': [{
-                'sentiment': {
-                    'score': -0.8,
-                    'magnitude': 3.0
-                }
-            }, {
-                'sentiment': {
-                    'score': 0.8,
-                    'magnitude': 3.0
-                }
-            }, {
-                'sentiment': {
-                    'score': 0.0,
-                    'magnitude': 0.0
-                }
-            }]})
+            project=project, owner=logged_in_user, transcript_analyzed=True,
+            transcript_histogram={
+                'positive': 1, 'negative': 1, 'neutral': 1,
+                'distribution': [1, 0, 1, 1]})
         request = self.rf.get('/project/{}/video/view/{}'.format(
             project.pk, video.pk))
         request.user = logged_in_user
         resp = VideoDetailView.as_view()(
             request, project_pk=project.pk, pk=video.pk)
         self.assertEqual(200, resp.status_code)
+        self.assertEqual(
+            {'Positive': 1, 'Negative': 1, 'Neutral': 1},
+            resp.context_data['transcript_chart_data'])
 
 
 class VideoTranscriptViewTestCase(TestCase):
@@ -562,6 +635,30 @@ class VideoTranscriptViewTestCase(TestCase):
         resp = VideoTranscriptView.as_view()(
             request, project_pk=project.pk, pk=video.pk)
         self.assertEqual(200, resp.status_code)
+        self.assertEqual(None, resp.context_data['transcript'])
+
+    def test_200_ok_with_transcript(self):
+        logged_in_user = AuthenticatedUserFactory()
+        project = ProjectFactory(owner=logged_in_user)
+        video = VideoFactory(
+            project=project, owner=logged_in_user, has_transcript=True,
+            transcript_analyzed=True)
+        VideoTranscriptFactory(
+            video=video, text='Hello world!', analysis={
+                'documentSentiment': {'score': 0.5, 'magnitude': 0.5},
+                'sentences': [{
+                    'text': {'content': 'Hello world!', 'beginOffset': 0},
+                    'sentiment': {'score': 0.5, 'magnitude': 0.5},
+                }]})
+        request = self.rf.get(
+            '/project/{}/video/{}/analysis/transcript/'.format(
+                project.pk, video.pk))
+        request.user = logged_in_user
+        resp = VideoTranscriptView.as_view()(
+            request, project_pk=project.pk, pk=video.pk)
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual(
+            'Hello world!', resp.context_data['transcript'].text)
 
 
 class VideoCommentListViewTestCase(TestCase):
@@ -608,3 +705,134 @@ class VideoCommentListViewTestCase(TestCase):
         resp = VideoCommentListView.as_view()(
             request, project_pk=project.pk, pk=video.pk)
         self.assertEqual(200, resp.status_code)
+
+    def test_200_paged_and_filtered(self):
+        logged_in_user = AuthenticatedUserFactory()
+        project = ProjectFactory(owner=logged_in_user)
+        video = VideoFactory(project=project, owner=logged_in_user)
+        for _ in range(3):
+            VideoCommentFactory(
+                video=video, analyzed_comment={'foo': 'bar'}, sentiment=0.5)
+        VideoCommentFactory(
+            video=video, analyzed_comment={'foo': 'bar'}, sentiment=-0.5)
+        request = self.rf.get(
+            '/project/{}/video/{}/analysis/comments/'.format(
+                project.pk, video.pk),
+            {'sentiment': 'positive'})
+        request.user = logged_in_user
+        with mock.patch.object(VideoCommentListView, 'page_size', 2):
+            resp = VideoCommentListView.as_view()(
+                request, project_pk=project.pk, pk=video.pk)
+        self.assertEqual(200, resp.status_code)
+        comments = resp.context_data['object_list']
+        self.assertEqual(2, len(comments))
+        self.assertTrue(all(c.sentiment_label == 'positive' for c in comments))
+        self.assertTrue(resp.context_data['next_cursor'])
+        self.assertEqual('positive', resp.context_data['sentiment'])
+
+
+class VideoCommentPageViewTestCase(TestCase):
+    def setUp(self):
+        super(VideoCommentPageViewTestCase, self).setUp()
+        self.rf = RequestFactory()
+
+    def test_404_logged_in_permission_denied(self):
+        project = ProjectFactory()
+        video = VideoFactory(project=project)
+        request = self.rf.get(
+            '/project/{}/video/{}/analysis/comments/more/'.format(
+                project.pk, video.pk))
+        request.user = AuthenticatedUserFactory()
+        with self.assertRaises(Http404):
+            VideoCommentPageView.as_view()(
+                request, project_pk=project.pk, pk=video.pk)
+
+    def test_400_invalid_cursor(self):
+        logged_in_user = AuthenticatedUserFactory()
+        project = ProjectFactory(owner=logged_in_user)
+        video = VideoFactory(project=project, owner=logged_in_user)
+        request = self.rf.get(
+            '/project/{}/video/{}/analysis/comments/more/?cursor=foo'.format(
+                project.pk, video.pk))
+        request.user = logged_in_user
+        resp = VideoCommentPageView.as_view()(
+            request, project_pk=project.pk, pk=video.pk)
+        self.assertEqual(400, resp.status_code)
+
+    def test_200_next_page(self):
+        logged_in_user = AuthenticatedUserFactory()
+        project = ProjectFactory(owner=logged_in_user)
+        video = VideoFactory(project=project, owner=logged_in_user)
+        for i in range(3):
+            VideoCommentFactory(
+                video=video, comment_raw='Comment {}'.format(i))
+        first_page = VideoComment.objects.filter(video=video)[:1]
+        request = self.rf.get(
+            '/project/{}/video/{}/analysis/comments/more/'.format(
+                project.pk, video.pk),
+            {'cursor': encode_cursor(first_page[0])})
+        request.user = logged_in_user
+        resp = VideoCommentPageView.as_view()(
+            request, project_pk=project.pk, pk=video.pk)
+        self.assertEqual(200, resp.status_code)
+        data = json.loads(resp.content)
+        self.assertEqual(None, data['next_cursor'])
+        self.assertNotIn(first_page[0].comment_raw, data['html'])
+        self.assertEqual(2, data['html'].count('<li'))
+
+
+class VideoCommentResyncViewTestCase(TestCase):
+    def setUp(self):
+        super(VideoCommentResyncViewTestCase, self).setUp()
+        self.rf = RequestFactory()
+
+    def test_302_not_logged_in(self):
+        project = ProjectFactory()
+        video = VideoFactory(project=project)
+        request = self.rf.post(
+            '/project/{}/video/{}/analysis/comments/resync/'.format(
+                project.pk, video.pk))
+        request.user = AnonymousUser()
+        resp = VideoCommentResyncView.as_view()(
+            request, project_pk=project.pk, pk=video.pk)
+        self.assertEqual(resp.status_code, 302)
+
+    def test_404_logged_in_permission_denied(self):
+        project = ProjectFactory()
+        video = VideoFactory(project=project)
+        request = self.rf.post(
+            '/project/{}/video/{}/analysis/comments/resync/'.format(
+                project.pk, video.pk))
+        request.user = AuthenticatedUserFactory()
+        with self.assertRaises(Http404):
+            VideoCommentResyncView.as_view()(
+                request, project_pk=project.pk, pk=video.pk)
+
+    @mock.patch('djangae.contrib.gauth.middleware.get_user')
+    def test_post_302_logged_in(self, mock_get_user):
+        logged_in_user = AuthenticatedUserFactory()
+        project = ProjectFactory(owner=logged_in_user)
+        video = VideoFactory(
+            project=project, owner=logged_in_user, comments_imported=True)
+        mock_get_user.return_value = logged_in_user
+        with mock.patch('dashboard.views.throttle.defer') as mock_defer:
+            response = self.client.post(reverse(
+                'dashboard:video_comment_resync',
+                kwargs={'project_pk': project.pk, 'pk': video.pk}))
+        self.assertEqual(302, response.status_code)
+        mock_defer.assert_called_once_with(
+            'youtube', youtube_resync_comments, video.pk, _queue='comments',
+            _lane=BACKGROUND, _owner=logged_in_user.pk)
+
+    @mock.patch('djangae.contrib.gauth.middleware.get_user')
+    def test_post_import_not_finished(self, mock_get_user):
+        logged_in_user = AuthenticatedUserFactory()
+        project = ProjectFactory(owner=logged_in_user)
+        video = VideoFactory(project=project, owner=logged_in_user)
+        mock_get_user.return_value = logged_in_user
+        with mock.patch('dashboard.views.throttle.defer') as mock_defer:
+            response = self.client.post(reverse(
+                'dashboard:video_comment_resync',
+                kwargs={'project_pk': project.pk, 'pk': video.pk}))
+        self.assertEqual(302, response.status_code)
+        self.assertFalse(mock_defer.called)
@@ -7,6 +7,8 @@ from .views import (
     ProjectUpdateView,
     VideoAddView,
     VideoCommentListView,
+    VideoCommentPageView,
+    VideoCommentResyncView,
     VideoDetailView,
     VideoSearchView,
     VideoTranscriptView
@@ -28,6 +30,10 @@ urlpatterns = (
         VideoDetailView.as_view(), name='video_view'),
     url(r'^project/(?P<project_pk>\d+)/video/(?P<pk>\d+)/analysis/comments/$',
         VideoCommentListView.as_view(), name='video_comment_view'),
+    url(r'^project/(?P<project_pk>\d+)/video/(?P<pk>\d+)/analysis/comments/more/$',
+        VideoCommentPageView.as_view(), name='video_comment_page'),
+    url(r'^project/(?P<project_pk>\d+)/video/(?P<pk>\d+)/analysis/comments/resync/$',
+        VideoCommentResyncView.as_view(), name='video_comment_resync'),
     url(r'^project/(?P<project_pk>\d+)/video/(?P<pk>\d+)/analysis/transcript/$',
         VideoTranscriptView.as_view(), name='video_transcript_view'),
 )
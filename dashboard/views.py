@@ -1,11 +1,15 @@
-import datetime
-
 from djangae.contrib.consistency import improve_queryset_consistency
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.core.urlresolvers import reverse
-from django.http import HttpResponseNotAllowed, HttpResponseRedirect
+from django.http import (
+    HttpResponseBadRequest,
+    HttpResponseNotAllowed,
+    HttpResponseRedirect,
+    JsonResponse
+)
 from django.shortcuts import get_object_or_404
+from django.template.loader import render_to_string
 from django.utils.decorators import method_decorator
 from django.views.generic.base import View
 from django.views.generic.detail import DetailView
@@ -14,9 +18,20 @@ from django.views.generic.list import ListView
 
 from projects.forms import ProjectForm
 from projects.models import Project
-from services import youtube
-from videos.forms import YouTubeVideoFormSet, YouTubeVideoSearchForm
-from videos.models import Video, VideoComment
+from services import throttle, youtube
+from services.quota import QuotaExceeded
+from videos import pipeline
+from videos.forms import YouTubeVideoAddForm, YouTubeVideoSearchForm
+from videos.models import SENTIMENT_LABEL_CHOICES, Video, VideoComment
+from videos.tasks import youtube_resync_comments
+from videos.utils import (
+    create_videos,
+    load_search,
+    page_comments,
+    project_youtube_ids,
+    save_search,
+    search_result_fields
+)
 
 
 class LoginRequiredMixin(object):
@@ -36,23 +51,14 @@ class TranscriptAnalysisChartMixin(object):
     def get_context_data(self, **kwargs):
         context = super(TranscriptAnalysisChartMixin, self).get_context_data(
             **kwargs)
-        positive_count = 0
-        negative_count = 0
-        neutral_count = 0
-        if self.object.analysis_complete:
-            for sentence in self.object.analyzed_transcript['sentences']:
-                if sentence['sentiment']['score'] > 0:
-                    positive_count += 1
-                elif sentence['sentiment']['score'] < 0:
-                    negative_count += 1
-                elif sentence['sentiment']['score'] == 0:
-                    neutral_count += 1
+        # computed when the transcript is analyzed
+        histogram = self.object.transcript_histogram or {}
         context['transcript_chart_headers'] = [
             'Sentiment', 'Percentage of content']
         context['transcript_chart_data'] = {
-            'Positive': positive_count,
-            'Negative': negative_count,
-            'Neutral': neutral_count,
+            'Positive': histogram.get('positive', 0),
+            'Negative': histogram.get('negative', 0),
+            'Neutral': histogram.get('neutral', 0),
         }
         return context
 
@@ -63,16 +69,16 @@ class CommentAnalysisChartMixin(object):
     """
     def get_context_data(self, **kwargs):
         if isinstance(self, VideoCommentListView):
-            qs = self.get_queryset()
+            video = self.video
         else:
-            qs = self.object.videocomment_set.all()
+            video = self.object
         context = super(CommentAnalysisChartMixin, self).get_context_data(
             **kwargs)
         context['comment_chart_headers'] = ['Sentiment', 'Percentage']
         context['comment_chart_data'] = {
-            'Positive': qs.filter(sentiment__gt=0).count(),
-            'Negative': qs.filter(sentiment__lt=0).count(),
-            'Neutral': qs.filter(sentiment=0).count(),
+            'Positive': video.comments_positive,
+            'Negative': video.comments_negative,
+            'Neutral': video.comments_neutral,
         }
         return context
 
@@ -145,6 +151,12 @@ class ProjectDetailView(LoginRequiredMixin, DetailView):
         context['video_search_form'] = YouTubeVideoSearchForm()
         context['videos'] = improve_queryset_consistency(
             self.object.video_set.all())
+        context['comment_chart_headers'] = ['Sentiment', 'Percentage']
+        context['comment_chart_data'] = {
+            'Positive': self.object.comments_positive,
+            'Negative': self.object.comments_negative,
+            'Neutral': self.object.comments_neutral,
+        }
         return context
 
 
@@ -163,69 +175,66 @@ class VideoSearchView(LoginRequiredMixin, FormView):
         project = get_object_or_404(
             Project, pk=self.kwargs['pk'], owner=self.request.user)
         results = youtube.Client().search(form.cleaned_data.get('keywords'))
-        existing_videos = [v.youtube_id for v in Video.objects.filter(
-            project__pk=project.pk)]
+        existing_videos = project_youtube_ids(project.pk)
         context['project'] = project
 
         # remove videos already added to project from results
-        for i, r in enumerate(results):
-            if r['id'] in existing_videos:
-                results.pop(i)
-
-        # construct a formset with the rest of the results data
-        context['formset'] = YouTubeVideoFormSet(initial=[{
-            'youtube_id': result['id'],
-            'published': datetime.datetime.strptime(
-                result['snippet']['publishedAt'],
-                "%Y-%m-%dT%H:%M:%S.%fZ"),
-            'name': result['snippet']['title'],
-            'description': result['snippet']['description'],
-            'thumbnail_default':
-                result['snippet']['thumbnails']['default']['url'],
-            'thumbnail_medium':
-                result['snippet']['thumbnails']['medium']['url'],
-            'thumbnail_high':
-                result['snippet']['thumbnails']['high']['url'],
-            'likes': result['statistics'].get('likeCount', 0),
-            'dislikes': result['statistics'].get('dislikeCount', 0),
-            'comment_count': result['statistics'].get('commentCount', 0),
-            }
-            for result in results
-        ])
+        videos = [
+            search_result_fields(r) for r in results
+            if r['id'] not in existing_videos]
+
+        # the results are kept server side, the add form only posts back the
+        # token they are stored under and the ids of the selected videos
+        token = save_search(self.request.user.pk, project.pk, videos)
+        context['videos'] = videos
+        context['add_form'] = YouTubeVideoAddForm(
+            initial={'token': token}, videos=videos)
         return context
 
     def form_valid(self, form):
-        return self.render_to_response(self.get_context_data(form))
+        try:
+            context = self.get_context_data(form)
+        except QuotaExceeded:
+            messages.error(
+                self.request,
+                'We have used up our YouTube search quota for now! Please '
+                'try again in a few minutes.')
+            return HttpResponseRedirect(reverse(
+                'dashboard:project_view', kwargs={'pk': self.kwargs['pk']}))
+        return self.render_to_response(context)
 
 
 class VideoAddView(LoginRequiredMixin, View):
     def post(self, request, pk):
         """
-        POST only view that validates the formset from the video search view
-        and creates video objects for each item added.
+        POST only view that creates video objects for each video selected
+        from the search results stored by the video search view.
         """
         project = get_object_or_404(
             Project, pk=pk, owner=self.request.user)
-        formset = YouTubeVideoFormSet(request.POST, request.FILES)
-        if formset.is_valid():
-            messages.success(request, 'Videos added succesfully!')
-            for form in formset:
-                if form.cleaned_data.get('add', None):
-                    Video.objects.create(
-                        owner=self.request.user,
-                        project=project,
-                        youtube_id=form.cleaned_data['youtube_id'],
-                        name=form.cleaned_data['name'],
-                        published=form.cleaned_data['published'],
-                        description=form.cleaned_data['description'],
-                        thumbnail_default=form.cleaned_data['thumbnail_default'],
-                        thumbnail_medium=form.cleaned_data['thumbnail_medium'],
-                        thumbnail_high=form.cleaned_data['thumbnail_high'],
-                        likes=form.cleaned_data['likes'],
-                        dislikes=form.cleaned_data['dislikes'],
-                        comment_count=form.cleaned_data['comment_count'])
-        return HttpResponseRedirect(reverse(
+        redirect = HttpResponseRedirect(reverse(
             'dashboard:project_view', kwargs={'pk': project.pk}))
+        videos = load_search(
+            request.POST.get('token', ''), request.user.pk, project.pk)
+        if videos is None:
+            messages.error(
+                request,
+                'Your search results have expired! Please search again.')
+            return redirect
+        form = YouTubeVideoAddForm(request.POST, videos=videos)
+        if form.is_valid():
+            messages.success(request, 'Videos added succesfully!')
+            selected = set(form.cleaned_data['youtube_id'])
+            existing_videos = project_youtube_ids(project.pk)
+            added = []
+            for video in videos:
+                youtube_id = video['youtube_id']
+                if youtube_id not in selected or youtube_id in existing_videos:
+                    continue
+                existing_videos.add(youtube_id)
+                added.append(video)
+            create_videos(self.request.user, project, added)
+        return redirect
 
 
 class VideoDetailView(
@@ -243,14 +252,13 @@ class VideoDetailView(
                 project=self.kwargs['project_pk'], owner=self.request.user))
 
 
-class VideoCommentListView(
-        LoginRequiredMixin, CommentAnalysisChartMixin, ListView):
-    model = VideoComment
-    template_name = 'video_comments.html'
-
-    def get_queryset(self):
-        return improve_queryset_consistency(
-            self.model.objects.filter(video=self.video))
+class VideoCommentPageMixin(object):
+    """
+    Mixin for views listing a page of a video's comments. Pages are fixed
+    size, optionally filtered by sentiment label, and follow on from the
+    comment marked by the `cursor` query parameter.
+    """
+    page_size = 50
 
     def pre_checks(self):
         """
@@ -261,13 +269,97 @@ class VideoCommentListView(
         self.video = get_object_or_404(
             Video, pk=self.kwargs['pk'], project=self.project)
 
+    def get_sentiment(self):
+        sentiment = self.request.GET.get('sentiment')
+        if sentiment in dict(SENTIMENT_LABEL_CHOICES):
+            return sentiment
+        return None
+
+    def get_queryset(self):
+        qs = VideoComment.objects.filter(video=self.video)
+        sentiment = self.get_sentiment()
+        if sentiment:
+            qs = qs.filter(sentiment_label=sentiment)
+        return qs
+
+    def get_page(self):
+        """
+        Returns the requested page of comments and the cursor of the next.
+        Raises ValueError if the cursor isnt valid.
+        """
+        return page_comments(
+            self.get_queryset(), self.request.GET.get('cursor'),
+            self.page_size)
+
+
+class VideoCommentListView(
+        LoginRequiredMixin, CommentAnalysisChartMixin, VideoCommentPageMixin,
+        ListView):
+    model = VideoComment
+    template_name = 'video_comments.html'
+
     def get_context_data(self, **kwargs):
+        try:
+            comments, next_cursor = self.get_page()
+        except ValueError:
+            # start over from the first page
+            comments, next_cursor = page_comments(
+                self.get_queryset(), page_size=self.page_size)
+        kwargs['object_list'] = comments
         context = super(VideoCommentListView, self).get_context_data(**kwargs)
         context['project'] = self.project
         context['video'] = self.video
+        context['next_cursor'] = next_cursor
+        context['sentiment'] = self.get_sentiment()
+        context['sentiment_choices'] = SENTIMENT_LABEL_CHOICES
         return context
 
 
+class VideoCommentPageView(
+        LoginRequiredMixin, VideoCommentPageMixin, View):
+    def get(self, request, project_pk, pk):
+        """
+        Returns the next page of a video's comments as JSON, with the
+        comments rendered as list rows, for the comment list's load more
+        button.
+        """
+        try:
+            comments, next_cursor = self.get_page()
+        except ValueError:
+            return HttpResponseBadRequest('Invalid cursor')
+        return JsonResponse({
+            'html': render_to_string(
+                'includes/comment_rows.html', {'comments': comments},
+                request=request),
+            'next_cursor': next_cursor,
+        })
+
+
+class VideoCommentResyncView(LoginRequiredMixin, View):
+    def post(self, request, project_pk, pk):
+        """
+        POST only view that queues a resync of a video's comments, picking up
+        anything new or edited since the last import.
+        """
+        video = get_object_or_404(
+            Video, pk=pk, project=project_pk, owner=self.request.user)
+        redirect = HttpResponseRedirect(reverse(
+            'dashboard:video_comment_view',
+            kwargs={'project_pk': video.project_id, 'pk': video.pk}))
+        if not video.comments_imported:
+            messages.error(
+                request,
+                'We are still importing the comments for this video! Please '
+                'try again once they are in.')
+            return redirect
+        pipeline.start(video.pk, 1)
+        throttle.defer(
+            'youtube', youtube_resync_comments, video.pk, _queue='comments',
+            _lane=throttle.BACKGROUND, _owner=video.owner_id)
+        messages.success(request, 'Refreshing comments for this video!')
+        return redirect
+
+
 class VideoTranscriptView(
         LoginRequiredMixin, TranscriptAnalysisChartMixin, DetailView):
     """
@@ -280,3 +372,11 @@ class VideoTranscriptView(
         return improve_queryset_consistency(
             self.model.objects.filter(
                 project=self.kwargs['project_pk'], owner=self.request.user))
+
+    def get_context_data(self, **kwargs):
+        context = super(VideoTranscriptView, self).get_context_data(**kwargs)
+        # the only view that needs the transcript and its analysis
+        transcript = self.object.get_transcript()
+        context['transcript'] = transcript
+        context['analysis'] = transcript.analysis if transcript else None
+        return context
@@ -1,6 +1,12 @@
 from django.contrib.auth import get_user_model
 from django.db import models
 
+SENTIMENT_BACKEND_CHOICES = (
+    ('cloud', 'Cloud Natural Language'),
+    ('local', 'Offline lexicon'),
+    ('hybrid', 'Offline lexicon, with Cloud for borderline scores'),
+)
+
 
 class Project(models.Model):
     """
@@ -11,9 +17,43 @@ class Project(models.Model):
     name = models.CharField(max_length=255)
     created = models.DateTimeField(auto_now_add=True)
     modified = models.DateTimeField(auto_now=True)
+    # blank uses the deployment wide SENTIMENT_BACKEND setting
+    sentiment_backend = models.CharField(
+        max_length=10, choices=SENTIMENT_BACKEND_CHOICES, blank=True)
+    # sentiment summary of the project's videos and comments, maintained as
+    # analysis completes, see projects.utils.update_project_summary
+    thumbnail = models.CharField(max_length=255, blank=True)
+    video_count = models.PositiveIntegerField(default=0)
+    videos_analyzed = models.PositiveIntegerField(default=0)
+    sentiment_sum = models.FloatField(default=0)
+    weighted_sentiment_sum = models.FloatField(default=0)
+    magnitude_sum = models.FloatField(default=0)
+    comments_total = models.PositiveIntegerField(default=0)
+    comments_positive = models.PositiveIntegerField(default=0)
+    comments_negative = models.PositiveIntegerField(default=0)
+    comments_neutral = models.PositiveIntegerField(default=0)
+    comments_failed = models.PositiveIntegerField(default=0)
 
     def __unicode__(self):
         return u'{}'.format(self.name)
 
+    @property
+    def sentiment(self):
+        """
+        Mean transcript sentiment of the project's analyzed videos
+        """
+        if not self.videos_analyzed:
+            return None
+        return self.sentiment_sum / self.videos_analyzed
+
+    @property
+    def weighted_sentiment(self):
+        """
+        Mean transcript sentiment weighted by the magnitude of each video
+        """
+        if not self.magnitude_sum:
+            return self.sentiment
+        return self.weighted_sentiment_sum / self.magnitude_sum
+
     class Meta:
         ordering = ['-created']
@@ -0,0 +1,60 @@
+import logging
+from collections import Counter
+
+from djangae.db import transaction
+
+from google.appengine.ext import deferred
+
+from .utils import apply_summary_counts, transcript_summary
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_FIELDS = (
+    'video_count', 'videos_analyzed', 'sentiment_sum',
+    'weighted_sentiment_sum', 'magnitude_sum', 'comments_total',
+    'comments_positive', 'comments_negative', 'comments_neutral',
+    'comments_failed')
+
+
+def rebuild_project_summary(project_pk):
+    """
+    Recalculates a project's summary from its videos, correcting any drift
+    in the incrementally maintained values. Comment figures are taken from
+    the counters on each video so comments themselves are never loaded,
+    less any changes to them still waiting to be rolled up.
+    """
+    from videos.models import Video  # avoid circular imports
+    from .models import Project
+    counts = Counter()
+    thumbnail = ''
+    for video in Video.objects.filter(project=project_pk):
+        thumbnail = thumbnail or video.thumbnail_high
+        counts['video_count'] += 1
+        counts.update(transcript_summary(video))
+        pending = video.comment_counts_pending or {}
+        for field in SUMMARY_FIELDS:
+            if field.startswith('comments_'):
+                counts[field] += getattr(video, field) - pending.get(field, 0)
+    with transaction.atomic():
+        try:
+            project = Project.objects.get(pk=project_pk)
+        except Project.DoesNotExist:
+            logger.info(
+                'Project %r no longer exists! Cant rebuild summary',
+                project_pk)
+            return
+        for field in SUMMARY_FIELDS:
+            setattr(project, field, 0)
+        apply_summary_counts(project, counts)
+        project.thumbnail = thumbnail
+        project.save(update_fields=SUMMARY_FIELDS + ('thumbnail',))
+
+
+def rebuild_project_summaries():
+    """
+    Queues a summary rebuild for every project
+    """
+    from .models import Project  # avoid circular imports
+    for project_pk in Project.objects.values_list('pk', flat=True):
+        deferred.defer(
+            rebuild_project_summary, project_pk, _queue='summaries')
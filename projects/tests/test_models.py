@@ -8,3 +8,14 @@ class ProjectModelTestCase(TestCase):
     def test_unicode_method(self):
         project = ProjectFactory.create(name=u'象は鼻が長')
         self.assertEqual(project.__unicode__(), u'象は鼻が長')
+
+    def test_sentiment_properties(self):
+        project = ProjectFactory()
+        self.assertEqual(None, project.sentiment)
+        self.assertEqual(None, project.weighted_sentiment)
+        project.videos_analyzed = 2
+        project.sentiment_sum = 0.4
+        project.weighted_sentiment_sum = 1.6
+        project.magnitude_sum = 4.0
+        self.assertAlmostEqual(0.2, project.sentiment)
+        self.assertAlmostEqual(0.4, project.weighted_sentiment)
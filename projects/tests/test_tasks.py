@@ -0,0 +1,55 @@
+from collections import Counter
+
+from djangae.test import TestCase
+
+import mock
+
+from core.tests.factories import ProjectFactory, VideoFactory
+from projects.tasks import rebuild_project_summaries, rebuild_project_summary
+from projects.utils import update_project_summary
+
+
+class RebuildProjectSummaryTestCase(TestCase):
+    def test_project_does_not_exist(self):
+        resp = rebuild_project_summary(9999)
+        self.assertEqual(None, resp)
+
+    def test_ok(self):
+        project = ProjectFactory()
+        VideoFactory(
+            project=project, sentiment=0.5, magnitude=2.0,
+            transcript_analyzed=True, thumbnail_high='foo.jpg',
+            comments_total=3, comments_positive=2, comments_failed=1)
+        VideoFactory(
+            project=project, sentiment=-0.5, magnitude=1.0,
+            transcript_analyzed=True,
+            comments_total=1, comments_negative=1)
+        # changes still to be rolled up arent counted yet
+        VideoFactory(
+            project=project, comments_total=2, comments_neutral=2,
+            comment_counts_pending={
+                'comments_total': 2, 'comments_neutral': 2})
+        # drift the summary away from the videos
+        update_project_summary(project.pk, Counter(
+            video_count=5, comments_neutral=10, sentiment_sum=3.0))
+        rebuild_project_summary(project.pk)
+        project.refresh_from_db()
+        self.assertEqual(3, project.video_count)
+        self.assertEqual(2, project.videos_analyzed)
+        self.assertAlmostEqual(0.0, project.sentiment)
+        self.assertAlmostEqual(0.5 / 3.0, project.weighted_sentiment)
+        self.assertEqual(4, project.comments_total)
+        self.assertEqual(2, project.comments_positive)
+        self.assertEqual(1, project.comments_negative)
+        self.assertEqual(0, project.comments_neutral)
+        self.assertEqual(1, project.comments_failed)
+        self.assertTrue(project.thumbnail)
+
+    def test_rebuild_all(self):
+        project_1 = ProjectFactory()
+        project_2 = ProjectFactory()
+        with mock.patch('projects.tasks.deferred.defer') as mock_defer:
+            rebuild_project_summaries()
+        self.assertEqual(
+            sorted([project_1.pk, project_2.pk]),
+            sorted(c[0][1] for c in mock_defer.call_args_list))
@@ -0,0 +1,29 @@
+from djangae.test import TestCase
+from django.test import RequestFactory
+
+import mock
+
+from projects.tasks import rebuild_project_summaries
+from projects.views import rebuild_summaries
+
+
+class RebuildSummariesViewTestCase(TestCase):
+    def setUp(self):
+        super(RebuildSummariesViewTestCase, self).setUp()
+        self.rf = RequestFactory()
+
+    def test_403_not_cron(self):
+        request = self.rf.get('/cron/projects/summaries/rebuild/')
+        with mock.patch('projects.views.deferred.defer') as mock_defer:
+            resp = rebuild_summaries(request)
+        self.assertEqual(403, resp.status_code)
+        self.assertFalse(mock_defer.called)
+
+    def test_200_cron(self):
+        request = self.rf.get(
+            '/cron/projects/summaries/rebuild/', HTTP_X_APPENGINE_CRON='true')
+        with mock.patch('projects.views.deferred.defer') as mock_defer:
+            resp = rebuild_summaries(request)
+        self.assertEqual(200, resp.status_code)
+        mock_defer.assert_called_once_with(
+            rebuild_project_summaries, _queue='summaries')
@@ -0,0 +1,8 @@
+from django.conf.urls import url
+
+from .views import rebuild_summaries
+
+urlpatterns = (
+    url(r'^summaries/rebuild/$',
+        rebuild_summaries, name='rebuild_summaries'),
+)
@@ -0,0 +1,60 @@
+from collections import Counter
+
+from djangae.db import transaction
+
+from accounts.utils import do_with_retry
+
+
+def transcript_summary(video):
+    """
+    Returns a Counter of what the passed video's transcript analysis
+    contributes to its project's summary.
+    """
+    if not video.analysis_complete:
+        return Counter()
+    return Counter({
+        'videos_analyzed': 1,
+        'sentiment_sum': video.sentiment,
+        'weighted_sentiment_sum': video.sentiment * video.magnitude,
+        'magnitude_sum': video.magnitude,
+    })
+
+
+def apply_summary_counts(project, counts):
+    """
+    Adds a Counter of deltas to the summary fields of the passed (unsaved)
+    project and returns the names of the fields that changed.
+    """
+    fields = []
+    for field, delta in counts.items():
+        if field is None or not delta:
+            continue
+        value = getattr(project, field) + delta
+        if isinstance(value, (int, long)):
+            value = max(0, value)
+        setattr(project, field, value)
+        fields.append(field)
+    return fields
+
+
+def _update_project_summary(project_pk, counts, thumbnail):
+    from .models import Project  # avoid circular imports
+    with transaction.atomic():
+        try:
+            project = Project.objects.get(pk=project_pk)
+        except Project.DoesNotExist:
+            return
+        fields = apply_summary_counts(project, counts)
+        if thumbnail and not project.thumbnail:
+            project.thumbnail = thumbnail
+            fields.append('thumbnail')
+        if fields:
+            project.save(update_fields=fields)
+
+
+def update_project_summary(project_pk, counts, thumbnail=None):
+    """
+    Applies a Counter of deltas to the summary on a project in a single
+    transaction, optionally setting its thumbnail if it doesnt have one.
+    """
+    do_with_retry(_update_project_summary, project_pk, counts, thumbnail)
@@ -0,0 +1,16 @@
+from django.http import HttpResponse, HttpResponseForbidden
+
+from google.appengine.ext import deferred
+
+from .tasks import rebuild_project_summaries
+
+
+def rebuild_summaries(request):
+    """
+    Cron handler that queues a rebuild of every project's summary
+    """
+    # App Engine strips this header from requests that dont come from cron
+    if not request.META.get('HTTP_X_APPENGINE_CRON'):
+        return HttpResponseForbidden()
+    deferred.defer(rebuild_project_summaries, _queue='summaries')
+    return HttpResponse('OK')
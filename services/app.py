@@ -3,3 +3,11 @@ from django.apps import AppConfig
 
 class ServicesConfig(AppConfig):
     name = 'services'
+
+    def ready(self):
+        from . import cloudnlp, metrics, registry, youtube
+        metrics.install_datastore_hooks()
+        registry.preload([
+            (youtube.API_NAME, youtube.API_VERSION),
+            (cloudnlp.API_NAME, cloudnlp.API_VERSION),
+        ])
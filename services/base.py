@@ -0,0 +1,19 @@
+class SentimentBackend(object):
+    """
+    Interface shared by the sentiment analysis backends. Results are returned
+    in the shape of a Cloud Natural Language `analyzeSentiment` response, ie.
+    a dict with `documentSentiment`, `language` and `sentences` keys.
+    """
+    def analyze_sentiment(self, text, lang='en', ctype='PLAIN_TEXT'):
+        """
+        Performs sentiment analysis on a single piece of text
+        """
+        raise NotImplementedError
+
+    def analyze_sentiment_batch(self, texts, lang='en'):
+        """
+        Performs sentiment analysis on a list of texts, returning a list of
+        results in the same order. Backends that cant analyze a text as part
+        of a batch return None in its place.
+        """
+        return [self.analyze_sentiment(text, lang) for text in texts]
@@ -0,0 +1,324 @@
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils import timezone
+
+from google.appengine.api import memcache
+from google.appengine.ext import deferred
+
+from . import throttle
+from .models import CachedAnalysis
+from .tasks import MAX_IN_VALUES
+
+logger = logging.getLogger(__name__)
+
+HITS_KEY = 'analysis-cache:hits'
+MISSES_KEY = 'analysis-cache:misses'
+WHITESPACE_RE = re.compile(r'\s+', re.UNICODE)
+# expired CachedAnalysis entries deleted per purge task
+PURGE_BATCH_SIZE = 500
+PURGE_QUEUE = throttle.lane_queue('analyze', throttle.BACKGROUND)
+
+
+def normalize(text):
+    """
+    Normalizes text so that trivially different copies of the same content
+    share a cache entry.
+    """
+    text = unicodedata.normalize('NFC', text or u'')
+    return WHITESPACE_RE.sub(u' ', text).strip()
+
+
+def expiry_cutoff():
+    """
+    Returns the time before which durable cache entries have expired
+    """
+    return timezone.now() - timezone.timedelta(
+        seconds=settings.CLOUD_NATURAL_LANG_CACHE_EXPIRY)
+
+
+def purge_cached_analyses():
+    """
+    Deletes the expired CachedAnalysis entries, a batch per task. Run daily
+    by cron, as entries are otherwise only deleted when they are read.
+    """
+    expired = CachedAnalysis.objects.filter(created__lt=expiry_cutoff())
+    pks = list(expired.values_list('pk', flat=True)[:PURGE_BATCH_SIZE])
+    for i in range(0, len(pks), MAX_IN_VALUES):
+        CachedAnalysis.objects.filter(
+            pk__in=pks[i:i + MAX_IN_VALUES]).delete()
+    if len(pks) == PURGE_BATCH_SIZE:
+        deferred.defer(purge_cached_analyses, _queue=PURGE_QUEUE)
+
+
+class AnalysisCache(object):
+    """
+    Caches sentiment analysis results by a hash of the normalized content,
+    language and API version. Results are held in memcache (which evicts
+    least recently used entries itself) in front of a durable datastore copy
+    that expires after `CLOUD_NATURAL_LANG_CACHE_EXPIRY` seconds. Texts
+    longer than `CLOUD_NATURAL_LANG_CACHE_MAX_LENGTH` characters arent
+    cached.
+    """
+    def __init__(self, version, namespace='analysis'):
+        self.version = version
+        self.namespace = namespace
+
+    def make_key(self, text, lang, ctype='PLAIN_TEXT'):
+        """
+        Returns the cache key for the passed content
+        """
+        content = u'\x00'.join([
+            self.version, lang, ctype, normalize(text)])
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def cacheable(self, text):
+        """
+        Returns whether the analysis of the passed text is cached
+        """
+        return len(text or u'') <= settings.CLOUD_NATURAL_LANG_CACHE_MAX_LENGTH
+
+    def get(self, text, lang, ctype='PLAIN_TEXT'):
+        """
+        Returns the cached analysis for the passed content or None
+        """
+        return self.get_many([text], lang, ctype)[0]
+
+    def get_many(self, texts, lang, ctype='PLAIN_TEXT'):
+        """
+        Returns a list of cached analyses for the passed texts, with None for
+        each text that isnt cached.
+        """
+        keys = [
+            self.make_key(t, lang, ctype) if self.cacheable(t) else None
+            for t in texts]
+        lookups = [k for k in keys if k is not None]
+        if not lookups:
+            return [None] * len(texts)
+        found = memcache.get_multi(lookups, namespace=self.namespace)
+        missing = [k for k in set(lookups) if k not in found]
+        if missing:
+            expiry = expiry_cutoff()
+            durable = {}
+            for entry in CachedAnalysis.objects.filter(pk__in=missing):
+                if entry.created < expiry:
+                    entry.delete()
+                    continue
+                durable[entry.pk] = entry.analysis
+            if durable:
+                memcache.set_multi(
+                    durable, namespace=self.namespace,
+                    time=settings.CLOUD_NATURAL_LANG_CACHE_TIMEOUT)
+                found.update(durable)
+        results = [found.get(k) for k in keys]
+        hits = len([r for r in results if r is not None])
+        if hits:
+            memcache.incr(
+                HITS_KEY, hits, namespace=self.namespace, initial_value=0)
+        if len(lookups) - hits:
+            memcache.incr(
+                MISSES_KEY, len(lookups) - hits, namespace=self.namespace,
+                initial_value=0)
+        return results
+
+    def set(self, text, lang, analysis, ctype='PLAIN_TEXT'):
+        """
+        Stores the analysis for the passed content in both cache layers
+        """
+        self.set_many([(text, analysis)], lang, ctype)
+
+    def set_many(self, items, lang, ctype='PLAIN_TEXT'):
+        """
+        Stores a list of (text, analysis) pairs in both cache layers
+        """
+        entries = dict(
+            (self.make_key(text, lang, ctype), analysis)
+            for text, analysis in items
+            if analysis is not None and self.cacheable(text))
+        if not entries:
+            return
+        memcache.set_multi(
+            entries, namespace=self.namespace,
+            time=settings.CLOUD_NATURAL_LANG_CACHE_TIMEOUT)
+        for key, analysis in entries.items():
+            try:
+                CachedAnalysis(pk=key, analysis=analysis).save()
+            except Exception:
+                # the durable layer is best effort, we have the result anyway
+                logger.exception('Error caching analysis %r', key)
+
+    def stats(self):
+        """
+        Returns the hit and miss counters for the cache
+        """
+        counters = memcache.get_multi(
+            [HITS_KEY, MISSES_KEY], namespace=self.namespace)
+        hits = int(counters.get(HITS_KEY, 0))
+        misses = int(counters.get(MISSES_KEY, 0))
+        total = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': float(hits) / total if total else 0.0,
+        }
+
+
+class _Flight(object):
+    """
+    An upstream call in progress that other threads can wait on
+    """
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+
+
+class ResponseCache(object):
+    """
+    Caches API responses for `timeout` seconds in two tiers, an in-process
+    LRU of up to `max_entries` responses in front of memcache. Concurrent
+    requests for the same uncached response are coalesced so that only one
+    of them calls upstream. Threads of this instance wait on the thread
+    making the call, other instances wait for its result to land in memcache
+    (up to `wait_timeout` seconds) before giving up and calling themselves.
+    """
+    POLL_INTERVAL = 0.05
+
+    def __init__(
+            self, namespace, timeout, max_entries=256, wait_timeout=10):
+        self.namespace = namespace
+        self.timeout = timeout
+        self.max_entries = max_entries
+        self.wait_timeout = wait_timeout
+        self._entries = OrderedDict()
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def make_key(self, *parts):
+        """
+        Returns the cache key for the passed request parameters
+        """
+        return hashlib.sha256(json.dumps(parts)).hexdigest()
+
+    def get(self, key):
+        """
+        Returns a tuple of the cached response for the key, or None if it
+        isnt cached. The tuple lets empty responses be cached too.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and entry[0] > now:
+                # move to the most recently used end
+                self._entries[key] = entry
+                return entry[1],
+        cached = memcache.get(key, namespace=self.namespace)
+        if cached is not None:
+            self._set_local(key, cached[0])
+        return cached
+
+    def set(self, key, value):
+        """
+        Stores a response in both tiers
+        """
+        self._set_local(key, value)
+        memcache.set(
+            key, (value,), time=self.timeout, namespace=self.namespace)
+
+    def _set_local(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() + self.timeout, value)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Drops every response held in this instance
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def get_or_call(self, parts, func, cost=0):
+        """
+        Returns the cached response for the request parameters `parts`,
+        calling `func` to fetch it if it isnt cached. `cost` is the quota a
+        call would use and is counted as saved on every hit.
+        """
+        key = self.make_key(*parts)
+        cached = self.get(key)
+        if cached is not None:
+            self.record(True, cost)
+            return cached[0]
+
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            flight.event.wait(self.wait_timeout)
+            if flight.result is not None:
+                self.record(True, cost)
+                return flight.result[0]
+            # the call failed or is taking too long, make our own
+            return self._call(key, func, cost)
+        try:
+            value = self._call(key, func, cost)
+            flight.result = (value,)
+            return value
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.event.set()
+
+    def _call(self, key, func, cost):
+        lock_key = key + ':lock'
+        if not memcache.add(
+                lock_key, 1, time=self.wait_timeout,
+                namespace=self.namespace):
+            # another instance is making this call, wait for its result
+            deadline = time.time() + self.wait_timeout
+            while time.time() < deadline:
+                time.sleep(self.POLL_INTERVAL)
+                cached = memcache.get(key, namespace=self.namespace)
+                if cached is not None:
+                    self._set_local(key, cached[0])
+                    self.record(True, cost)
+                    return cached[0]
+        try:
+            value = func()
+            self.set(key, value)
+        finally:
+            memcache.delete(lock_key, namespace=self.namespace)
+        self.record(False, cost)
+        return value
+
+    def record(self, hit, cost):
+        counters = {'hits': 1, 'saved_units': cost} if hit else {'misses': 1}
+        memcache.offset_multi(
+            counters, namespace=self.namespace + ':stats', initial_value=0)
+
+    def stats(self):
+        """
+        Returns the hit and miss counters for the cache and the quota units
+        its hits have saved
+        """
+        counters = memcache.get_multi(
+            ['hits', 'misses', 'saved_units'],
+            namespace=self.namespace + ':stats')
+        hits = int(counters.get('hits', 0))
+        misses = int(counters.get('misses', 0))
+        total = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': float(hits) / total if total else 0.0,
+            'saved_units': int(counters.get('saved_units', 0)),
+        }
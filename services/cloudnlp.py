@@ -1,29 +1,159 @@
 from django.conf import settings
 
-from googleapiclient import discovery
+from . import quota, registry, throttle
+from .base import SentimentBackend
+from .cache import AnalysisCache
 
+API_NAME = 'language'
+API_VERSION = 'v1'
 
-class Client(object):
+# Texts packed into a batch document are each terminated with a full stop (if
+# they dont already end a sentence) and separated by a blank line so that the
+# API always starts a new sentence at the start of each one.
+BATCH_SEPARATOR = u'\n\n'
+SENTENCE_TERMINATORS = (u'.', u'!', u'?')
+BATCH_MAX_BYTES = 50000
+
+
+def char_offset(encoded, offset):
+    """
+    Converts a byte offset into UTF-8 encoded text into a character offset
+    """
+    return len(encoded[:offset].decode('utf-8', 'ignore'))
+
+
+class Client(SentimentBackend):
     """
     Wrapper around the cloud natural language API
     """
-    def __init__(self, service=None):
+    def __init__(self, service=None, cache=True):
         if service is None:  # pragma: no cover
-            service = discovery.build(
-                'language', 'v1',
-                developerKey=settings.CLOUD_NATURAL_LANG_API_KEY)
+            service = registry.get_service(
+                API_NAME, API_VERSION, settings.CLOUD_NATURAL_LANG_API_KEY)
         self.service = service
+        self.cache = AnalysisCache(API_VERSION) if cache else None
 
     def analyze_sentiment(self, text, lang='en', ctype='PLAIN_TEXT'):
         """
         Takes a string and performs setiment anaylsis on it using google's
-        cloud service
+        cloud service. Results are served from the analysis cache where the
+        same content has been analyzed before. Sentence offsets are returned
+        as character offsets into the text.
         """
-        results = self.service.documents().analyzeSentiment(body={
-            'document': {
-                'language': lang,
-                'content': text,
-                'type': ctype,
-            }
-        }).execute()
+        if self.cache is not None:
+            results = self.cache.get(text, lang, ctype)
+            if results is not None:
+                return results
+        quota.acquire(API_NAME, 'documents.analyzeSentiment')
+        results = throttle.execute(
+            API_NAME, 'documents.analyzeSentiment',
+            self.service.documents().analyzeSentiment(body={
+                'document': {
+                    'language': lang,
+                    'content': text,
+                    'type': ctype,
+                },
+                'encodingType': 'UTF32',
+            }))
+        if self.cache is not None:
+            self.cache.set(text, lang, results, ctype)
         return results
+
+    def analyze_sentiment_batch(
+            self, texts, lang='en', max_bytes=BATCH_MAX_BYTES):
+        """
+        Performs sentiment analysis on a list of short texts, packing as many
+        of them as fit within `max_bytes` into each API call and splitting the
+        sentence level results back out per text. Returns a list of results
+        in the same order and shape as `analyze_sentiment`. Texts that could
+        not be split cleanly out of the batch are returned as None so that the
+        caller can fall back to analysing them individually.
+        """
+        if self.cache is not None:
+            results = self.cache.get_many(texts, lang)
+        else:
+            results = [None] * len(texts)
+        # duplicate texts within the batch are only sent once
+        duplicates = {}
+        pending = []
+        batch = []
+        size = 0
+        for index, text in enumerate(texts):
+            chunk = (text or u'').strip()
+            if not chunk or results[index] is not None:
+                continue
+            if chunk in duplicates:
+                duplicates[chunk].append(index)
+                continue
+            duplicates[chunk] = []
+            pending.append(index)
+            if not chunk.endswith(SENTENCE_TERMINATORS):
+                chunk += u'.'
+            length = len(chunk.encode('utf-8'))
+            if batch and size + length > max_bytes:
+                self._analyze_batch(batch, lang, results)
+                batch = []
+                size = 0
+            batch.append((index, chunk, size, size + length))
+            size += length + len(BATCH_SEPARATOR.encode('utf-8'))
+        if batch:
+            self._analyze_batch(batch, lang, results)
+        for index in pending:
+            for duplicate in duplicates[texts[index].strip()]:
+                results[duplicate] = results[index]
+        if self.cache is not None:
+            self.cache.set_many(
+                [(texts[index], results[index]) for index in pending], lang)
+        return results
+
+    def _analyze_batch(self, batch, lang, results):
+        """
+        Analyzes a single packed document and fills in `results` for each
+        text in the batch whose sentences fall entirely within its own byte
+        range of the document.
+        """
+        quota.acquire(API_NAME, 'documents.analyzeSentiment')
+        analysis = throttle.execute(
+            API_NAME, 'documents.analyzeSentiment',
+            self.service.documents().analyzeSentiment(body={
+                'document': {
+                    'language': lang,
+                    'content': BATCH_SEPARATOR.join(
+                        c for _, c, _, _ in batch),
+                    'type': 'PLAIN_TEXT',
+                },
+                'encodingType': 'UTF8',
+            }))
+        sentences = analysis.get('sentences', [])
+        position = 0
+        for index, chunk, begin, end in batch:
+            matched = []
+            while position < len(sentences) and \
+                    sentences[position]['text']['beginOffset'] < end:
+                matched.append(sentences[position])
+                position += 1
+            if not matched or matched[0]['text']['beginOffset'] != begin:
+                continue
+            last = matched[-1]['text']
+            if last['beginOffset'] + len(
+                    last['content'].encode('utf-8')) > end:
+                continue
+            # offsets come back in bytes, convert them back to characters
+            encoded = chunk.encode('utf-8')
+            scores = [s['sentiment']['score'] for s in matched]
+            results[index] = {
+                'documentSentiment': {
+                    'score': sum(scores) / len(scores),
+                    'magnitude': sum(
+                        s['sentiment']['magnitude'] for s in matched),
+                },
+                'language': analysis.get('language', lang),
+                'sentences': [{
+                    'text': {
+                        'content': s['text']['content'],
+                        'beginOffset': char_offset(
+                            encoded, s['text']['beginOffset'] - begin),
+                    },
+                    'sentiment': s['sentiment'],
+                } for s in matched],
+            }
@@ -0,0 +1,168 @@
+import io
+import os
+import re
+
+import numpy as np
+
+from .base import SentimentBackend
+
+LEXICON_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'data', 'lexicon.tsv')
+
+# the valence table uses a -4 to +4 scale, scores are normalized into -1 to 1
+# as score / sqrt(score^2 + ALPHA) the same way VADER does
+MAX_VALENCE = 4.0
+ALPHA = 15.0
+NEGATION_SCALAR = -0.74
+NEGATION_WINDOW = 3
+EXCLAMATION_BOOST = 0.292
+MAX_EXCLAMATIONS = 4
+NEGATIONS = frozenset([
+    u'not', u'no', u'never', u'none', u'nothing', u'nobody', u'neither',
+    u'nor', u'cannot', u'without'])
+BOOSTERS = {
+    u'very': 0.293, u'really': 0.293, u'so': 0.293, u'extremely': 0.293,
+    u'absolutely': 0.293, u'totally': 0.293, u'incredibly': 0.293,
+    u'completely': 0.293, u'most': 0.293, u'slightly': -0.293,
+    u'somewhat': -0.293, u'kinda': -0.293, u'barely': -0.293,
+}
+SENTENCE_RE = re.compile(r'[^.!?\n]+[.!?]*|[.!?]+', re.UNICODE)
+TOKEN_RE = re.compile(r"[\w']+|!", re.UNICODE)
+
+_lexicon = None
+
+
+def get_lexicon():
+    """
+    Loads the token to valence table, returning a tuple of a dict mapping each
+    token to its row and a NumPy array of the valences. The table is loaded
+    once per instance.
+    """
+    global _lexicon
+    if _lexicon is None:
+        index = {}
+        valences = []
+        with io.open(LEXICON_PATH, encoding='utf-8') as f:
+            for line in f:
+                if not line.strip() or line.startswith(u'#'):
+                    continue
+                token, valence = line.split(u'\t')
+                index[token] = len(valences)
+                valences.append(float(valence))
+        _lexicon = (index, np.array(valences, dtype=np.float64))
+    return _lexicon
+
+
+def split_sentences(text):
+    """
+    Splits text into a list of (begin offset, sentence) tuples. Offsets are
+    character offsets into the passed text.
+    """
+    sentences = []
+    for match in SENTENCE_RE.finditer(text or u''):
+        sentence = match.group()
+        stripped = sentence.lstrip()
+        if not stripped.strip():
+            continue
+        offset = match.start() + len(sentence) - len(stripped)
+        sentences.append((offset, stripped.rstrip()))
+    return sentences
+
+
+class Client(SentimentBackend):
+    """
+    Offline, rule based sentiment analysis using a bundled English lexicon.
+    Returns results in the same shape as the Cloud Natural Language API so it
+    can stand in for `services.cloudnlp.Client`.
+    """
+    def __init__(self):
+        self.index, self.valences = get_lexicon()
+
+    def analyze_sentiment(self, text, lang='en', ctype='PLAIN_TEXT'):
+        """
+        Performs sentiment analysis on a single piece of text
+        """
+        return self.analyze_sentiment_batch([text], lang)[0]
+
+    def analyze_sentiment_batch(self, texts, lang='en'):
+        """
+        Performs sentiment analysis on a list of texts, scoring every sentence
+        of every text in one vectorized pass over the valence table.
+        """
+        documents = [split_sentences(text) for text in texts]
+        sentences = [s for document in documents for _, s in document]
+        scores, magnitudes = self.score_sentences(sentences)
+        results = []
+        position = 0
+        for document in documents:
+            count = len(document)
+            document_scores = scores[position:position + count]
+            document_magnitudes = magnitudes[position:position + count]
+            position += count
+            results.append({
+                'documentSentiment': {
+                    'score': round(float(document_scores.mean()), 3)
+                    if count else 0.0,
+                    'magnitude': round(float(document_magnitudes.sum()), 3),
+                },
+                'language': lang,
+                'sentences': [{
+                    'text': {
+                        'content': sentence,
+                        'beginOffset': offset,
+                    },
+                    'sentiment': {
+                        'score': round(float(score), 3),
+                        'magnitude': round(float(magnitude), 3),
+                    },
+                } for (offset, sentence), score, magnitude in zip(
+                    document, document_scores, document_magnitudes)],
+            })
+        return results
+
+    def score_sentences(self, sentences):
+        """
+        Returns NumPy arrays of the score and magnitude of each sentence.
+        Negations and boosters are resolved while tokenizing, everything else
+        is done with array operations over all sentences at once.
+        """
+        rows = []
+        owners = []
+        weights = []
+        exclamations = np.zeros(len(sentences))
+        for owner, sentence in enumerate(sentences):
+            negate = 0
+            boost = 0.0
+            for token in TOKEN_RE.findall(sentence.lower()):
+                if token == u'!':
+                    exclamations[owner] += 1
+                    continue
+                if token in NEGATIONS or token.endswith(u"n't"):
+                    negate = NEGATION_WINDOW
+                    continue
+                if token in BOOSTERS:
+                    boost += BOOSTERS[token]
+                    continue
+                row = self.index.get(token)
+                if row is not None:
+                    rows.append(row)
+                    owners.append(owner)
+                    weights.append(
+                        (1.0 + boost) * (NEGATION_SCALAR if negate else 1.0))
+                boost = 0.0
+                negate = max(0, negate - 1)
+
+        if not rows:
+            # older NumPy cant bincount an empty array
+            return np.zeros(len(sentences)), np.zeros(len(sentences))
+        valence = self.valences[np.array(rows, dtype=np.intp)] * np.array(
+            weights, dtype=np.float64)
+        owners = np.array(owners, dtype=np.intp)
+        totals = np.bincount(owners, weights=valence, minlength=len(sentences))
+        intensity = np.bincount(
+            owners, weights=np.abs(valence), minlength=len(sentences))
+        totals += np.sign(totals) * np.minimum(
+            exclamations, MAX_EXCLAMATIONS) * EXCLAMATION_BOOST
+        scores = totals / np.sqrt(totals ** 2 + ALPHA)
+        magnitudes = intensity / MAX_VALENCE
+        return scores, magnitudes
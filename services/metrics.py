@@ -0,0 +1,287 @@
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from djangae import environment
+from django.conf import settings
+
+from google.appengine.api import apiproxy_stub_map, memcache
+
+logger = logging.getLogger(__name__)
+
+NAMES_KEY = 'names'
+CAS_ATTEMPTS = 5
+# upper bounds, in milliseconds, of the latency histogram buckets. Anything
+# slower lands in the overflow bucket.
+BUCKETS = (
+    5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+OVERFLOW = 'inf'
+HOOK_NAME = 'metrics'
+
+_recorder = None
+
+
+def bucket_for(ms):
+    """
+    Returns the label of the histogram bucket the passed latency falls in
+    """
+    for bound in BUCKETS:
+        if ms <= bound:
+            return str(bound)
+    return OVERFLOW
+
+
+def percentile(buckets, count, fraction):
+    """
+    Returns the upper bound of the bucket the passed fraction of `count`
+    observations falls within, clamped to the largest bucket.
+    """
+    target = count * fraction
+    seen = 0
+    for bound in BUCKETS:
+        seen += buckets.get(str(bound), 0)
+        if seen >= target:
+            return bound
+    return BUCKETS[-1]
+
+
+def current_version():
+    """
+    Returns the version of the app that is running, so that each deploy
+    starts its counters afresh
+    """
+    return os.environ.get('CURRENT_VERSION_ID', '').split('.')[0]
+
+
+def size(value):
+    return len(value) if isinstance(value, basestring) else 0
+
+
+class Recorder(object):
+    """
+    Records call counts, latency histograms and other counters. Counters are
+    buffered in process and added to counters in memcache, shared by every
+    instance, at most every `interval` seconds. Memcache cant list its keys
+    so the names of the metrics are kept in an index alongside them.
+    """
+    def __init__(self, namespace, interval):
+        self.namespace = namespace
+        self.interval = interval
+        self._counters = Counter()
+        self._flushed = time.time()
+        self._lock = threading.Lock()
+
+    def incr(self, name, field, value=1):
+        """
+        Adds `value` to the `field` counter of the named metric
+        """
+        with self._lock:
+            self._counters[(name, field)] += value
+        self.maybe_flush()
+
+    def timing(self, name, ms, error=False, **counts):
+        """
+        Records a call to the named metric that took `ms` milliseconds, along
+        with any other counts for it such as the bytes it sent
+        """
+        ms = int(round(ms))
+        with self._lock:
+            self._counters[(name, 'count')] += 1
+            self._counters[(name, 'ms')] += ms
+            self._counters[(name, 'le:' + bucket_for(ms))] += 1
+            if error:
+                self._counters[(name, 'errors')] += 1
+            for field, value in counts.items():
+                self._counters[(name, field)] += value
+        self.maybe_flush()
+
+    def maybe_flush(self):
+        if time.time() - self._flushed >= self.interval:
+            self.flush()
+
+    def flush(self):
+        """
+        Adds the buffered counters to the counters in memcache
+        """
+        with self._lock:
+            counters, self._counters = self._counters, Counter()
+            self._flushed = time.time()
+        offsets = dict(
+            ('{}|{}'.format(name, field), value)
+            for (name, field), value in counters.items() if value)
+        if not offsets:
+            return
+        try:
+            results = memcache.offset_multi(
+                offsets, namespace=self.namespace, initial_value=0)
+        except Exception:
+            # metrics are best effort, never fail the caller over them
+            logger.exception('Error flushing metrics')
+            return
+        failed = [k for k, v in results.items() if v is None]
+        if failed:
+            logger.warning('Unable to flush %s metric counters', len(failed))
+        self.index(set(name for name, _ in counters))
+
+    def index(self, names):
+        """
+        Adds the passed metric names to the index, unless they are already in
+        it. The index is checked on every flush since memcache may have
+        evicted it.
+        """
+        client = memcache.Client()
+        for _ in range(CAS_ATTEMPTS):
+            indexed = client.gets(NAMES_KEY, namespace=self.namespace)
+            if indexed is None:
+                if client.add(
+                        NAMES_KEY, sorted(names), namespace=self.namespace):
+                    break
+                continue
+            if names.issubset(indexed):
+                break
+            if client.cas(
+                    NAMES_KEY, sorted(names.union(indexed)),
+                    namespace=self.namespace):
+                break
+        else:
+            logger.warning('Unable to index metrics %r', sorted(names))
+
+    def stats(self):
+        """
+        Returns the counters in memcache, by metric name. Metrics with
+        timings also get their mean and approximate 50th, 90th and 99th
+        percentile latencies, in milliseconds.
+        """
+        names = memcache.get(NAMES_KEY, namespace=self.namespace) or []
+        fields = ['count', 'ms', 'errors', 'bytes_in', 'bytes_out', 'units',
+                  'throttled', 'backoffs', 'le:' + OVERFLOW]
+        fields += ['le:{}'.format(bound) for bound in BUCKETS]
+        counters = memcache.get_multi(
+            ['{}|{}'.format(n, f) for n in names for f in fields],
+            namespace=self.namespace)
+        stats = {}
+        for name in names:
+            values = {}
+            buckets = {}
+            for field in fields:
+                value = counters.get('{}|{}'.format(name, field))
+                if value is None:
+                    continue
+                if field.startswith('le:'):
+                    buckets[field[3:]] = int(value)
+                else:
+                    values[field] = int(value)
+            count = values.get('count')
+            if count:
+                values['buckets'] = buckets
+                values['mean_ms'] = round(
+                    float(values.get('ms', 0)) / count, 1)
+                for label, fraction in (
+                        ('p50_ms', 0.5), ('p90_ms', 0.9), ('p99_ms', 0.99)):
+                    values[label] = percentile(buckets, count, fraction)
+            stats[name] = values
+        return stats
+
+
+def get_recorder(version=None):
+    """
+    Returns the recorder for the passed app version, by default the instance
+    wide recorder of the running version
+    """
+    global _recorder
+    if version is not None and version != current_version():
+        return Recorder(
+            'metrics-' + version, settings.METRICS_FLUSH_INTERVAL)
+    if _recorder is None:
+        _recorder = Recorder(
+            'metrics-' + current_version(), settings.METRICS_FLUSH_INTERVAL)
+    return _recorder
+
+
+@contextmanager
+def timed(name):
+    """
+    Context manager recording the time its block takes against the named
+    metric. It yields a dict that the block can add other counts to.
+    """
+    counts = {}
+    started = time.time()
+    error = False
+    try:
+        yield counts
+    except Exception:
+        error = True
+        raise
+    finally:
+        get_recorder().timing(
+            name, (time.time() - started) * 1000, error=error, **counts)
+
+
+def execute(api, method, request):
+    """
+    Executes a Google API request, recording its latency and the bytes sent
+    and received against the method
+    """
+    with timed('api:{}.{}'.format(api, method)) as counts:
+        counts['bytes_out'] = size(getattr(request, 'uri', None)) + size(
+            getattr(request, 'body', None))
+        postproc = getattr(request, 'postproc', None)
+        if callable(postproc):
+            def measure(resp, content):
+                counts['bytes_in'] = size(content)
+                return postproc(resp, content)
+            request.postproc = measure
+        return request.execute()
+
+
+def record_queue_lag(queue):
+    """
+    Records how long the running task waited in its queue past its ETA
+    """
+    eta = os.environ.get('HTTP_X_APPENGINE_TASKETA')
+    if not eta:
+        return
+    try:
+        lag = time.time() - float(eta)
+    except ValueError:
+        return
+    get_recorder().timing(
+        'queue:' + (environment.task_queue_name() or queue),
+        max(0, lag) * 1000)
+
+
+def _datastore_pre_call(service, call, request, response, rpc=None):
+    if rpc is not None:
+        rpc.metrics_started = time.time()
+
+
+def _datastore_post_call(
+        service, call, request, response, rpc=None, error=None):
+    started = getattr(rpc, 'metrics_started', None)
+    if started is None:
+        return
+    try:
+        counts = {
+            'bytes_out': request.ByteSize(),
+            'bytes_in': response.ByteSize() if error is None else 0,
+        }
+    except Exception:
+        counts = {}
+    get_recorder().timing(
+        'datastore:' + call, (time.time() - started) * 1000,
+        error=error is not None, **counts)
+
+
+def install_datastore_hooks():
+    """
+    Hooks into the datastore API to record the latency and size of every
+    datastore call
+    """
+    apiproxy = apiproxy_stub_map.apiproxy
+    apiproxy.GetPreCallHooks().Append(
+        HOOK_NAME, _datastore_pre_call, 'datastore_v3')
+    apiproxy.GetPostCallHooks().Append(
+        HOOK_NAME, _datastore_post_call, 'datastore_v3')
@@ -0,0 +1,49 @@
+from djangae.fields import JSONField
+from django.db import models
+
+
+class CachedAnalysis(models.Model):
+    """
+    Durable copy of a sentiment analysis result, keyed by a hash of the
+    analyzed content. Sits beneath the memcache layer in `services.cache`.
+    """
+    key = models.CharField(max_length=64, primary_key=True)
+    analysis = JSONField()
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __unicode__(self):
+        return u'{}'.format(self.key)
+
+
+class QuotaBucket(models.Model):
+    """
+    Datastore copy of an API quota token bucket, used by `services.quota`
+    when memcache is unavailable.
+    """
+    name = models.CharField(max_length=100, primary_key=True)
+    tokens = models.FloatField(default=0)
+    updated = models.FloatField(default=0)
+
+    def __unicode__(self):
+        return u'{}'.format(self.name)
+
+
+class DeadLetter(models.Model):
+    """
+    A deferred task that failed with a permanent error, or ran out of
+    retries, kept so that it can be looked into and replayed with
+    `services.tasks.replay`.
+    """
+    task = models.CharField(max_length=255)
+    queue = models.CharField(max_length=100)
+    args = JSONField()
+    kwargs = JSONField(blank=True, null=True)
+    # the error class, see services.tasks.classify
+    kind = models.CharField(max_length=10)
+    error = models.TextField()
+    attempts = models.PositiveIntegerField(default=1)
+    created = models.DateTimeField(auto_now_add=True)
+    replayed = models.DateTimeField(blank=True, null=True)
+
+    def __unicode__(self):
+        return u'{}: {}'.format(self.task, self.error)
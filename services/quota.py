@@ -0,0 +1,123 @@
+import logging
+import math
+import time
+
+from djangae.db import transaction
+from django.conf import settings
+
+from google.appengine.api import memcache
+
+from . import metrics
+from .models import QuotaBucket
+
+logger = logging.getLogger(__name__)
+
+# quota units charged for each API method we call
+COSTS = {
+    'youtube': {
+        'search.list': 100,
+        'videos.list': 1,
+        'commentThreads.list': 1,
+    },
+    'language': {
+        'documents.analyzeSentiment': 1,
+    },
+}
+CAS_ATTEMPTS = 5
+NAMESPACE = 'quota'
+
+
+class QuotaExceeded(Exception):
+    """
+    Raised when an API call would exceed the available quota. `retry_after`
+    is the number of seconds until enough quota will be available.
+    """
+    def __init__(self, api, method, retry_after):
+        self.api = api
+        self.method = method
+        self.retry_after = retry_after
+        super(QuotaExceeded, self).__init__(
+            'Quota exceeded for {} {}, retry after {}s'.format(
+                api, method, retry_after))
+
+
+class TokenBucket(object):
+    """
+    Token bucket shared by every instance of the app. Tokens refill at `rate`
+    per second up to `capacity`. The bucket lives in memcache, updated with
+    compare and set, and falls back to a datastore entity updated in a
+    transaction if memcache cant be used.
+    """
+    def __init__(self, name, rate, capacity):
+        self.name = name
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+
+    def refill(self, tokens, updated, now):
+        return min(self.capacity, tokens + (now - updated) * self.rate)
+
+    def take(self, tokens, units):
+        """
+        Returns the tokens left after taking `units` and the number of seconds
+        to wait before trying again if there arent enough.
+        """
+        if tokens >= units:
+            return tokens - units, 0
+        return tokens, int(math.ceil((units - tokens) / self.rate))
+
+    def consume(self, units):
+        """
+        Takes `units` tokens from the bucket, returning 0 if they were
+        available or the number of seconds until they will be otherwise.
+        """
+        now = time.time()
+        client = memcache.Client()
+        for _ in range(CAS_ATTEMPTS):
+            state = client.gets(self.name, namespace=NAMESPACE)
+            if state is None:
+                tokens, wait = self.take(self.capacity, units)
+                if client.add(
+                        self.name, (tokens, now), namespace=NAMESPACE):
+                    return wait
+                continue
+            tokens = self.refill(state[0], state[1], now)
+            tokens, wait = self.take(tokens, units)
+            if client.cas(self.name, (tokens, now), namespace=NAMESPACE):
+                return wait
+        logger.warning(
+            'Unable to update quota bucket %r in memcache! Using datastore',
+            self.name)
+        return self.consume_durable(units, now)
+
+    def consume_durable(self, units, now):
+        with transaction.atomic():
+            try:
+                bucket = QuotaBucket.objects.get(pk=self.name)
+                tokens = self.refill(bucket.tokens, bucket.updated, now)
+            except QuotaBucket.DoesNotExist:
+                bucket = QuotaBucket(pk=self.name)
+                tokens = self.capacity
+            bucket.tokens, wait = self.take(tokens, units)
+            bucket.updated = now
+            bucket.save()
+        return wait
+
+
+def get_bucket(api):
+    """
+    Returns the token bucket for the passed API
+    """
+    limits = settings.API_QUOTAS[api]
+    return TokenBucket(api, limits['rate'], limits['capacity'])
+
+
+def acquire(api, method):
+    """
+    Charges the quota cost of calling `method` on `api`, raising
+    QuotaExceeded if there isnt enough quota left.
+    """
+    wait = get_bucket(api).consume(COSTS[api][method])
+    if wait:
+        metrics.get_recorder().incr('quota:' + api, 'throttled')
+        raise QuotaExceeded(api, method, wait)
+    metrics.get_recorder().incr('quota:' + api, 'units', COSTS[api][method])
@@ -0,0 +1,101 @@
+import json
+import logging
+import os
+import threading
+
+import httplib2
+from googleapiclient import discovery
+from googleapiclient.errors import HttpError
+
+logger = logging.getLogger(__name__)
+
+# discovery documents are downloaded into this directory by ./install_deps so
+# that they are deployed with the app
+DISCOVERY_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'discovery')
+HTTP_TIMEOUT = 30
+
+_documents = {}
+_lock = threading.Lock()
+_local = threading.local()
+
+
+def discovery_path(api, version):
+    """
+    Returns the path of the bundled discovery document for the passed API
+    """
+    return os.path.join(DISCOVERY_DIR, '{}.{}.json'.format(api, version))
+
+
+def load_discovery_document(api, version):
+    """
+    Loads and parses the discovery document for the passed API, reading the
+    copy bundled with the app if there is one.
+    """
+    path = discovery_path(api, version)
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    logger.warning(
+        'No bundled discovery document for %s %s! Fetching it', api, version)
+    url = discovery.DISCOVERY_URI.format(api=api, apiVersion=version)
+    resp, content = httplib2.Http(timeout=HTTP_TIMEOUT).request(url)
+    if resp.status >= 400:
+        raise HttpError(resp, content, uri=url)
+    return json.loads(content)
+
+
+def get_discovery_document(api, version):
+    """
+    Returns the parsed discovery document for the passed API. Documents are
+    loaded once per instance and shared between threads.
+    """
+    key = (api, version)
+    document = _documents.get(key)
+    if document is None:
+        with _lock:
+            document = _documents.get(key)
+            if document is None:
+                document = load_discovery_document(api, version)
+                _documents[key] = document
+    return document
+
+
+def get_service(api, version, developer_key):
+    """
+    Returns an API service object for the passed API. httplib2 connections
+    arent thread safe so each thread builds its service object once, from the
+    shared discovery document, and reuses it (and its connection) for every
+    call it makes afterwards.
+    """
+    services = getattr(_local, 'services', None)
+    if services is None:
+        services = _local.services = {}
+    key = (api, version, developer_key)
+    service = services.get(key)
+    if service is None:
+        service = discovery.build_from_document(
+            get_discovery_document(api, version),
+            developerKey=developer_key,
+            http=httplib2.Http(timeout=HTTP_TIMEOUT))
+        services[key] = service
+    return service
+
+
+def preload(apis):
+    """
+    Parses the bundled discovery documents for the passed (api, version)
+    pairs ahead of the first request that needs them.
+    """
+    for api, version in apis:
+        if os.path.exists(discovery_path(api, version)):
+            get_discovery_document(api, version)
+
+
+def clear():
+    """
+    Drops the cached discovery documents and this thread's service objects
+    """
+    with _lock:
+        _documents.clear()
+    _local.services = {}
@@ -0,0 +1,59 @@
+from django.conf import settings
+
+from . import cloudnlp, lexicon
+from .base import SentimentBackend
+
+
+class HybridClient(SentimentBackend):
+    """
+    Analyzes text with the local lexicon first and only sends it to the Cloud
+    Natural Language API when the local score is too close to neutral to
+    trust.
+    """
+    def __init__(self, local=None, cloud=None, threshold=None):
+        if threshold is None:
+            threshold = settings.SENTIMENT_HYBRID_THRESHOLD
+        self.local = local or lexicon.Client()
+        self._cloud = cloud
+        self.threshold = threshold
+
+    @property
+    def cloud(self):
+        # the cloud client is only built if something is borderline
+        if self._cloud is None:
+            self._cloud = cloudnlp.Client()
+        return self._cloud
+
+    def is_borderline(self, analysis):
+        return abs(analysis['documentSentiment']['score']) < self.threshold
+
+    def analyze_sentiment(self, text, lang='en', ctype='PLAIN_TEXT'):
+        analysis = self.local.analyze_sentiment(text, lang, ctype)
+        if self.is_borderline(analysis):
+            return self.cloud.analyze_sentiment(text, lang, ctype)
+        return analysis
+
+    def analyze_sentiment_batch(self, texts, lang='en'):
+        results = self.local.analyze_sentiment_batch(texts, lang)
+        borderline = [
+            i for i, analysis in enumerate(results)
+            if analysis is None or self.is_borderline(analysis)]
+        if borderline:
+            analyses = self.cloud.analyze_sentiment_batch(
+                [texts[i] for i in borderline], lang)
+            for i, analysis in zip(borderline, analyses):
+                results[i] = analysis
+        return results
+
+
+def get_client(backend=None):
+    """
+    Returns a client for the named sentiment backend, falling back to the
+    deployment wide `SENTIMENT_BACKEND` setting.
+    """
+    backend = backend or settings.SENTIMENT_BACKEND
+    if backend == 'local':
+        return lexicon.Client()
+    if backend == 'hybrid':
+        return HybridClient()
+    return cloudnlp.Client()
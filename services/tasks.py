@@ -0,0 +1,231 @@
+import datetime
+import httplib
+import json
+import logging
+import random
+import socket
+from functools import wraps
+
+from djangae import environment
+from django.conf import settings
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+import httplib2
+import pytz
+from googleapiclient.errors import HttpError
+
+from google.appengine.api import datastore_errors, taskqueue
+from google.appengine.ext import deferred
+from google.appengine.ext.deferred.deferred import (
+    _DEFAULT_URL,
+    _TASKQUEUE_HEADERS,
+    serialize
+)
+from google.appengine.runtime import apiproxy_errors
+
+from . import metrics, throttle
+from .models import DeadLetter
+from .quota import QuotaExceeded
+
+logger = logging.getLogger(__name__)
+
+# datastore limit on the number of values in an __in filter
+MAX_IN_VALUES = 30
+
+# error classes, see classify
+TRANSIENT = 'transient'
+QUOTA = 'quota'
+PERMANENT = 'permanent'
+
+TRANSIENT_STATUSES = frozenset([408, 500, 502, 503, 504])
+TRANSIENT_REASONS = frozenset(['backendError', 'internalError'])
+# daily quotas reset at midnight Pacific time, the others are per minute or
+# per 100 seconds
+DAILY_QUOTA_REASONS = frozenset(['quotaExceeded', 'dailyLimitExceeded'])
+QUOTA_REASONS = DAILY_QUOTA_REASONS | frozenset([
+    'rateLimitExceeded', 'userRateLimitExceeded', 'RESOURCE_EXHAUSTED'])
+QUOTA_TIMEZONE = pytz.timezone('America/Los_Angeles')
+RATE_LIMIT_WINDOW = 100
+TRANSIENT_ERRORS = (
+    socket.error,
+    httplib.HTTPException,
+    httplib2.HttpLib2Error,
+    apiproxy_errors.DeadlineExceededError,
+    datastore_errors.InternalError,
+    datastore_errors.Timeout,
+    datastore_errors.TransactionFailedError,
+)
+
+
+def error_reasons(exc):
+    """
+    Returns the set of error reasons in the body of a Google API HttpError
+    """
+    try:
+        error = json.loads(exc.content)['error']
+    except (TypeError, ValueError, KeyError):
+        return set()
+    reasons = set(e.get('reason') for e in error.get('errors', []))
+    if error.get('status'):
+        reasons.add(error['status'])
+    return reasons
+
+
+def classify(exc):
+    """
+    Classifies an error raised by a task as TRANSIENT (worth retrying
+    shortly), QUOTA (worth retrying once there is quota again) or PERMANENT.
+    """
+    if isinstance(exc, QuotaExceeded):
+        return QUOTA
+    if isinstance(exc, HttpError):
+        reasons = error_reasons(exc)
+        if exc.resp.status == 429 or reasons & QUOTA_REASONS:
+            return QUOTA
+        if exc.resp.status in TRANSIENT_STATUSES:
+            return TRANSIENT
+        if reasons & TRANSIENT_REASONS:
+            return TRANSIENT
+        return PERMANENT
+    if isinstance(exc, TRANSIENT_ERRORS):
+        return TRANSIENT
+    return PERMANENT
+
+
+def quota_delay(exc, now=None):
+    """
+    Returns the number of seconds until the quota a QUOTA error ran out of
+    should be available again
+    """
+    if isinstance(exc, QuotaExceeded):
+        return exc.retry_after
+    if error_reasons(exc) & DAILY_QUOTA_REASONS:
+        now = now or timezone.now()
+        today = now.astimezone(QUOTA_TIMEZONE).date()
+        tomorrow = today + datetime.timedelta(days=1)
+        midnight = QUOTA_TIMEZONE.localize(
+            datetime.datetime.combine(tomorrow, datetime.time()))
+        return int((midnight - now).total_seconds()) + 1
+    return RATE_LIMIT_WINDOW
+
+
+def backoff_delay(attempt):
+    """
+    Returns a jittered exponential backoff, in seconds, for retrying after
+    the passed attempt
+    """
+    delay = min(
+        settings.TASK_RETRY_MAX_DELAY,
+        settings.TASK_RETRY_BASE_DELAY * 2 ** (attempt - 1))
+    return random.uniform(delay / 2.0, delay)
+
+
+def task(queue, on_failure=None):
+    """
+    Decorator for deferred tasks running on the passed queue. Errors the task
+    raises are classified: transient errors are retried with a jittered
+    exponential backoff up to `TASK_RETRY_ATTEMPTS` times, and quota errors
+    are retried once the quota is available again. Permanent errors, and
+    transient ones that run out of attempts, are stored as a DeadLetter and
+    `on_failure` is called with the task's arguments so that it can record
+    the failure. Retries stay on the queue of the lane the task is running
+    in. The task's wall time and queue lag are recorded in
+    `services.metrics`.
+    """
+    def decorator(func):
+        name = 'task:{}.{}'.format(func.__module__, func.__name__)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            attempt = kwargs.pop('_attempt', 1)
+            running = environment.task_queue_name() or queue
+            metrics.record_queue_lag(queue)
+            try:
+                with metrics.timed(name):
+                    return func(*args, **kwargs)
+            except Exception as e:
+                kind = classify(e)
+                if kind == QUOTA:
+                    delay = quota_delay(e)
+                    logger.info(
+                        '%s. Deferring %s for %ss', e, func.__name__, delay)
+                    deferred.defer(
+                        wrapper, *args, _attempt=attempt, _countdown=delay,
+                        _queue=running, **kwargs)
+                    return
+                if kind == TRANSIENT and \
+                        attempt < settings.TASK_RETRY_ATTEMPTS:
+                    delay = backoff_delay(attempt)
+                    logger.warning(
+                        '%r running %s (attempt %s), retrying in %ss',
+                        e, func.__name__, attempt, delay)
+                    deferred.defer(
+                        wrapper, *args, _attempt=attempt + 1,
+                        _countdown=delay, _queue=running, **kwargs)
+                    return
+                logger.exception(
+                    'Error running %s (attempt %s), giving up',
+                    func.__name__, attempt)
+                DeadLetter.objects.create(
+                    task='{}.{}'.format(func.__module__, func.__name__),
+                    queue=queue, args=list(args), kwargs=kwargs, kind=kind,
+                    error=repr(e), attempts=attempt)
+                if on_failure is not None:
+                    on_failure(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def defer_batch(
+        calls, queue, api=None, lane=throttle.INTERACTIVE, owner=None):
+    """
+    Defers a list of (func, args) or (func, args, kwargs) calls onto the
+    passed queue's copy for the lane, adding their tasks asynchronously in
+    batches of up to `taskqueue.MAX_TASKS_PER_ADD`. Tasks that call an `api`
+    are spread over the owner's next dispatch slots, see
+    `services.throttle`. Returns the RPCs of the adds.
+    """
+    queue = throttle.lane_queue(queue, lane)
+    controller = throttle.get_controller(api) if api else None
+    if controller is not None and calls:
+        countdowns = controller.schedule(len(calls), lane, owner)
+    else:
+        countdowns = [0] * len(calls)
+    tasks = []
+    for call, countdown in zip(calls, countdowns):
+        func, args = call[:2]
+        kwargs = call[2] if len(call) > 2 else {}
+        tasks.append(taskqueue.Task(
+            payload=serialize(func, *args, **kwargs), url=_DEFAULT_URL,
+            headers=_TASKQUEUE_HEADERS, countdown=countdown))
+    step = taskqueue.MAX_TASKS_PER_ADD
+    return [
+        taskqueue.Queue(queue).add_async(tasks[i:i + step])
+        for i in range(0, len(tasks), step)]
+
+
+def replay(dead_letters):
+    """
+    Queues the tasks of the passed DeadLetters (a queryset or list) to run
+    again from their first attempt, as background work with one batched add
+    per queue, and marks them as replayed. DeadLetters that have already
+    been replayed are skipped. Returns the number of tasks queued.
+    """
+    dead_letters = [d for d in dead_letters if d.replayed is None]
+    queues = {}
+    for dead_letter in dead_letters:
+        queues.setdefault(dead_letter.queue, []).append((
+            import_string(dead_letter.task), dead_letter.args,
+            dead_letter.kwargs or {}))
+    rpcs = []
+    for queue, calls in queues.items():
+        rpcs += defer_batch(calls, queue, lane=throttle.BACKGROUND)
+    for rpc in rpcs:
+        rpc.get_result()
+    pks = [d.pk for d in dead_letters]
+    now = timezone.now()
+    for i in range(0, len(pks), MAX_IN_VALUES):
+        DeadLetter.objects.filter(
+            pk__in=pks[i:i + MAX_IN_VALUES]).update(replayed=now)
+    return len(dead_letters)
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+import threading
+
+from djangae.test import TestCase
+from django.test import RequestFactory, override_settings
+from django.utils import timezone
+
+import mock
+
+from google.appengine.api import memcache
+
+from services import cache
+from services.cache import AnalysisCache, ResponseCache, normalize
+from services.models import CachedAnalysis
+from services.views import purge_analysis_cache
+
+MOCK_ANALYSIS = {
+    'documentSentiment': {
+        'score': 0.8,
+        'magnitude': 0.8
+    }
+}
+
+
+class AnalysisCacheTestCase(TestCase):
+    def setUp(self):
+        super(AnalysisCacheTestCase, self).setUp()
+        self.cache = AnalysisCache('v1')
+
+    def test_normalize(self):
+        self.assertEqual(u'first !', normalize(u'  first \n\t!  '))
+        self.assertEqual(u'', normalize(None))
+
+    def test_make_key(self):
+        key = self.cache.make_key(u'First!', 'en')
+        self.assertEqual(key, self.cache.make_key(u' First!\n', 'en'))
+        self.assertNotEqual(key, self.cache.make_key(u'First!', 'fr'))
+        self.assertNotEqual(
+            key, AnalysisCache('v2').make_key(u'First!', 'en'))
+
+    def test_get_set(self):
+        self.assertEqual(None, self.cache.get(u'象は鼻が長', 'en'))
+        self.cache.set(u'象は鼻が長', 'en', MOCK_ANALYSIS)
+        self.assertEqual(MOCK_ANALYSIS, self.cache.get(u'象は鼻が長', 'en'))
+        self.assertEqual(1, CachedAnalysis.objects.count())
+        self.assertEqual(
+            {'hits': 1, 'misses': 1, 'hit_rate': 0.5}, self.cache.stats())
+
+    def test_datastore_layer(self):
+        self.cache.set(u'First!', 'en', MOCK_ANALYSIS)
+        memcache.flush_all()
+        self.assertEqual(MOCK_ANALYSIS, self.cache.get(u'First!', 'en'))
+
+    @override_settings(CLOUD_NATURAL_LANG_CACHE_EXPIRY=60)
+    def test_datastore_layer_expired(self):
+        self.cache.set(u'First!', 'en', MOCK_ANALYSIS)
+        CachedAnalysis.objects.update(
+            created=timezone.now() - timezone.timedelta(seconds=120))
+        memcache.flush_all()
+        self.assertEqual(None, self.cache.get(u'First!', 'en'))
+        self.assertEqual(0, CachedAnalysis.objects.count())
+
+    def test_get_many(self):
+        self.cache.set(u'First!', 'en', MOCK_ANALYSIS)
+        self.assertEqual(
+            [MOCK_ANALYSIS, None, MOCK_ANALYSIS],
+            self.cache.get_many([u'First!', u'Second!', u'First!'], 'en'))
+
+    @override_settings(CLOUD_NATURAL_LANG_CACHE_MAX_LENGTH=6)
+    def test_too_long(self):
+        self.cache.set_many(
+            [(u'First!', MOCK_ANALYSIS), (u'Second!', MOCK_ANALYSIS)], 'en')
+        self.assertEqual(1, CachedAnalysis.objects.count())
+        self.assertEqual(
+            [MOCK_ANALYSIS, None],
+            self.cache.get_many([u'First!', u'Second!'], 'en'))
+        # the long text wasnt looked up
+        self.assertEqual(
+            {'hits': 1, 'misses': 0, 'hit_rate': 1.0}, self.cache.stats())
+
+
+@override_settings(CLOUD_NATURAL_LANG_CACHE_EXPIRY=60)
+@mock.patch('services.cache.PURGE_BATCH_SIZE', 2)
+class PurgeCachedAnalysesTestCase(TestCase):
+    def test_ok(self):
+        analysis_cache = AnalysisCache('v1')
+        for text in (u'First!', u'Second!', u'Third!'):
+            analysis_cache.set(text, 'en', MOCK_ANALYSIS)
+        CachedAnalysis.objects.update(
+            created=timezone.now() - timezone.timedelta(seconds=120))
+        analysis_cache.set(u'Fourth!', 'en', MOCK_ANALYSIS)
+
+        with mock.patch('services.cache.deferred.defer') as mock_defer:
+            cache.purge_cached_analyses()
+        self.assertEqual(2, CachedAnalysis.objects.count())
+        # a full batch was deleted so there may be more
+        mock_defer.assert_called_once_with(
+            cache.purge_cached_analyses, _queue='analyze-background')
+
+        with mock.patch('services.cache.deferred.defer') as mock_defer:
+            cache.purge_cached_analyses()
+        self.assertEqual(
+            [analysis_cache.make_key(u'Fourth!', 'en')],
+            list(CachedAnalysis.objects.values_list('pk', flat=True)))
+        self.assertFalse(mock_defer.called)
+
+    def test_403_not_cron(self):
+        request = RequestFactory().get('/cron/services/analysis-cache/purge/')
+        with mock.patch('services.views.deferred.defer') as mock_defer:
+            resp = purge_analysis_cache(request)
+        self.assertEqual(403, resp.status_code)
+        self.assertFalse(mock_defer.called)
+
+    def test_200_cron(self):
+        request = RequestFactory().get(
+            '/cron/services/analysis-cache/purge/',
+            HTTP_X_APPENGINE_CRON='true')
+        with mock.patch('services.views.deferred.defer') as mock_defer:
+            resp = purge_analysis_cache(request)
+        self.assertEqual(200, resp.status_code)
+        mock_defer.assert_called_once_with(
+            cache.purge_cached_analyses, _queue='analyze-background')
+
+
+class ResponseCacheTestCase(TestCase):
+    def setUp(self):
+        super(ResponseCacheTestCase, self).setUp()
+        self.cache = ResponseCache('test', 60, max_entries=2, wait_timeout=1)
+
+    def test_get_or_call(self):
+        func = mock.Mock(return_value=[])
+        self.assertEqual([], self.cache.get_or_call(('a', 1), func, cost=5))
+        self.assertEqual([], self.cache.get_or_call(('a', 1), func, cost=5))
+        self.assertEqual(1, func.call_count)
+        self.assertEqual({
+            'hits': 1, 'misses': 1, 'hit_rate': 0.5, 'saved_units': 5,
+        }, self.cache.stats())
+
+    def test_lru_eviction(self):
+        for key in ('a', 'b', 'c'):
+            self.cache.set(key, key)
+        memcache.flush_all()
+        self.assertEqual(None, self.cache.get('a'))
+        self.assertEqual(('c',), self.cache.get('c'))
+
+    def test_memcache_tier(self):
+        self.cache.set('a', 'value')
+        self.cache.clear()
+        self.assertEqual(('value',), self.cache.get('a'))
+
+    def test_failed_call_not_cached(self):
+        func = mock.Mock(side_effect=[ValueError, 'value'])
+        with self.assertRaises(ValueError):
+            self.cache.get_or_call(('a',), func)
+        self.assertEqual('value', self.cache.get_or_call(('a',), func))
+
+    def test_concurrent_calls_coalesced(self):
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def func():
+            calls.append(1)
+            started.set()
+            release.wait(1)
+            return 'value'
+
+        results = []
+        leader = threading.Thread(
+            target=lambda: results.append(
+                self.cache.get_or_call(('a',), func)))
+        leader.start()
+        started.wait(1)
+        follower = threading.Thread(
+            target=lambda: results.append(
+                self.cache.get_or_call(('a',), func)))
+        follower.start()
+        release.set()
+        leader.join()
+        follower.join()
+        self.assertEqual(['value', 'value'], results)
+        self.assertEqual(1, len(calls))
+
+    def test_waits_for_other_instance(self):
+        key = self.cache.make_key('a')
+        memcache.add(key + ':lock', 1, namespace='test')
+        with mock.patch('services.cache.time.sleep') as sleep:
+            sleep.side_effect = lambda seconds: memcache.set(
+                key, ('value',), namespace='test')
+            self.assertEqual(
+                'value', self.cache.get_or_call(('a',), mock.Mock()))
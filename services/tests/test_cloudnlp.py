@@ -52,3 +52,63 @@ class CloudNaturalLanguageClientTestCase(TestCase):
         text = 'Rob is awesome\nRob is rubbish\nMy name is Rob'
         result = client.analyze_sentiment(text)
         self.assertEqual(result, mock_analysis)
+
+        # analysing the same text again is served from the cache
+        service.documents().analyzeSentiment.reset_mock()
+        result = client.analyze_sentiment(text)
+        self.assertEqual(result, mock_analysis)
+        self.assertFalse(service.documents().analyzeSentiment.called)
+
+    def test_analyze_sentiment_batch(self):
+        # "Rob is awesome." is 15 bytes, followed by a 2 byte separator
+        mock_analysis = {
+            "documentSentiment": {"score": 0.0, "magnitude": 2.4},
+            "language": "en",
+            "sentences": [{
+                "text": {"content": "Rob is awesome.", "beginOffset": 0},
+                "sentiment": {"magnitude": 0.8, "score": 0.8}
+            }, {
+                "text": {"content": "Rob is rubbish!", "beginOffset": 17},
+                "sentiment": {"magnitude": 0.8, "score": -0.8}
+            }, {
+                "text": {"content": "Really.", "beginOffset": 33},
+                "sentiment": {"magnitude": 0.8, "score": -0.2}
+            }]
+        }
+        service = mock.Mock()
+        service.documents().analyzeSentiment.\
+            return_value.execute.return_value = mock_analysis
+        client = Client(service=service)
+        result = client.analyze_sentiment_batch(
+            [u'Rob is awesome', u'Rob is rubbish! Really.'])
+        body = service.documents().analyzeSentiment.call_args[1]['body']
+        self.assertEqual(
+            u'Rob is awesome.\n\nRob is rubbish! Really.',
+            body['document']['content'])
+        self.assertEqual(2, len(result))
+        self.assertEqual(
+            {'score': 0.8, 'magnitude': 0.8}, result[0]['documentSentiment'])
+        self.assertEqual(
+            {'score': -0.5, 'magnitude': 1.6}, result[1]['documentSentiment'])
+        self.assertEqual(16, result[1]['sentences'][1]['text']['beginOffset'])
+
+    def test_analyze_sentiment_batch_unclean_split(self):
+        # a sentence spanning both texts means neither can be split out
+        mock_analysis = {
+            "documentSentiment": {"score": 0.0, "magnitude": 0.0},
+            "language": "en",
+            "sentences": [{
+                "text": {
+                    "content": "Rob is awesome.\n\nRob is rubbish.",
+                    "beginOffset": 0
+                },
+                "sentiment": {"magnitude": 0.0, "score": 0.0}
+            }]
+        }
+        service = mock.Mock()
+        service.documents().analyzeSentiment.\
+            return_value.execute.return_value = mock_analysis
+        client = Client(service=service)
+        result = client.analyze_sentiment_batch(
+            [u'Rob is awesome.', u'Rob is rubbish.'])
+        self.assertEqual([None, None], result)
@@ -0,0 +1,51 @@
+from djangae.test import TestCase
+
+from services.lexicon import Client, split_sentences
+
+
+class LexiconClientTestCase(TestCase):
+    def test_split_sentences(self):
+        self.assertEqual(
+            [(0, u'Rob is awesome!'), (16, u'Rob is rubbish.'), (33, u'Ok')],
+            split_sentences(u'Rob is awesome! Rob is rubbish.\n Ok'))
+        self.assertEqual([], split_sentences(u''))
+
+    def test_analyze_sentiment(self):
+        client = Client()
+        result = client.analyze_sentiment(
+            u'I love this video! It is awesome. My name is Rob')
+        self.assertEqual('en', result['language'])
+        self.assertGreater(result['documentSentiment']['score'], 0)
+        self.assertGreater(result['documentSentiment']['magnitude'], 0)
+        self.assertEqual(3, len(result['sentences']))
+        self.assertEqual(
+            {'content': u'It is awesome.', 'beginOffset': 19},
+            result['sentences'][1]['text'])
+        self.assertEqual(
+            {'score': 0.0, 'magnitude': 0.0},
+            result['sentences'][2]['sentiment'])
+
+    def test_negation_and_boosters(self):
+        client = Client()
+        good, not_good, very_good = client.analyze_sentiment_batch(
+            [u'It is good.', u'It is not good.', u'It is very good.'])
+        self.assertLess(not_good['documentSentiment']['score'], 0)
+        self.assertGreater(
+            very_good['documentSentiment']['score'],
+            good['documentSentiment']['score'])
+
+    def test_empty_text(self):
+        result = Client().analyze_sentiment(u'')
+        self.assertEqual(
+            {'score': 0.0, 'magnitude': 0.0}, result['documentSentiment'])
+        self.assertEqual([], result['sentences'])
+
+    def test_no_lexicon_words(self):
+        for text in [u'first!', u'My name is Rob']:
+            result = Client().analyze_sentiment(text)
+            self.assertEqual(
+                {'score': 0.0, 'magnitude': 0.0},
+                result['documentSentiment'])
+            self.assertEqual(
+                {'score': 0.0, 'magnitude': 0.0},
+                result['sentences'][0]['sentiment'])
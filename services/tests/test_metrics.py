@@ -0,0 +1,109 @@
+import os
+
+from djangae.test import TestCase
+from django.test import RequestFactory
+
+import mock
+
+from services import metrics
+from services.models import DeadLetter
+from services.tasks import PERMANENT
+from services.views import stats
+
+
+class RecorderTestCase(TestCase):
+    def setUp(self):
+        super(RecorderTestCase, self).setUp()
+        self.recorder = metrics.Recorder('metrics-test', interval=60)
+
+    def test_buffers_until_flushed(self):
+        self.recorder.timing('api:youtube.search.list', 40, bytes_in=100)
+        self.assertEqual({}, self.recorder.stats())
+        self.recorder.flush()
+        self.assertEqual(
+            1, self.recorder.stats()['api:youtube.search.list']['count'])
+
+    def test_flushes_after_interval(self):
+        self.recorder.interval = 0
+        self.recorder.incr('quota:youtube', 'units', 100)
+        self.assertEqual(
+            {'quota:youtube': {'units': 100}}, self.recorder.stats())
+
+    def test_stats(self):
+        for ms in [3, 40, 40, 45, 200, 200, 800, 90000]:
+            self.recorder.timing('task:videos', ms, bytes_in=10)
+        self.recorder.timing('task:videos', 20, error=True)
+        self.recorder.flush()
+        # a second instance shares the counters and the index
+        other = metrics.Recorder('metrics-test', interval=60)
+        other.timing('task:videos', 20)
+        other.timing('queue:comments', 1500)
+        other.flush()
+
+        result = self.recorder.stats()
+        self.assertEqual(set(['task:videos', 'queue:comments']), set(result))
+        task = result['task:videos']
+        self.assertEqual(10, task['count'])
+        self.assertEqual(1, task['errors'])
+        self.assertEqual(80, task['bytes_in'])
+        self.assertEqual(91368, task['ms'])
+        self.assertEqual(9136.8, task['mean_ms'])
+        self.assertEqual(
+            {'5': 1, '25': 2, '50': 3, '250': 2, '1000': 1, 'inf': 1},
+            task['buckets'])
+        self.assertEqual(50, task['p50_ms'])
+        self.assertEqual(1000, task['p90_ms'])
+        self.assertEqual(60000, task['p99_ms'])
+        self.assertEqual(2500, result['queue:comments']['p50_ms'])
+
+    def test_timed(self):
+        recorder = metrics.Recorder('metrics-test', interval=0)
+        with mock.patch('services.metrics.get_recorder') as mock_recorder:
+            mock_recorder.return_value = recorder
+            with metrics.timed('datastore:Get') as counts:
+                counts['bytes_in'] = 10
+            with self.assertRaises(ValueError):
+                with metrics.timed('datastore:Get'):
+                    raise ValueError
+        result = recorder.stats()['datastore:Get']
+        self.assertEqual(2, result['count'])
+        self.assertEqual(1, result['errors'])
+        self.assertEqual(10, result['bytes_in'])
+
+    def test_queue_lag(self):
+        recorder = metrics.Recorder('metrics-test', interval=0)
+        environ = {
+            'HTTP_X_APPENGINE_TASKETA': '1000.0',
+            'HTTP_X_APPENGINE_QUEUENAME': 'analyze',
+        }
+        with mock.patch('services.metrics.get_recorder') as mock_recorder:
+            mock_recorder.return_value = recorder
+            with mock.patch.dict(os.environ, environ):
+                with mock.patch('services.metrics.time.time',
+                                return_value=1000.2):
+                    metrics.record_queue_lag('default')
+        result = recorder.stats()
+        self.assertEqual(['queue:analyze'], list(result))
+        self.assertEqual(250, result['queue:analyze']['p50_ms'])
+
+
+class StatsViewTestCase(TestCase):
+    def test_403_not_admin(self):
+        request = RequestFactory().get('/_ah/stats/')
+        with mock.patch('google.appengine.api.users.is_current_user_admin',
+                        return_value=False):
+            resp = stats(request)
+        self.assertEqual(403, resp.status_code)
+
+    def test_200_admin(self):
+        DeadLetter.objects.create(
+            task='videos.tasks.cloudnlp_analyze_comment', queue='analyze',
+            args=[1], kind=PERMANENT, error='')
+        metrics.get_recorder().incr('quota:language', 'units', 5)
+        request = RequestFactory().get('/_ah/stats/')
+        with mock.patch('google.appengine.api.users.is_current_user_admin',
+                        return_value=True):
+            resp = stats(request)
+        self.assertEqual(200, resp.status_code)
+        self.assertIn('"units": 5', resp.content)
+        self.assertIn('"permanent": 1', resp.content)
@@ -0,0 +1,47 @@
+from djangae.test import TestCase
+
+import mock
+
+from services import quota
+from services.models import QuotaBucket
+
+
+class TokenBucketTestCase(TestCase):
+    def test_consume(self):
+        bucket = quota.TokenBucket('test', rate=1, capacity=100)
+        with mock.patch('services.quota.time.time', return_value=1000.0):
+            self.assertEqual(0, bucket.consume(100))
+            # empty, so we need to wait for 5 tokens to refill
+            self.assertEqual(5, bucket.consume(5))
+        with mock.patch('services.quota.time.time', return_value=1005.0):
+            self.assertEqual(0, bucket.consume(5))
+
+    def test_refill_capped_at_capacity(self):
+        bucket = quota.TokenBucket('test', rate=1, capacity=10)
+        self.assertEqual(10, bucket.refill(5, 0, 1000))
+        self.assertEqual(7, bucket.refill(5, 998, 1000))
+
+    def test_datastore_fallback(self):
+        bucket = quota.TokenBucket('test', rate=1, capacity=100)
+        with mock.patch('services.quota.memcache.Client') as mock_client:
+            mock_client.return_value.gets.return_value = None
+            mock_client.return_value.add.return_value = False
+            with mock.patch('services.quota.time.time', return_value=1000.0):
+                self.assertEqual(0, bucket.consume(60))
+                self.assertEqual(20, bucket.consume(60))
+        stored = QuotaBucket.objects.get(pk='test')
+        self.assertEqual(40, stored.tokens)
+        self.assertEqual(1000.0, stored.updated)
+
+
+class AcquireTestCase(TestCase):
+    def test_acquire_weighted_by_cost(self):
+        with self.settings(API_QUOTAS={
+                'youtube': {'rate': 1, 'capacity': 101}}):
+            quota.acquire('youtube', 'videos.list')
+            quota.acquire('youtube', 'videos.list')
+            with self.assertRaises(quota.QuotaExceeded) as cm:
+                quota.acquire('youtube', 'search.list')
+        self.assertEqual('youtube', cm.exception.api)
+        self.assertEqual('search.list', cm.exception.method)
+        self.assertEqual(1, cm.exception.retry_after)
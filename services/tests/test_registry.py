@@ -0,0 +1,54 @@
+import json
+import shutil
+import tempfile
+import threading
+
+from djangae.test import TestCase
+
+import mock
+
+from services import registry
+
+
+class RegistryTestCase(TestCase):
+    def setUp(self):
+        super(RegistryTestCase, self).setUp()
+        registry.clear()
+        self.addCleanup(registry.clear)
+
+    def test_load_bundled_discovery_document(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with open('{}/youtube.v3.json'.format(directory), 'w') as f:
+            json.dump({'name': 'youtube'}, f)
+        with mock.patch('services.registry.DISCOVERY_DIR', directory):
+            with mock.patch('services.registry.httplib2.Http') as mock_http:
+                document = registry.load_discovery_document('youtube', 'v3')
+                self.assertFalse(mock_http.called)
+        self.assertEqual({'name': 'youtube'}, document)
+
+    def test_discovery_document_loaded_once(self):
+        with mock.patch(
+                'services.registry.load_discovery_document') as mock_load:
+            mock_load.return_value = {'name': 'youtube'}
+            registry.get_discovery_document('youtube', 'v3')
+            registry.get_discovery_document('youtube', 'v3')
+        mock_load.assert_called_once_with('youtube', 'v3')
+
+    @mock.patch('services.registry.load_discovery_document')
+    @mock.patch('services.registry.discovery.build_from_document')
+    def test_get_service_reused_per_thread(self, mock_build, mock_load):
+        mock_build.side_effect = lambda *args, **kwargs: mock.Mock()
+        service = registry.get_service('youtube', 'v3', 'key')
+        self.assertIs(service, registry.get_service('youtube', 'v3', 'key'))
+        self.assertEqual(1, mock_build.call_count)
+
+        # other threads get their own service objects
+        other = []
+        thread = threading.Thread(target=lambda: other.append(
+            registry.get_service('youtube', 'v3', 'key')))
+        thread.start()
+        thread.join()
+        self.assertIsNot(service, other[0])
+        self.assertEqual(2, mock_build.call_count)
+        mock_load.assert_called_once_with('youtube', 'v3')
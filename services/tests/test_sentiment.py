@@ -0,0 +1,51 @@
+from djangae.test import TestCase
+
+import mock
+
+from services import lexicon
+from services.sentiment import HybridClient, get_client
+
+
+def analysis(score):
+    return {'documentSentiment': {'score': score, 'magnitude': abs(score)}}
+
+
+class GetClientTestCase(TestCase):
+    def test_local(self):
+        self.assertIsInstance(get_client('local'), lexicon.Client)
+
+    def test_hybrid(self):
+        self.assertIsInstance(get_client('hybrid'), HybridClient)
+
+    def test_default(self):
+        with mock.patch('services.sentiment.cloudnlp.Client') as mock_cloud:
+            with self.settings(SENTIMENT_BACKEND='cloud'):
+                self.assertEqual(mock_cloud.return_value, get_client(''))
+
+
+class HybridClientTestCase(TestCase):
+    def setUp(self):
+        super(HybridClientTestCase, self).setUp()
+        self.local = mock.Mock()
+        self.cloud = mock.Mock()
+        self.client = HybridClient(
+            local=self.local, cloud=self.cloud, threshold=0.25)
+
+    def test_analyze_sentiment_confident(self):
+        self.local.analyze_sentiment.return_value = analysis(0.8)
+        self.assertEqual(analysis(0.8), self.client.analyze_sentiment('foo'))
+        self.assertFalse(self.cloud.analyze_sentiment.called)
+
+    def test_analyze_sentiment_borderline(self):
+        self.local.analyze_sentiment.return_value = analysis(0.1)
+        self.cloud.analyze_sentiment.return_value = analysis(-0.5)
+        self.assertEqual(analysis(-0.5), self.client.analyze_sentiment('foo'))
+
+    def test_analyze_sentiment_batch(self):
+        self.local.analyze_sentiment_batch.return_value = [
+            analysis(0.8), analysis(0.0), analysis(-0.9)]
+        self.cloud.analyze_sentiment_batch.return_value = [analysis(0.4)]
+        result = self.client.analyze_sentiment_batch(['a', 'b', 'c'])
+        self.cloud.analyze_sentiment_batch.assert_called_once_with(['b'], 'en')
+        self.assertEqual(
+            [analysis(0.8), analysis(0.4), analysis(-0.9)], result)
@@ -0,0 +1,156 @@
+import datetime
+import json
+import socket
+
+from djangae.test import TestCase
+from django.test import override_settings
+
+import httplib2
+import mock
+import pytz
+from googleapiclient.errors import HttpError
+
+from services import tasks
+from services.models import DeadLetter
+from services.quota import QuotaExceeded
+
+calls = []
+
+
+def http_error(status, reason=None):
+    content = ''
+    if reason is not None:
+        content = json.dumps({'error': {'errors': [{'reason': reason}]}})
+    return HttpError(httplib2.Response({'status': status}), content)
+
+
+ERRORS = {
+    'unavailable': http_error(503),
+    'rate_limit': QuotaExceeded('language', 'documents.analyzeSentiment', 30),
+    'timeout': socket.timeout('timed out'),
+    'invalid': ValueError('nope'),
+}
+
+
+def record_failure(value, error=None):
+    calls.append(('failed', value))
+
+
+@tasks.task('analyze', on_failure=record_failure)
+def flaky(value, error=None):
+    calls.append(('called', value))
+    if error is not None:
+        raise ERRORS[error]
+
+
+class ClassifyTestCase(TestCase):
+    def test_classify(self):
+        self.assertEqual(tasks.QUOTA, tasks.classify(
+            QuotaExceeded('youtube', 'search.list', 10)))
+        self.assertEqual(
+            tasks.QUOTA, tasks.classify(http_error(403, 'quotaExceeded')))
+        self.assertEqual(tasks.QUOTA, tasks.classify(http_error(429)))
+        self.assertEqual(tasks.TRANSIENT, tasks.classify(http_error(503)))
+        self.assertEqual(
+            tasks.TRANSIENT, tasks.classify(socket.timeout('timed out')))
+        self.assertEqual(
+            tasks.PERMANENT,
+            tasks.classify(http_error(403, 'commentsDisabled')))
+        self.assertEqual(tasks.PERMANENT, tasks.classify(http_error(404)))
+        self.assertEqual(tasks.PERMANENT, tasks.classify(ValueError()))
+
+    def test_quota_delay(self):
+        self.assertEqual(10, tasks.quota_delay(
+            QuotaExceeded('youtube', 'search.list', 10)))
+        self.assertEqual(
+            tasks.RATE_LIMIT_WINDOW,
+            tasks.quota_delay(http_error(403, 'rateLimitExceeded')))
+        # 11pm Pacific, an hour before the daily quota resets
+        now = datetime.datetime(2018, 6, 2, 6, tzinfo=pytz.utc)
+        self.assertEqual(3601, tasks.quota_delay(
+            http_error(403, 'quotaExceeded'), now=now))
+
+    @override_settings(TASK_RETRY_BASE_DELAY=10, TASK_RETRY_MAX_DELAY=60)
+    def test_backoff_delay(self):
+        self.assertTrue(5 <= tasks.backoff_delay(1) <= 10)
+        self.assertTrue(20 <= tasks.backoff_delay(3) <= 40)
+        self.assertTrue(30 <= tasks.backoff_delay(10) <= 60)
+
+
+class TaskTestCase(TestCase):
+    def setUp(self):
+        super(TaskTestCase, self).setUp()
+        del calls[:]
+
+    def test_ok(self):
+        flaky(1)
+        self.assertEqual([('called', 1)], calls)
+        self.assertFalse(DeadLetter.objects.exists())
+
+    def test_transient_error_retried(self):
+        with mock.patch('services.tasks.deferred.defer') as mock_defer:
+            flaky(1, error='unavailable', _attempt=2)
+        mock_defer.assert_called_once_with(
+            flaky, 1, _attempt=3, _countdown=mock.ANY, _queue='analyze',
+            error='unavailable')
+        self.assertFalse(DeadLetter.objects.exists())
+
+    def test_quota_error_deferred(self):
+        with mock.patch('services.tasks.deferred.defer') as mock_defer:
+            flaky(1, error='rate_limit')
+        mock_defer.assert_called_once_with(
+            flaky, 1, _attempt=1, _countdown=30, _queue='analyze',
+            error='rate_limit')
+
+    @override_settings(TASK_RETRY_ATTEMPTS=3)
+    def test_out_of_attempts(self):
+        with mock.patch('services.tasks.deferred.defer') as mock_defer:
+            flaky(1, error='timeout', _attempt=3)
+        self.assertFalse(mock_defer.called)
+        dead_letter = DeadLetter.objects.get()
+        self.assertEqual(tasks.TRANSIENT, dead_letter.kind)
+        self.assertEqual(3, dead_letter.attempts)
+
+    def test_permanent_error(self):
+        with mock.patch('services.tasks.deferred.defer') as mock_defer:
+            flaky(1, error='invalid')
+        self.assertFalse(mock_defer.called)
+        self.assertEqual([('called', 1), ('failed', 1)], calls)
+        dead_letter = DeadLetter.objects.get()
+        self.assertEqual('services.tests.test_tasks.flaky', dead_letter.task)
+        self.assertEqual('analyze', dead_letter.queue)
+        self.assertEqual([1], dead_letter.args)
+        self.assertEqual({'error': 'invalid'}, dead_letter.kwargs)
+        self.assertEqual(tasks.PERMANENT, dead_letter.kind)
+        self.assertIn('nope', dead_letter.error)
+
+
+class ReplayTestCase(TestCase):
+    def test_replay(self):
+        dead_letters = [
+            DeadLetter.objects.create(
+                task='services.tests.test_tasks.flaky', queue='analyze',
+                args=[i], kwargs={}, kind=tasks.PERMANENT, error='')
+            for i in range(3)]
+        DeadLetter.objects.filter(pk=dead_letters[2].pk).update(
+            replayed=datetime.datetime(2018, 1, 1, tzinfo=pytz.utc))
+        with mock.patch('services.tasks.taskqueue.Queue') as mock_queue:
+            self.assertEqual(2, tasks.replay(DeadLetter.objects.all()))
+        mock_queue.assert_called_once_with('analyze-background')
+        added = mock_queue().add_async.call_args[0][0]
+        self.assertEqual(2, len(added))
+        self.assertEqual(
+            0, DeadLetter.objects.filter(replayed__isnull=True).count())
+
+    def test_replay_every_task_queue(self):
+        # the background copy of every queue a task can be dead lettered
+        # from exists, the task queue stub rejects adds to any other queue
+        for queue in ('analyze', 'comments', 'videos'):
+            DeadLetter.objects.create(
+                task='services.tests.test_tasks.flaky', queue=queue,
+                args=[1], kwargs={}, kind=tasks.PERMANENT, error='')
+        self.assertEqual(3, tasks.replay(DeadLetter.objects.all()))
+        for queue in ('analyze', 'comments', 'videos'):
+            self.assertNumTasksEquals(1, queue + '-background')
+        self.assertFalse(
+            DeadLetter.objects.filter(replayed__isnull=True).exists())
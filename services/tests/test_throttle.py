@@ -0,0 +1,143 @@
+import os
+
+from djangae.test import TestCase
+from django.test import override_settings
+
+import httplib2
+import mock
+from googleapiclient.errors import HttpError
+
+from services import throttle
+
+
+def controller():
+    return throttle.Controller(
+        'test', rate=2, min_rate=0.5, max_rate=3, increase=0.5,
+        decrease=0.5, interval=10, latency=1.0)
+
+
+class ControllerTestCase(TestCase):
+    def test_additive_increase(self):
+        control = controller()
+        with mock.patch('services.throttle.time.time', return_value=1000.0):
+            self.assertEqual(2.5, control.success(0.1))
+            # at most once an interval
+            control._increase_checked = 0
+            self.assertEqual(2.5, control.success(0.1))
+        with mock.patch('services.throttle.time.time', return_value=1010.0):
+            self.assertEqual(3, control.success(0.1))
+        with mock.patch('services.throttle.time.time', return_value=1020.0):
+            # capped at the max rate
+            self.assertEqual(3, control.success(0.1))
+        self.assertEqual(3, control.rate)
+
+    def test_slow_calls_hold_rate(self):
+        control = controller()
+        self.assertIsNone(control.success(5.0))
+        self.assertEqual(2, control.rate)
+
+    def test_multiplicative_decrease(self):
+        control = controller()
+        with mock.patch('services.throttle.time.time', return_value=1000.0):
+            self.assertEqual(1, control.backoff())
+            # a burst of errors only backs off once
+            self.assertEqual(1, control.backoff())
+            control._increase_checked = 0
+            # and holds off increasing again for an interval
+            self.assertEqual(1, control.success(0.1))
+        with mock.patch('services.throttle.time.time', return_value=1010.0):
+            self.assertEqual(0.5, control.backoff())
+        with mock.patch('services.throttle.time.time', return_value=1020.0):
+            # floored at the min rate
+            self.assertEqual(0.5, control.backoff())
+
+    def test_schedule(self):
+        control = controller()
+        with mock.patch('services.throttle.time.time', return_value=1000.0):
+            self.assertEqual([0, 0.5, 1.0], control.schedule(3))
+            self.assertEqual([1.5], control.schedule())
+        with mock.patch('services.throttle.time.time', return_value=1001.0):
+            control.backoff()
+            # slots already handed out keep their place
+            self.assertEqual([1.0, 2.0], control.schedule(2))
+        with mock.patch('services.throttle.time.time', return_value=1010.0):
+            self.assertEqual([0], control.schedule())
+
+    def test_schedule_lanes_and_owners(self):
+        control = controller()
+        with mock.patch('services.throttle.time.time', return_value=1000.0):
+            self.assertEqual([0, 0.5], control.schedule(2, owner=1))
+            # another owner isnt held up by the first one's backlog
+            self.assertEqual([0], control.schedule(owner=2))
+            # background work gets its own slots, at half the rate
+            self.assertEqual(
+                [0, 1.0], control.schedule(2, throttle.BACKGROUND, owner=1))
+
+    def test_schedule_memcache_unavailable(self):
+        control = controller()
+        with mock.patch('services.throttle.memcache.Client') as mock_client:
+            mock_client.return_value.gets.return_value = None
+            mock_client.return_value.add.return_value = False
+            self.assertEqual([0, 0], control.schedule(2))
+
+
+@override_settings(API_THROTTLES={
+    'language': {'rate': 2, 'min_rate': 0.5, 'max_rate': 3}})
+class ThrottleTestCase(TestCase):
+    def setUp(self):
+        super(ThrottleTestCase, self).setUp()
+        throttle._controllers.clear()
+
+    def tearDown(self):
+        throttle._controllers.clear()
+        super(ThrottleTestCase, self).tearDown()
+
+    def test_defer(self):
+        func = mock.Mock()
+        with mock.patch('services.throttle.deferred.defer') as mock_defer, \
+                mock.patch('services.throttle.time.time',
+                           return_value=1000.0):
+            throttle.defer('language', func, 1, _queue='analyze')
+            throttle.defer('language', func, 2, _queue='analyze')
+            throttle.defer('youtube', func, 3, _queue='comments')
+        self.assertEqual([
+            mock.call(func, 1, _countdown=0, _queue='analyze'),
+            mock.call(func, 2, _countdown=0.5, _queue='analyze'),
+            mock.call(func, 3, _queue='comments'),
+        ], mock_defer.call_args_list)
+
+    def test_defer_lanes(self):
+        func = mock.Mock()
+        with mock.patch('services.throttle.deferred.defer') as mock_defer:
+            throttle.defer(
+                'youtube', func, 1, _queue='comments',
+                _lane=throttle.BACKGROUND)
+            with mock.patch.dict(os.environ, {
+                    'HTTP_X_APPENGINE_QUEUENAME': 'comments-background'}):
+                # work fanned out from background tasks stays there
+                throttle.defer('youtube', func, 2, _queue='analyze')
+        self.assertEqual([
+            mock.call(func, 1, _queue='comments-background'),
+            mock.call(func, 2, _queue='analyze-background'),
+        ], mock_defer.call_args_list)
+
+    def test_execute_feedback(self):
+        control = throttle.get_controller('language')
+        request = mock.Mock()
+        request.execute.return_value = {'ok': True}
+        self.assertEqual(
+            {'ok': True}, throttle.execute('language', 'method', request))
+        self.assertEqual(2.5, control.rate)
+
+        request.execute.side_effect = HttpError(
+            httplib2.Response({'status': 429}), '')
+        with self.assertRaises(HttpError):
+            throttle.execute('language', 'method', request)
+        self.assertEqual(1.25, control.rate)
+
+        # errors that arent the API pushing back dont change the rate
+        request.execute.side_effect = HttpError(
+            httplib2.Response({'status': 404}), '')
+        with self.assertRaises(HttpError):
+            throttle.execute('language', 'method', request)
+        self.assertEqual(1.25, control.rate)
@@ -3,7 +3,12 @@ from djangae.test import TestCase
 
 import mock
 
-from services.youtube import Client
+from services.youtube import (
+    Captions,
+    Client,
+    get_response_cache,
+    parse_captions
+)
 
 MOCK_CAPTIONS_XML = u"""<?xml version="1.0" encoding="utf-8" ?>
 <transcript>
@@ -21,6 +26,10 @@ MOCK_CAPTIONS_XML_UTF8 = u"""<?xml version="1.0" encoding="utf-8" ?>
 
 
 class YouTubeClientTestCase(TestCase):
+    def setUp(self):
+        super(YouTubeClientTestCase, self).setUp()
+        get_response_cache().clear()
+
     def test_search(self):
         expected_items = [{
             u'etag': u'"etag/123456789"',
@@ -127,6 +136,35 @@ class YouTubeClientTestCase(TestCase):
         result = client.search('kittens')
         self.assertEqual(result, [])
 
+    def test_search_cached(self):
+        service = mock.Mock()
+        service.search().list.return_value.execute.return_value = {
+            u'items': [{u'id': {u'videoId': u'video1234'}}]}
+        service.videos().list.return_value.execute.return_value = {
+            u'items': [{u'id': u'video1234'}]}
+        client = Client(service=service)
+        self.assertEqual([{u'id': u'video1234'}], client.search('Kittens'))
+        self.assertEqual(
+            [{u'id': u'video1234'}], client.search(u' kittens\n'))
+        self.assertEqual(1, service.search().list.call_count)
+        stats = get_response_cache().stats()
+        self.assertEqual(1, stats['hits'])
+        self.assertEqual(101, stats['saved_units'])
+
+        # a new instance only has the memcache tier
+        get_response_cache().clear()
+        self.assertEqual([{u'id': u'video1234'}], client.search('kittens'))
+        self.assertEqual(1, service.search().list.call_count)
+
+    def test_search_uncached(self):
+        service = mock.Mock()
+        service.search().list.return_value.execute.return_value = {
+            u'items': []}
+        client = Client(service=service, cache=False)
+        client.search('kittens')
+        client.search('kittens')
+        self.assertEqual(2, service.search().list.call_count)
+
     def test_get_video(self):
         expected_items = [{
             u'snippet': {
@@ -243,8 +281,37 @@ class YouTubeClientTestCase(TestCase):
             }
         }
         client = Client(service=service)
-        result = client.get_video_comments('video1234')
-        self.assertEqual(result, expected_items)
+        result = client.get_video_comments('video1234', max_pages=1)
+        self.assertEqual(list(result), [(expected_items, u'next_page_token')])
+
+    def test_get_video_comments_follows_page_token(self):
+        service = mock.Mock()
+        service.commentThreads().list.return_value.execute.side_effect = [
+            {u'items': [{u'id': u'thread1'}], u'nextPageToken': u'page2'},
+            {u'items': [{u'id': u'thread2'}]},
+        ]
+        client = Client(service=service)
+        result = list(client.get_video_comments('video1234'))
+        self.assertEqual(result, [
+            ([{u'id': u'thread1'}], u'page2'),
+            ([{u'id': u'thread2'}], None),
+        ])
+        self.assertEqual(
+            u'page2',
+            service.commentThreads().list.call_args[1]['pageToken'])
+
+    def test_get_video_comments_max_comments(self):
+        service = mock.Mock()
+        service.commentThreads().list.return_value.execute.return_value = {
+            u'items': [{u'id': u'thread1'}, {u'id': u'thread2'}],
+            u'nextPageToken': u'page2',
+        }
+        client = Client(service=service)
+        result = list(client.get_video_comments('video1234', max_comments=3))
+        self.assertEqual(result, [
+            ([{u'id': u'thread1'}, {u'id': u'thread2'}], u'page2'),
+            ([{u'id': u'thread1'}], None),
+        ])
 
     def test_get_video_transcript_no_caption(self):
         # checks that None is returned if no captions are available
@@ -279,3 +346,49 @@ class YouTubeClientTestCase(TestCase):
             result = client.get_video_transcript('video1234')
         self.assertEqual(
             result, u"象は鼻が長 I’m Rob Charlwood - Engineer")
+
+    def test_get_video_captions(self):
+        service = mock.Mock()
+        mock_pytube = mock.Mock()
+        mock_xml = mock.Mock()
+        mock_xml.xml_captions = MOCK_CAPTIONS_XML
+        mock_pytube.captions.get_by_language_code.return_value = mock_xml
+        client = Client(service=service)
+        with mock.patch('services.youtube.YouTube', return_value=mock_pytube):
+            result = client.get_video_captions('video1234')
+        self.assertEqual(
+            result.transcript,
+            'Hello world! Im Rob Charlwood and Im an Engineer')
+        self.assertEqual(
+            {
+                'start': [4.75, 11.77],
+                'duration': [5.12, 7.549],
+                'offset': [0, 13]
+            }, result.to_dict())
+
+
+class CaptionsTestCase(TestCase):
+    def test_parse_captions_strips_html_and_blank_cues(self):
+        captions = parse_captions(u"""<?xml version="1.0" encoding="utf-8" ?>
+<transcript>
+    <text start="1.0" dur="1.0">&lt;font color=&quot;#E5E5E5&quot;&gt;Hi&lt;/font&gt;</text>
+    <text start="2.0" dur="1.0">  </text>
+    <text start="3.0">Rob &amp;#39;here&amp;#39;</text>
+</transcript>
+""")
+        self.assertEqual(u"Hi Rob 'here'", captions.transcript)
+        self.assertEqual(2, len(captions))
+        self.assertEqual([1.0, 3.0], list(captions.starts))
+        self.assertEqual([1.0, 0.0], list(captions.durations))
+
+    def test_time_at(self):
+        captions = Captions.from_dict(u'Hello world! Im Rob', {
+            'start': [4.75, 11.77],
+            'duration': [5.12, 7.549],
+            'offset': [0, 13]
+        })
+        self.assertEqual(4.75, captions.time_at(0))
+        self.assertEqual(4.75, captions.time_at(12))
+        self.assertEqual(11.77, captions.time_at(13))
+        self.assertEqual(11.77, captions.time_at(100))
+        self.assertEqual(0.0, Captions.from_dict(u'', {}).time_at(10))
@@ -0,0 +1,225 @@
+import logging
+import time
+
+from djangae import environment
+from django.conf import settings
+
+from google.appengine.api import memcache
+from google.appengine.ext import deferred
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+CAS_ATTEMPTS = 5
+RATE_KEY = 'rate'
+
+# task lanes. Background work runs on its own copy of each queue, named with
+# the suffix, so that it never holds up interactive work.
+INTERACTIVE = 'interactive'
+BACKGROUND = 'background'
+BACKGROUND_SUFFIX = '-background'
+
+_controllers = {}
+
+
+class Controller(object):
+    """
+    Adapts the rate, in tasks per second, that the tasks calling an API are
+    dispatched at with additive increase, multiplicative decrease. The rate
+    grows by `increase` at most every `interval` seconds while calls succeed
+    within `latency` seconds, holds while they are slower than that and is
+    multiplied by `decrease` (at most once per interval, so one burst of
+    errors only counts once) when the API pushes back with a quota or rate
+    limit error. The rate and the next free dispatch slots live in memcache,
+    shared by every instance and updated with compare and set.
+
+    Each lane and owner has its own dispatch slots so that a backlog of one
+    owner's tasks doesnt push back everyone else's. Background lanes get
+    `background_share` of the rate. Several owners dispatching at once can
+    add up to more than the rate, the API pushing back then brings it down.
+    """
+    def __init__(
+            self, name, rate, min_rate, max_rate, increase=0.5,
+            decrease=0.5, interval=10, latency=5.0, background_share=0.5):
+        self.name = name
+        self.initial_rate = float(rate)
+        self.min_rate = float(min_rate)
+        self.max_rate = float(max_rate)
+        self.increase = float(increase)
+        self.decrease = float(decrease)
+        self.interval = interval
+        self.latency = latency
+        self.background_share = background_share
+        self.namespace = 'throttle-' + name
+        # when this instance last tried to raise the rate, so that a stream
+        # of successes doesnt hit memcache on every call
+        self._increase_checked = 0
+
+    @property
+    def rate(self):
+        """
+        The current dispatch rate
+        """
+        state = memcache.get(RATE_KEY, namespace=self.namespace)
+        return state[0] if state else self.initial_rate
+
+    def _update(self, adjust):
+        """
+        Applies `adjust`, which takes the current (rate, increased,
+        decreased) state and returns the new one or None to leave it be, to
+        the shared state. Returns the rate.
+        """
+        now = time.time()
+        client = memcache.Client()
+        for _ in range(CAS_ATTEMPTS):
+            state = client.gets(RATE_KEY, namespace=self.namespace)
+            if state is None:
+                updated = adjust((self.initial_rate, 0, 0), now)
+                if updated is None:
+                    return self.initial_rate
+                if client.add(RATE_KEY, updated, namespace=self.namespace):
+                    return updated[0]
+                continue
+            updated = adjust(state, now)
+            if updated is None:
+                return state[0]
+            if client.cas(RATE_KEY, updated, namespace=self.namespace):
+                return updated[0]
+        logger.warning('Unable to update %r dispatch rate', self.name)
+        return self.rate
+
+    def _increase(self, state, now):
+        rate, increased, decreased = state
+        if rate >= self.max_rate or \
+                now - max(increased, decreased) < self.interval:
+            return
+        return min(self.max_rate, rate + self.increase), now, decreased
+
+    def _decrease(self, state, now):
+        rate, increased, decreased = state
+        if rate <= self.min_rate or now - decreased < self.interval:
+            return
+        return max(self.min_rate, rate * self.decrease), increased, now
+
+    def success(self, seconds):
+        """
+        Records a call to the API that succeeded, taking `seconds`
+        """
+        now = time.time()
+        if seconds > self.latency or \
+                now - self._increase_checked < self.interval:
+            return
+        self._increase_checked = now
+        return self._update(self._increase)
+
+    def backoff(self):
+        """
+        Records a call to the API that was pushed back
+        """
+        rate = self._update(self._decrease)
+        logger.info('Backing off %r dispatch to %.2f/s', self.name, rate)
+        metrics.get_recorder().incr('throttle:' + self.name, 'backoffs')
+        return rate
+
+    def schedule(self, count=1, lane=INTERACTIVE, owner=None):
+        """
+        Reserves the owner's next `count` dispatch slots in the passed lane
+        at the current rate, returning the countdown in seconds of each.
+        Slots already handed out keep their place when the rate changes. If
+        memcache cant be used the tasks are dispatched straight away,
+        leaving the queue's own rate to hold them back.
+        """
+        rate = self.rate
+        if lane == BACKGROUND:
+            rate *= self.background_share
+        key = 'slot:{}:{}'.format(lane, owner or '')
+        now = time.time()
+        client = memcache.Client()
+        for _ in range(CAS_ATTEMPTS):
+            slot = client.gets(key, namespace=self.namespace)
+            start = max(now, slot or now)
+            end = start + count / rate
+            # the slot is only needed until it has passed
+            timeout = int(end - now) + 1
+            if slot is None:
+                if client.add(
+                        key, end, time=timeout, namespace=self.namespace):
+                    break
+            elif client.cas(
+                    key, end, time=timeout, namespace=self.namespace):
+                break
+        else:
+            logger.warning('Unable to schedule %r dispatch', self.name)
+            return [0] * count
+        return [start - now + i / rate for i in range(count)]
+
+
+def get_controller(api):
+    """
+    Returns the dispatch controller for the passed API, or None if its tasks
+    arent throttled
+    """
+    controller = _controllers.get(api)
+    if controller is None:
+        options = settings.API_THROTTLES.get(api)
+        if options is None:
+            return
+        controller = _controllers[api] = Controller(api, **options)
+    return controller
+
+
+def current_lane():
+    """
+    Returns the lane of the running task, or INTERACTIVE outside of tasks
+    """
+    queue = environment.task_queue_name() or ''
+    if queue.endswith(BACKGROUND_SUFFIX):
+        return BACKGROUND
+    return INTERACTIVE
+
+
+def lane_queue(queue, lane):
+    """
+    Returns the name of the passed queue's copy for the lane
+    """
+    if lane == BACKGROUND and not queue.endswith(BACKGROUND_SUFFIX):
+        return queue + BACKGROUND_SUFFIX
+    return queue
+
+
+def defer(api, func, *args, **kwargs):
+    """
+    Defers a task that calls the passed API onto the `_queue` of its lane,
+    in the next dispatch slot of its `_owner`. `_lane` defaults to the lane
+    of the task doing the deferring, so work fanned out from background
+    tasks stays in the background.
+    """
+    lane = kwargs.pop('_lane', None) or current_lane()
+    owner = kwargs.pop('_owner', None)
+    kwargs['_queue'] = lane_queue(kwargs.get('_queue', 'default'), lane)
+    controller = get_controller(api)
+    if controller is not None:
+        countdown = controller.schedule(lane=lane, owner=owner)[0]
+        kwargs['_countdown'] = kwargs.get('_countdown', 0) + countdown
+    return deferred.defer(func, *args, **kwargs)
+
+
+def execute(api, method, request):
+    """
+    Executes a Google API request through `metrics.execute`, feeding its
+    outcome back to the API's dispatch controller
+    """
+    from .tasks import QUOTA, classify  # avoid circular imports
+    controller = get_controller(api)
+    if controller is None:
+        return metrics.execute(api, method, request)
+    started = time.time()
+    try:
+        results = metrics.execute(api, method, request)
+    except Exception as e:
+        if classify(e) == QUOTA:
+            controller.backoff()
+        raise
+    controller.success(time.time() - started)
+    return results
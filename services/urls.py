@@ -0,0 +1,8 @@
+from django.conf.urls import url
+
+from .views import purge_analysis_cache
+
+urlpatterns = (
+    url(r'^analysis-cache/purge/$',
+        purge_analysis_cache, name='purge_analysis_cache'),
+)
@@ -0,0 +1,51 @@
+from djangae.environment import task_or_admin_only
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse
+
+from google.appengine.ext import deferred
+
+from . import metrics, throttle, youtube
+from .cache import PURGE_QUEUE, AnalysisCache, purge_cached_analyses
+from .cloudnlp import API_VERSION
+from .models import DeadLetter
+from .tasks import PERMANENT, QUOTA, TRANSIENT
+
+
+@task_or_admin_only
+def stats(request):
+    """
+    Returns the instrumentation counters of an app version (the running one
+    unless a `version` is passed), the cache hit rates, the adaptive
+    dispatch rates and the number of dead letters waiting to be replayed, as
+    JSON
+    """
+    version = request.GET.get('version') or metrics.current_version()
+    recorder = metrics.get_recorder(version)
+    # include what this instance hasnt flushed yet
+    recorder.flush()
+    return JsonResponse({
+        'version': version,
+        'metrics': recorder.stats(),
+        'caches': {
+            'analysis': AnalysisCache(API_VERSION).stats(),
+            'youtube': youtube.get_response_cache().stats(),
+        },
+        'dispatch_rates': dict(
+            (api, throttle.get_controller(api).rate)
+            for api in settings.API_THROTTLES),
+        'dead_letters': dict(
+            (kind, DeadLetter.objects.filter(
+                kind=kind, replayed__isnull=True).count())
+            for kind in (TRANSIENT, QUOTA, PERMANENT)),
+    })
+
+
+def purge_analysis_cache(request):
+    """
+    Cron handler that queues the deletion of expired analysis cache entries
+    """
+    # App Engine strips this header from requests that dont come from cron
+    if not request.META.get('HTTP_X_APPENGINE_CRON'):
+        return HttpResponseForbidden()
+    deferred.defer(purge_cached_analyses, _queue=PURGE_QUEUE)
+    return HttpResponse('OK')
@@ -1,70 +1,221 @@
 import logging
-import xml.etree.ElementTree as ElementTree
+import re
+from array import array
+from bisect import bisect_right
+from io import BytesIO
 
 from django.conf import settings
 
-from lxml import html
-from lxml.html.clean import clean_html
-
-from googleapiclient import discovery
+from lxml import etree
 from pytube import YouTube
 from pytube.compat import unescape
 
+from . import quota, registry, throttle
+from .cache import ResponseCache, normalize
+
 logger = logging.getLogger(__name__)
 
+API_NAME = 'youtube'
+API_VERSION = 'v3'
+TAG_RE = re.compile(r'<[^>]*>')
+
+_response_cache = None
+
+
+def get_response_cache():
+    """
+    Returns the search response cache, which is shared by every client in
+    the instance so that its in-process tier outlives each request
+    """
+    global _response_cache
+    if _response_cache is None:
+        _response_cache = ResponseCache(
+            'youtube-responses', settings.YOUTUBE_SEARCH_CACHE_TIMEOUT,
+            max_entries=settings.YOUTUBE_SEARCH_CACHE_SIZE)
+    return _response_cache
+
+
+class Captions(object):
+    """
+    Timed captions for a video. Alongside the flat transcript, each cue's
+    start time and duration (in seconds) and the character offset its text
+    starts at within the transcript are held in parallel arrays.
+    """
+    def __init__(self, transcript, starts, durations, offsets):
+        self.transcript = transcript
+        self.starts = starts
+        self.durations = durations
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def cue_at(self, offset):
+        """
+        Returns the index of the cue containing the passed transcript offset
+        """
+        return max(0, bisect_right(self.offsets, offset) - 1)
+
+    def time_at(self, offset):
+        """
+        Returns the time in seconds that the passed transcript offset is
+        spoken at
+        """
+        return self.starts[self.cue_at(offset)] if len(self) else 0.0
+
+    def to_dict(self):
+        return {
+            'start': [round(s, 3) for s in self.starts],
+            'duration': [round(d, 3) for d in self.durations],
+            'offset': list(self.offsets),
+        }
+
+    @classmethod
+    def from_dict(cls, transcript, data):
+        return cls(
+            transcript,
+            array('d', data.get('start', [])),
+            array('d', data.get('duration', [])),
+            array('l', data.get('offset', [])))
+
+
+def parse_captions(xml):
+    """
+    Streams through YouTube's timed caption XML, building a Captions instance
+    from it. Each cue is unescaped, stripped of html and discarded as soon as
+    it has been read so only the transcript text and timings are kept.
+    """
+    if isinstance(xml, unicode):
+        xml = xml.encode('utf-8')
+    starts = array('d')
+    durations = array('d')
+    offsets = array('l')
+    parts = []
+    length = 0
+    for _, element in etree.iterparse(BytesIO(xml), tag='text'):
+        text = element.text or u''
+        start = float(element.get('start', 0))
+        duration = float(element.get('dur', 0))
+        element.clear()
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+
+        text = unescape(text.replace('\n', ' ').replace('  ', ' '))
+        if u'<' in text:
+            text = TAG_RE.sub(u'', text)
+        text = text.strip()
+        if not text:
+            continue
+        if parts:
+            length += 1
+        starts.append(start)
+        durations.append(duration)
+        offsets.append(length)
+        parts.append(text)
+        length += len(text)
+    return Captions(u' '.join(parts), starts, durations, offsets)
+
 
 class Client(object):
     """
     Wrapper around the YouTube data API
     """
-    def __init__(self, service=None):
+    def __init__(self, service=None, cache=True):
         if service is None:  # pragma: no cover
-            service = discovery.build(
-                'youtube', 'v3', developerKey=settings.YOUTUBE_API_KEY)
+            service = registry.get_service(
+                API_NAME, API_VERSION, settings.YOUTUBE_API_KEY)
         self.service = service
+        self.cache = get_response_cache() if cache else None
 
     def search(self, query, part="id", max_results=50):
         """
-        Searches YouTube based on the passed data
+        Searches YouTube based on the passed data. Results are served from the
+        response cache where the same search has been made recently, and
+        identical searches made at the same time share one upstream call.
         """
-        results = self.service.search().list(
-            q=query,
-            part=part,
-            maxResults=max_results,
-            type="video"
-        ).execute()
+        if self.cache is None:
+            return self._search(query, part, max_results)
+        return self.cache.get_or_call(
+            ('search', normalize(query).lower(), part, max_results),
+            lambda: self._search(query, part, max_results),
+            cost=sum(quota.COSTS[API_NAME][method]
+                     for method in ('search.list', 'videos.list')))
+
+    def _search(self, query, part, max_results):
+        quota.acquire(API_NAME, 'search.list')
+        results = throttle.execute(
+            API_NAME, 'search.list', self.service.search().list(
+                q=query,
+                part=part,
+                maxResults=max_results,
+                type="video"))
         results = results.get('items', [])
         if results:
-            return self.get(
+            return self._get(
                 ','.join(i['id']['videoId'] for i in results))
         return []
 
     def get(self, video_ids, part="snippet,statistics"):
         """
-        Searches YouTube based on the passed data
+        Searches YouTube based on the passed data, through the response cache
         """
-        results = self.service.videos().list(
-            id=video_ids,
-            part=part,
-        ).execute()
+        if self.cache is None:
+            return self._get(video_ids, part)
+        return self.cache.get_or_call(
+            ('videos', sorted(video_ids.split(',')), part),
+            lambda: self._get(video_ids, part),
+            cost=quota.COSTS[API_NAME]['videos.list'])
+
+    def _get(self, video_ids, part="snippet,statistics"):
+        quota.acquire(API_NAME, 'videos.list')
+        results = throttle.execute(
+            API_NAME, 'videos.list', self.service.videos().list(
+                id=video_ids,
+                part=part))
         return results.get('items', [])
 
-    def get_video_comments(self, video_id, max_results=50, order="relevance"):
+    def get_video_comments(
+            self, video_id, max_results=100, order="relevance",
+            page_token=None, max_pages=None, max_comments=None):
         """
-        Retrieves comments for a video
+        Generator that pages through the comments for a video, following
+        `nextPageToken` until the results are exhausted or one of the caps is
+        reached. Each iteration yields a tuple of the page's comment threads
+        and the token for the page after it (None on the final page), so
+        callers can checkpoint their progress and resume from `page_token`.
         """
-        results = self.service.commentThreads().list(
-            part="snippet",
-            videoId=video_id,
-            textFormat="html",
-            maxResults=max_results,
-            order=order,
-        ).execute()
-        return results.get('items', [])
+        pages = 0
+        total = 0
+        while True:
+            params = dict(
+                part="snippet",
+                videoId=video_id,
+                textFormat="html",
+                maxResults=max_results,
+                order=order)
+            if page_token:
+                params['pageToken'] = page_token
+            quota.acquire(API_NAME, 'commentThreads.list')
+            results = throttle.execute(
+                API_NAME, 'commentThreads.list',
+                self.service.commentThreads().list(**params))
+            items = results.get('items', [])
+            page_token = results.get('nextPageToken')
+            pages += 1
+            total += len(items)
+            if max_comments is not None and total >= max_comments:
+                items = items[:len(items) - (total - max_comments)]
+                page_token = None
+            yield items, page_token
+            if not page_token:
+                return
+            if max_pages is not None and pages >= max_pages:
+                return
 
-    def get_video_transcript(self, video_id):
+    def get_video_captions(self, video_id):
         """
-        Retrieves and formats transcripts for the passed video
+        Retrieves the english captions for the passed video, returning a
+        Captions instance or None if there arent any.
 
         TODO: If no captions are available, download audio track and pass into
         Cloud Speech-to-Text? for now we just return None implying that we cant
@@ -75,18 +226,13 @@ class Client(object):
         if not captions:
             logger.info('Unable to return transcript for video %r!', video_id)
             return
+        return parse_captions(captions.xml_captions)
 
-        # format captions as plaintext and strip trailing whitespace and html
-        try:
-            captions = ElementTree.fromstring(captions.xml_captions)
-        except UnicodeEncodeError:
-            xml = captions.xml_captions.encode("utf-8")
-            captions = ElementTree.fromstring(xml)
-        captions_list = []
-        for subtitle in captions.getchildren():
-            text = subtitle.text or u''
-            caption = unescape(text.replace('\n', ' ').replace('  ', ' '))
-            captions_list.append(u"{text} ".format(text=caption))
-        transcript = clean_html(
-            html.fromstring(u''.join(captions_list).strip()))
-        return transcript.text_content().strip()
+    def get_video_transcript(self, video_id):
+        """
+        Retrieves and formats transcripts for the passed video
+        """
+        captions = self.get_video_captions(video_id)
+        if captions is None:
+            return
+        return captions.transcript
@@ -0,0 +1,163 @@
+import json
+import logging
+from collections import Counter
+
+from djangae.db.backends.appengine import caching
+from django.conf import settings
+
+from google.appengine.api import datastore
+from google.appengine.ext import deferred
+
+from projects.tasks import rebuild_project_summaries
+from services import throttle
+
+from .utils import (
+    comment_count_corrections,
+    sentence_histogram,
+    sentiment_timeline,
+    update_comment_counts
+)
+
+logger = logging.getLogger(__name__)
+
+# backfills are background work, see queue.yaml
+BACKFILL_QUEUE = throttle.lane_queue('videos', throttle.BACKGROUND)
+BACKFILL_BATCH_SIZE = 100
+# transcripts can run to megabytes so fewer videos are loaded at a time
+TRANSCRIPT_BATCH_SIZE = 20
+# properties of videos stored before their transcripts moved to
+# VideoTranscript
+LEGACY_TRANSCRIPT_PROPERTIES = (
+    'transcript', 'transcript_cues', 'analyzed_transcript')
+
+
+def backfill_comment_counts(
+        after=None, video_pk=None, comment_pk=None, labels=None):
+    """
+    Migrates comments and videos stored before comments had a stored
+    sentiment label and videos counted them. Works through the videos in pk
+    order, a batch of comments per task, re-saving each comment so that its
+    label is stored. Once all of a video's comments are done its counters
+    are corrected from their labels, see update_comment_counts for when
+    they reach the project. The project summaries are rebuilt after the
+    last video. Start it from a shell with
+    `deferred.defer(backfill_comment_counts, _queue=BACKFILL_QUEUE)`.
+    """
+    from .models import Video, VideoComment  # avoid circular imports
+    video = None
+    if video_pk is not None:
+        video = Video.objects.filter(pk=video_pk).first()
+        after = video_pk
+    if video is None:
+        labels = None
+        videos = Video.objects.order_by('pk')
+        if after is not None:
+            videos = videos.filter(pk__gt=after)
+        video = videos.first()
+    if video is None:
+        logger.info('Finished backfilling comment counts')
+        deferred.defer(rebuild_project_summaries, _queue='summaries')
+        return
+
+    labels = Counter(labels or {})
+    comments = VideoComment.objects.filter(video=video).order_by('pk')
+    if comment_pk is not None:
+        comments = comments.filter(pk__gt=comment_pk)
+    comments = list(comments[:BACKFILL_BATCH_SIZE])
+    for comment in comments:
+        # save stores the label worked out from the analysis
+        comment.save()
+        labels[comment.sentiment_label] += 1
+    if len(comments) == BACKFILL_BATCH_SIZE:
+        deferred.defer(
+            backfill_comment_counts, video_pk=video.pk,
+            comment_pk=comments[-1].pk, labels=dict(labels),
+            _queue=BACKFILL_QUEUE)
+        return
+
+    # the counters may have moved on while the comments were saved
+    video.refresh_from_db()
+    update_comment_counts(video.pk, comment_count_corrections(video, labels))
+    deferred.defer(
+        backfill_comment_counts, after=video.pk, _queue=BACKFILL_QUEUE)
+
+
+def legacy_json(value):
+    """
+    Returns the value of a legacy JSONField property, which is stored as a
+    JSON string
+    """
+    if isinstance(value, basestring):
+        return json.loads(value) if value else None
+    return value
+
+
+def _remove_legacy_properties(key):
+    entity = datastore.Get(key)
+    for name in LEGACY_TRANSCRIPT_PROPERTIES:
+        entity.pop(name, None)
+    datastore.Put(entity)
+
+
+def migrate_transcript(entity):
+    """
+    Moves the transcript, caption cues and transcript analysis of a legacy
+    Video entity into a VideoTranscript, sets the transcript fields that
+    have since been added to the video from them and deletes the old
+    properties from the entity.
+    """
+    from .models import Video, VideoTranscript  # avoid circular imports
+    video_pk = entity.key().id()
+    text = entity.get('transcript') or u''
+    analysis = legacy_json(entity.get('analyzed_transcript'))
+    fields = {}
+    if text:
+        transcript = VideoTranscript(
+            video_id=video_pk, text=text,
+            cues=legacy_json(entity.get('transcript_cues')))
+        transcript.analysis = analysis
+        transcript.save()
+        fields['has_transcript'] = True
+        if analysis:
+            fields['transcript_analyzed'] = True
+            fields['transcript_histogram'] = sentence_histogram(analysis)
+            captions = transcript.captions
+            if captions is not None:
+                fields['transcript_timeline'] = sentiment_timeline(
+                    analysis, captions, settings.TRANSCRIPT_TIMELINE_WINDOW)
+    if fields:
+        # update rather than save so we dont clobber the fields written by
+        # tasks running alongside us
+        Video.objects.filter(pk=video_pk).update(**fields)
+    datastore.RunInTransaction(_remove_legacy_properties, entity.key())
+    # the entity was written behind djangae's back
+    caching.remove_entities_from_cache_by_key([entity.key()], None)
+
+
+def backfill_transcripts(after=None):
+    """
+    Migrates the transcripts of videos stored before they moved to
+    VideoTranscript, a batch of videos per task in pk order, see
+    migrate_transcript. The project summaries are rebuilt after the last
+    batch so that the migrated transcript analyses are counted. Start it
+    from a shell with
+    `deferred.defer(backfill_transcripts, _queue=BACKFILL_QUEUE)`.
+    """
+    from .models import Video  # avoid circular imports
+    videos = Video.objects.order_by('pk')
+    if after is not None:
+        videos = videos.filter(pk__gt=after)
+    pks = list(videos.values_list('pk', flat=True)[:TRANSCRIPT_BATCH_SIZE])
+    if not pks:
+        logger.info('Finished backfilling transcripts')
+        deferred.defer(rebuild_project_summaries, _queue='summaries')
+        return
+    kind = Video._meta.db_table
+    entities = datastore.Get(
+        [datastore.Key.from_path(kind, pk) for pk in pks])
+    for entity in entities:
+        if entity is None:
+            continue
+        if any(name in entity for name in LEGACY_TRANSCRIPT_PROPERTIES):
+            migrate_transcript(entity)
+    deferred.defer(backfill_transcripts, after=pks[-1], _queue=BACKFILL_QUEUE)
@@ -1,5 +1,4 @@
 from django import forms
-from django.forms import formset_factory
 
 
 class YouTubeVideoSearchForm(forms.Form):
@@ -9,29 +8,19 @@ class YouTubeVideoSearchForm(forms.Form):
     keywords = forms.CharField(max_length=100)
 
 
-class YouTubeVideoForm(forms.Form):
+class YouTubeVideoAddForm(forms.Form):
     """
-    Form representing a single video response from the YouTube search. This
-    form is used as part of the YouTubeVideoFormSet which allows us to add
-    videos to a project in bulk
+    Form to add videos from a YouTube search to a project. The search results
+    are held server side under `token`, so only the token and the ids of the
+    selected videos are posted. Pass the stored results as `videos` to limit
+    the ids to those returned by the search.
     """
-    add = forms.BooleanField(
-        label="", initial=False, required=False,
-        widget=forms.CheckboxInput(attrs={'class': 'mdl-checkbox__input'}))
-    youtube_id = forms.CharField(max_length=25, widget=forms.HiddenInput())
-    name = forms.CharField(max_length=255, widget=forms.HiddenInput())
-    description = forms.CharField(
-        label="", required=False, widget=forms.Textarea(attrs={'hidden': ''}))
-    published = forms.DateTimeField(widget=forms.HiddenInput())
-    thumbnail_default = forms.CharField(
-        max_length=255, widget=forms.HiddenInput())
-    thumbnail_medium = forms.CharField(
-        max_length=255, widget=forms.HiddenInput())
-    thumbnail_high = forms.CharField(
-        max_length=255, widget=forms.HiddenInput())
-    likes = forms.IntegerField(widget=forms.HiddenInput())
-    dislikes = forms.IntegerField(widget=forms.HiddenInput())
-    comment_count = forms.IntegerField(widget=forms.HiddenInput())
+    token = forms.CharField(max_length=32, widget=forms.HiddenInput())
+    youtube_id = forms.MultipleChoiceField(
+        required=False, widget=forms.CheckboxSelectMultiple())
 
-
-YouTubeVideoFormSet = formset_factory(YouTubeVideoForm, extra=0)
+    def __init__(self, *args, **kwargs):
+        videos = kwargs.pop('videos', None) or []
+        super(YouTubeVideoAddForm, self).__init__(*args, **kwargs)
+        self.fields['youtube_id'].choices = [
+            (video['youtube_id'], video['name']) for video in videos]
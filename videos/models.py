@@ -3,9 +3,26 @@ from django.contrib.auth import get_user_model
 from django.db import models
 from django.db.models.signals import post_save
 
+from core.fields import CompressedJSONField, CompressedTextField
 from projects.models import Project
-
-from .signals import import_youtube_comments
+from services.youtube import Captions
+
+from .signals import add_to_project_summary, import_youtube_comments
+from .utils import pack_analysis, unpack_analysis
+
+SENTIMENT_LABEL_CHOICES = (
+    ('positive', 'Positive'),
+    ('negative', 'Negative'),
+    ('neutral', 'Neutral'),
+    ('failed', 'Failed'),
+    ('pending', 'Pending'),
+)
+PROCESSING_STATE_CHOICES = (
+    ('', 'Unknown'),
+    ('processing', 'Processing'),
+    ('finalizing', 'Finalizing'),
+    ('complete', 'Complete'),
+)
 
 
 class Video(models.Model):
@@ -17,13 +34,20 @@ class Video(models.Model):
     # overall video sentiment analysis
     sentiment = models.FloatField(default=0)
     magnitude = models.FloatField(default=0)
-    analyzed_transcript = JSONField(blank=True, null=True)
+    # the transcript itself and its analysis live in VideoTranscript
+    has_transcript = models.BooleanField(default=False)
+    transcript_analyzed = models.BooleanField(default=False)
+    # sentence sentiment counts and score distribution of the transcript, see
+    # videos.utils.sentence_histogram
+    transcript_histogram = JSONField(blank=True, null=True)
+    # transcript sentiment bucketed into fixed time windows, see
+    # videos.utils.sentiment_timeline
+    transcript_timeline = JSONField(blank=True, null=True)
     transcript_failed = models.BooleanField(default=False)
     # you tube specific data
     youtube_id = models.CharField(max_length=25)
     name = models.CharField(max_length=255)
     description = models.TextField(blank=True)
-    transcript = models.TextField(blank=True)
     published = models.DateTimeField()
     thumbnail_default = models.CharField(max_length=255)
     thumbnail_medium = models.CharField(max_length=255)
@@ -31,39 +55,116 @@ class Video(models.Model):
     likes = models.PositiveIntegerField(default=0)
     dislikes = models.PositiveIntegerField(default=0)
     comment_count = models.PositiveIntegerField(default=0)
+    # comment import progress
+    comments_page_token = models.CharField(max_length=255, blank=True)
+    comments_imported = models.BooleanField(default=False)
+    # comment resync progress, the newest comment update held when the
+    # resync started and the token of the next page, kept until it finishes
+    # so that a retried resync carries on from the same point
+    comments_resyncing = models.BooleanField(default=False)
+    resync_watermark = models.DateTimeField(blank=True, null=True)
+    resync_page_token = models.CharField(max_length=255, blank=True)
+    # comment sentiment counters, maintained as comments are imported and
+    # analyzed, see videos.utils.update_comment_counts
+    comments_total = models.PositiveIntegerField(default=0)
+    comments_positive = models.PositiveIntegerField(default=0)
+    comments_negative = models.PositiveIntegerField(default=0)
+    comments_neutral = models.PositiveIntegerField(default=0)
+    comments_failed = models.PositiveIntegerField(default=0)
+    # changes to the comment counters not yet rolled up into the project
+    # summary, see videos.utils.roll_up_comment_counts
+    comment_counts_pending = JSONField(blank=True, null=True)
+    # processing pipeline progress, see videos.pipeline. pipeline_pending
+    # counts the tasks queued or running and stage_timings holds the task
+    # count, busy seconds and first start and last finish of each stage
+    processing_state = models.CharField(
+        max_length=10, choices=PROCESSING_STATE_CHOICES, blank=True)
+    pipeline_pending = models.PositiveIntegerField(default=0)
+    processing_started = models.DateTimeField(blank=True, null=True)
+    processing_completed = models.DateTimeField(blank=True, null=True)
+    stage_timings = JSONField(blank=True, null=True)
 
     def __unicode__(self):
         return u'{}'.format(self.name)
 
     @property
     def analysis_complete(self):
-        if self.analyzed_transcript:
-            return True
-        return False
+        return self.transcript_analyzed
 
     @property
     def can_be_analyzed(self):
         """
         Videos can only be analyzed if they have a transcript available.
         """
-        if self.transcript:
-            return True
-        return False
+        return self.has_transcript
+
+    def get_transcript(self):
+        """
+        Loads the video's VideoTranscript, or returns None if it doesnt have
+        one yet.
+        """
+        try:
+            return VideoTranscript.objects.get(pk=self.pk)
+        except VideoTranscript.DoesNotExist:
+            return None
+
+    @property
+    def processing_complete(self):
+        return self.processing_state == 'complete'
+
+    @property
+    def comments_analyzed(self):
+        return (
+            self.comments_positive + self.comments_negative +
+            self.comments_neutral)
 
     @property
     def comment_analysis_complete(self):
         """
         Returns True if all the videos comments have been analyzed
         """
-        for comment in self.videocomment_set.all():
-            if not comment.analysis_complete:
-                return False
-        return True
+        return self.comments_analyzed >= self.comments_total
 
     class Meta:
         ordering = ['-published']
 
 
+class VideoTranscript(models.Model):
+    """
+    The transcript of a Video and its sentiment analysis. These can run to
+    megabytes for long videos so they are kept compressed in their own
+    entity, and only loaded when they are actually needed.
+    """
+    video = models.OneToOneField(Video, primary_key=True)
+    text = CompressedTextField()
+    # caption cue timings as parallel lists of start, duration and transcript
+    # offset, see services.youtube.Captions
+    cues = CompressedJSONField(null=True)
+    # packed with videos.utils.pack_analysis, use the analysis property
+    analysis_data = CompressedJSONField(null=True)
+
+    def __unicode__(self):
+        return u'Video: {} Transcript'.format(self.video_id)
+
+    @property
+    def analysis(self):
+        return unpack_analysis(self.analysis_data, self.text)
+
+    @analysis.setter
+    def analysis(self, analysis):
+        self.analysis_data = pack_analysis(analysis, self.text)
+
+    @property
+    def captions(self):
+        """
+        Returns the timed captions for the transcript, or None if we dont
+        have cue timings for it.
+        """
+        if not self.text or not self.cues:
+            return None
+        return Captions.from_dict(self.text, self.cues)
+
+
 class VideoComment(models.Model):
     """
     Represents a user's comment on a Video
@@ -72,8 +173,13 @@ class VideoComment(models.Model):
     # overall comment sentiment analysis
     sentiment = models.FloatField(default=0)
     magnitude = models.FloatField(default=0)
+    # packed with videos.utils.pack_analysis, use the analysis property
     analyzed_comment = JSONField(blank=True, null=True)
     analysis_failed = models.BooleanField(default=False)
+    # derived from the fields above on save so the comment list can be
+    # filtered with an equality filter, see get_sentiment_label
+    sentiment_label = models.CharField(
+        max_length=10, choices=SENTIMENT_LABEL_CHOICES, default='pending')
     # you tube specific data
     youtube_id = models.CharField(max_length=100)
     author_display_name = models.CharField(max_length=100)
@@ -86,6 +192,27 @@ class VideoComment(models.Model):
     def __unicode__(self):
         return u'Video: {} Comment: {}'.format(self.video_id, self.comment_raw)
 
+    def save(self, *args, **kwargs):
+        self.sentiment_label = self.get_sentiment_label()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {'sentiment_label'}
+        return super(VideoComment, self).save(*args, **kwargs)
+
+    def get_sentiment_label(self):
+        """
+        Returns the sentiment label the comment should be listed under
+        """
+        if self.analysis_failed:
+            return 'failed'
+        if not self.analyzed_comment:
+            return 'pending'
+        if self.sentiment > 0:
+            return 'positive'
+        if self.sentiment < 0:
+            return 'negative'
+        return 'neutral'
+
     @property
     def analysis_complete(self):
         """
@@ -95,6 +222,14 @@ class VideoComment(models.Model):
             return True
         return False
 
+    @property
+    def analysis(self):
+        return unpack_analysis(self.analyzed_comment, self.comment_raw)
+
+    @analysis.setter
+    def analysis(self, analysis):
+        self.analyzed_comment = pack_analysis(analysis, self.comment_raw)
+
     class Meta:
         ordering = ['-updated', '-published']
 
@@ -103,3 +238,6 @@ class VideoComment(models.Model):
 post_save.connect(
     import_youtube_comments, sender=Video,
     dispatch_uid='import_youtube_comments')
+post_save.connect(
+    add_to_project_summary, sender=Video,
+    dispatch_uid='add_to_project_summary')
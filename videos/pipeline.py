@@ -0,0 +1,183 @@
+import logging
+import time
+from collections import Counter
+
+from djangae.db import transaction
+from django.utils import timezone
+
+from google.appengine.ext import deferred
+
+from accounts.utils import do_with_retry
+
+from .utils import (
+    comment_count_corrections,
+    roll_up_comment_counts,
+    update_comment_counts
+)
+
+logger = logging.getLogger(__name__)
+
+# processing states, see Video.processing_state
+PROCESSING = 'processing'
+FINALIZING = 'finalizing'
+COMPLETE = 'complete'
+# states of a run that is yet to complete, and roll up its video's comment
+# counters when it does
+IN_PROGRESS = (PROCESSING, FINALIZING)
+
+# pipeline stages, each made up of one or more deferred tasks
+IMPORT_COMMENTS = 'import_comments'
+RESYNC_COMMENTS = 'resync_comments'
+IMPORT_TRANSCRIPT = 'import_transcript'
+ANALYZE_COMMENTS = 'analyze_comments'
+ANALYZE_TRANSCRIPT = 'analyze_transcript'
+
+# a new video starts out with its comment and transcript imports
+INITIAL_TASKS = 2
+
+
+def initial_fields(tasks=INITIAL_TASKS):
+    """
+    Returns the Video field values of a pipeline that has just started with
+    `tasks` tasks queued
+    """
+    return {
+        'processing_state': PROCESSING,
+        'pipeline_pending': tasks,
+        'processing_started': timezone.now(),
+        'processing_completed': None,
+        'stage_timings': {},
+    }
+
+
+def _start(video_pk, tasks):
+    from .models import Video  # avoid circular imports
+    with transaction.atomic():
+        try:
+            video = Video.objects.get(pk=video_pk)
+        except Video.DoesNotExist:
+            return
+        if video.processing_state == PROCESSING:
+            video.pipeline_pending += tasks
+            video.save(update_fields=['pipeline_pending'])
+            return
+        fields = initial_fields(tasks)
+        for field, value in fields.items():
+            setattr(video, field, value)
+        video.save(update_fields=list(fields))
+
+
+def start(video_pk, tasks=INITIAL_TASKS):
+    """
+    Starts a run of the processing pipeline for a video, or adds `tasks` to
+    the run in progress. Call before the tasks are queued.
+    """
+    do_with_retry(_start, video_pk, tasks)
+
+
+def _fan_out(video_pk, tasks):
+    from .models import Video  # avoid circular imports
+    with transaction.atomic():
+        try:
+            video = Video.objects.get(pk=video_pk)
+        except Video.DoesNotExist:
+            return
+        if video.processing_state != PROCESSING:
+            return
+        video.pipeline_pending += tasks
+        video.save(update_fields=['pipeline_pending'])
+
+
+def fan_out(video_pk, tasks=1):
+    """
+    Counts `tasks` more tasks in the video's pipeline run. Tasks must call
+    this before queuing the tasks they fan out to, and before they finish
+    themselves, so that the run cant complete while work is outstanding.
+    """
+    do_with_retry(_fan_out, video_pk, tasks)
+
+
+def _finish(video_pk, stage, started, finished):
+    from .models import Video  # avoid circular imports
+    with transaction.atomic():
+        try:
+            video = Video.objects.get(pk=video_pk)
+        except Video.DoesNotExist:
+            return
+        if video.processing_state != PROCESSING:
+            # videos from before the pipeline, or a duplicate task
+            return
+        timings = video.stage_timings or {}
+        timing = timings.setdefault(stage, {
+            'tasks': 0, 'seconds': 0,
+            'started': started, 'finished': finished})
+        timing['tasks'] += 1
+        timing['seconds'] = round(timing['seconds'] + finished - started, 3)
+        timing['started'] = min(timing['started'], started)
+        timing['finished'] = max(timing['finished'], finished)
+        video.stage_timings = timings
+        video.pipeline_pending = max(0, video.pipeline_pending - 1)
+        fields = ['pipeline_pending', 'stage_timings']
+        if not video.pipeline_pending:
+            # fan in, only the transaction that takes the count to zero
+            # gets here so the completion hook is queued exactly once
+            video.processing_state = FINALIZING
+            fields.append('processing_state')
+            deferred.defer(
+                complete, video.pk, _queue='videos', _transactional=True)
+        video.save(update_fields=fields)
+
+
+def finish(video_pk, stage, started):
+    """
+    Records a task of the passed stage, started at `started` (a unix
+    timestamp), as done. Tasks call this once they are finished with, but
+    not when they requeue themselves to carry on later. When the last task
+    of the run finishes the completion hook is queued.
+    """
+    do_with_retry(_finish, video_pk, stage, started, time.time())
+
+
+def _mark_complete(video_pk):
+    from .models import Video  # avoid circular imports
+    with transaction.atomic():
+        try:
+            video = Video.objects.get(pk=video_pk)
+        except Video.DoesNotExist:
+            return
+        if video.processing_state != FINALIZING:
+            # another run started while we were finalizing
+            return
+        video.processing_state = COMPLETE
+        video.processing_completed = timezone.now()
+        video.save(
+            update_fields=['processing_state', 'processing_completed'])
+
+
+def complete(video_pk):
+    """
+    Completion hook, run once the last task of a video's pipeline run has
+    finished. Recounts the comment counters from the comments themselves,
+    correcting any drift in the running counts, rolls them up into the
+    project summary and marks the video as complete.
+    """
+    from .models import Video, VideoComment  # avoid circular imports
+    try:
+        video = Video.objects.get(pk=video_pk)
+    except Video.DoesNotExist:
+        logger.info('Video %r no longer exists! Cant complete', video_pk)
+        return
+    if video.processing_state != FINALIZING:
+        return
+    # unordered so that the (video_id, sentiment_label) index serves the query
+    comments = VideoComment.objects.filter(video=video).order_by()
+    labels = Counter(comments.values_list('sentiment_label', flat=True))
+    counts = comment_count_corrections(video, labels)
+    if any(counts.values()):
+        logger.warning(
+            'Correcting comment counters for video %r by %r',
+            video.youtube_id, dict(counts))
+    update_comment_counts(video.pk, counts)
+    roll_up_comment_counts(video.pk)
+    do_with_retry(_mark_complete, video.pk)
+    logger.info('Finished processing video %r', video.youtube_id)
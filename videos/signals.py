@@ -1,7 +1,12 @@
 import logging
+from collections import Counter
 
 from google.appengine.ext import deferred
 
+from projects.utils import update_project_summary
+from services import throttle
+
+from . import pipeline
 from .tasks import youtube_import_comments, youtube_import_transcript
 
 logger = logging.getLogger(__name__)
@@ -13,7 +18,20 @@ def import_youtube_comments(sender, instance, created=None, **kwargs):
     VideoComment model.
     """
     if created:
+        pipeline.start(instance.pk, pipeline.INITIAL_TASKS)
         logger.info('Retrieving comments for YouTube video %r', instance.pk)
-        deferred.defer(youtube_import_comments, instance.pk, _queue='comments')
+        throttle.defer(
+            'youtube', youtube_import_comments, instance.pk,
+            _queue='comments', _owner=instance.owner_id)
         logger.info('Retrieving transcript for YouTube video %r', instance.pk)
         deferred.defer(youtube_import_transcript, instance.pk, _queue='videos')
+
+
+def add_to_project_summary(sender, instance, created=None, **kwargs):
+    """
+    Counts a newly added video in its project's summary
+    """
+    if created:
+        update_project_summary(
+            instance.project_id, Counter(video_count=1),
+            thumbnail=instance.thumbnail_high)
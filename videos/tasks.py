@@ -1,41 +1,141 @@
 import logging
+import time
+from collections import Counter
+
+from django.conf import settings
 
 from dateutil import parser
-from google.appengine.ext import deferred
 
-from services import cloudnlp, youtube
+from projects.utils import transcript_summary, update_project_summary
+from services import sentiment, throttle, youtube
+from services.tasks import MAX_IN_VALUES, PERMANENT, classify, task
+
+from . import pipeline
+from .utils import (
+    bulk_put,
+    comment_counter,
+    count_transition,
+    sentence_histogram,
+    sentiment_timeline,
+    update_comment_counts
+)
 
 logger = logging.getLogger(__name__)
 
 
+def finish_stage(stage):
+    """
+    Returns a failure hook that finishes a video's pipeline task of the
+    passed stage
+    """
+    def on_failure(video_pk):
+        pipeline.finish(video_pk, stage, time.time())
+    return on_failure
+
+
+def mark_analysis_failed(comments):
+    """
+    Marks the passed comments as having failed analysis, returning a Counter
+    of the changes to their video's comment counters
+    """
+    counts = Counter()
+    for comment in comments:
+        before = comment_counter(comment)
+        comment.analysis_failed = True
+        comment.save()
+        count_transition(counts, before, comment_counter(comment))
+    return counts
+
+
+def comment_analysis_failed(comment_pk):
+    """
+    Failure hook of cloudnlp_analyze_comment
+    """
+    from .models import VideoComment  # avoid circular imports
+    for comment in VideoComment.objects.filter(pk=comment_pk):
+        update_comment_counts(
+            comment.video_id, mark_analysis_failed([comment]))
+
+
+def comments_analysis_failed(comment_pks):
+    """
+    Failure hook of cloudnlp_analyze_comments, marks the comments in the batch
+    that werent analyzed as failed and finishes the pipeline task
+    """
+    from .models import VideoComment  # avoid circular imports
+    comments = list(VideoComment.objects.filter(pk__in=comment_pks))
+    if not comments:
+        return
+    video_pk = comments[0].video_id
+    update_comment_counts(video_pk, mark_analysis_failed(
+        [c for c in comments if not c.analysis_complete]))
+    pipeline.finish(video_pk, pipeline.ANALYZE_COMMENTS, time.time())
+
+
+def resync_failed(video_pk):
+    """
+    Failure hook of youtube_resync_comments, clears the resync progress so
+    that the next resync starts afresh and finishes the pipeline task
+    """
+    from .models import Video  # avoid circular imports
+    Video.objects.filter(pk=video_pk).update(
+        comments_resyncing=False, resync_watermark=None,
+        resync_page_token='')
+    pipeline.finish(video_pk, pipeline.RESYNC_COMMENTS, time.time())
+
+
+def transcript_import_failed(video_pk):
+    """
+    Failure hook of youtube_import_transcript
+    """
+    from .models import Video  # avoid circular imports
+    Video.objects.filter(pk=video_pk).update(transcript_failed=True)
+    pipeline.finish(video_pk, pipeline.IMPORT_TRANSCRIPT, time.time())
+
+
+@task('analyze', on_failure=finish_stage(pipeline.ANALYZE_TRANSCRIPT))
 def cloudnlp_analyze_transcript(video_pk):
     """
     Runs video transcripts through sentiment analysis.
     """
     from .models import Video  # avoid circular imports
+    started = time.time()
     try:
         video = Video.objects.get(pk=video_pk)
     except Video.DoesNotExist:
         logger.info('Video %r no longer exists! Cant analyze!', video_pk)
         return
-    if not video.transcript:
+    transcript = video.get_transcript()
+    if transcript is None or not transcript.text:
         logger.info(
             'Video %r does not have a transcript! Cant analyze!', video_pk)
+        pipeline.finish(video.pk, pipeline.ANALYZE_TRANSCRIPT, started)
         return
-    try:
-        client = cloudnlp.Client()
-        analysis = client.analyze_sentiment(video.transcript)
-    except Exception:
-        logger.exception(
-            'Error performing sentiment analysis on transcript for video %r',
-            video.youtube_id)
-        return
-    video.analyzed_transcript = analysis
+    client = sentiment.get_client(video.project.sentiment_backend)
+    analysis = client.analyze_sentiment(transcript.text)
+    before = transcript_summary(video)
+    transcript.analysis = analysis
+    transcript.save()
+    video.transcript_analyzed = True
     video.sentiment = analysis['documentSentiment']['score']
     video.magnitude = analysis['documentSentiment']['magnitude']
-    video.save()
+    video.transcript_histogram = sentence_histogram(analysis)
+    captions = transcript.captions
+    if captions is not None:
+        video.transcript_timeline = sentiment_timeline(
+            analysis, captions, settings.TRANSCRIPT_TIMELINE_WINDOW)
+    # only write our own fields so we dont clobber the comment import's
+    # progress, which is updated alongside us
+    video.save(update_fields=[
+        'transcript_analyzed', 'sentiment', 'magnitude',
+        'transcript_histogram', 'transcript_timeline'])
+    counts = transcript_summary(video)
+    counts.subtract(before)
+    update_project_summary(video.project_id, counts)
+    pipeline.finish(video.pk, pipeline.ANALYZE_TRANSCRIPT, started)
 
 
+@task('analyze', on_failure=comment_analysis_failed)
 def cloudnlp_analyze_comment(comment_pk):
     """
     Runs video comments through sentiment analysis.
@@ -47,81 +147,310 @@ def cloudnlp_analyze_comment(comment_pk):
         logger.info(
             'Video comment %r no longer exists! Cant analyze!', comment_pk)
         return
-    try:
-        client = cloudnlp.Client()
-        analysis = client.analyze_sentiment(comment.comment_raw)
-    except Exception:
-        comment.analysis_failed = True
-        comment.save()
-        logger.exception(
-            'Error performing sentiment analysis on comment %r',
-            comment.youtube_id)
-        return
-    comment.analyzed_comment = analysis
+    before = comment_counter(comment)
+    client = sentiment.get_client(comment.video.project.sentiment_backend)
+    analysis = client.analyze_sentiment(comment.comment_raw)
+    comment.analysis = analysis
     comment.sentiment = analysis['documentSentiment']['score']
     comment.magnitude = analysis['documentSentiment']['magnitude']
     comment.save()
+    update_comment_counts(comment.video_id, count_transition(
+        Counter(), before, comment_counter(comment)))
+
 
+@task('analyze', on_failure=comments_analysis_failed)
+def cloudnlp_analyze_comments(comment_pks):
+    """
+    Runs a batch of video comments through sentiment analysis, packing them
+    into as few API calls as possible. Comments that cant be split cleanly
+    back out of a batch are analyzed individually.
+    """
+    from .models import VideoComment  # avoid circular imports
+    started = time.time()
+    comments = list(VideoComment.objects.filter(pk__in=comment_pks))
+    if not comments:
+        logger.info(
+            'Video comments %r no longer exist! Cant analyze!', comment_pks)
+        return
+    # batches are always made up of comments from a single video
+    video_pk = comments[0].video_id
+    # comments analyzed by an earlier attempt at the batch are skipped
+    comments = [c for c in comments if not c.analysis_complete]
+    if comments:
+        analyze_comments(comments)
+    pipeline.finish(video_pk, pipeline.ANALYZE_COMMENTS, started)
+
+
+def analyze_comments(comments):
+    """
+    Analyzes a list of comments from a single video. Comments the batch
+    couldnt be split back out for, or all of them if the batch fails with a
+    permanent error, are analyzed individually. Comments that fail to
+    be analyzed individually with a permanent error are marked as failed,
+    any other error is raised once the comments analyzed so far have been
+    counted.
+    """
+    client = sentiment.get_client(comments[0].video.project.sentiment_backend)
+    try:
+        analyses = client.analyze_sentiment_batch(
+            [c.comment_raw for c in comments])
+    except Exception as e:
+        if classify(e) != PERMANENT:
+            raise
+        # the batch itself was rejected, analyze the comments individually
+        logger.exception(
+            'Error performing batched sentiment analysis on %s comments',
+            len(comments))
+        analyses = [None] * len(comments)
+    counts = Counter()
+    try:
+        for comment, analysis in zip(comments, analyses):
+            before = comment_counter(comment)
+            if analysis is None:
+                try:
+                    analysis = client.analyze_sentiment(comment.comment_raw)
+                except Exception as e:
+                    if classify(e) != PERMANENT:
+                        raise
+                    logger.exception(
+                        'Error performing sentiment analysis on comment %r',
+                        comment.youtube_id)
+                    counts.update(mark_analysis_failed([comment]))
+                    continue
+            comment.analysis = analysis
+            comment.sentiment = analysis['documentSentiment']['score']
+            comment.magnitude = analysis['documentSentiment']['magnitude']
+            comment.save()
+            count_transition(counts, before, comment_counter(comment))
+    finally:
+        # one counter update for the whole batch keeps writes to the video
+        # low
+        update_comment_counts(comments[0].video_id, counts)
+
+
+def update_comment(comment, thread):
+    """
+    Copies the data from a YouTube comment thread resource onto the passed
+    (unsaved) VideoComment and returns it.
+    """
+    data = thread['snippet']['topLevelComment']['snippet']
+    comment.youtube_id = thread['snippet']['topLevelComment']['id']
+    comment.author_display_name = data['authorDisplayName']
+    comment.author_profile_image_url = data['authorProfileImageUrl']
+    comment.comment_raw = data['textOriginal']
+    comment.comment_rich = data['textDisplay']
+    comment.published = parser.parse(data['publishedAt'])
+    comment.updated = parser.parse(data['updatedAt'])
+    return comment
+
+
+def stored_comments(video, threads):
+    """
+    Returns the comments of the video already stored for the passed YouTube
+    comment threads, by their YouTube id
+    """
+    from .models import VideoComment  # avoid circular imports
+    youtube_ids = [t['snippet']['topLevelComment']['id'] for t in threads]
+    stored = {}
+    for i in range(0, len(youtube_ids), MAX_IN_VALUES):
+        # unordered so that the built in indexes serve the query
+        stored.update((c.youtube_id, c) for c in VideoComment.objects.filter(
+            video=video, youtube_id__in=youtube_ids[i:i + MAX_IN_VALUES]
+        ).order_by())
+    return stored
 
+
+@task('comments', on_failure=finish_stage(pipeline.IMPORT_COMMENTS))
 def youtube_import_comments(video_pk):
     """
-    Task to import YouTube comments for a video
+    Task to import YouTube comments for a video. Comments are fetched and
+    persisted a page at a time, with the token of the next page checkpointed
+    on the video after each one so that a retried task resumes where the
+    previous attempt left off rather than starting over. The page a retry
+    resumes from may already have been written by the previous attempt, so
+    comments already stored arent written again.
     """
     from .models import Video, VideoComment  # avoid circular imports
+    started = time.time()
     try:
         video = Video.objects.get(pk=video_pk)
     except Video.DoesNotExist:
         logger.info('Video {} no longer exists! Cant import comments')
         return
+    if video.comments_imported:
+        logger.info('Comments already imported for video %r', video.youtube_id)
+        return
+
+    max_comments = settings.YOUTUBE_COMMENTS_MAX_RESULTS
+    if video.comments_page_token and max_comments is not None:
+        max_comments = max(
+            0, max_comments - video.videocomment_set.count())
+    resuming = video.videocomment_set.exists()
+    client = youtube.Client()
+    pages = client.get_video_comments(
+        video.youtube_id,
+        max_results=settings.YOUTUBE_COMMENTS_PAGE_SIZE,
+        page_token=video.comments_page_token or None,
+        max_pages=settings.YOUTUBE_COMMENTS_MAX_PAGES,
+        max_comments=max_comments)
+    for page, (comments, next_page_token) in enumerate(pages):
+        stored = {}
+        if page == 0 and resuming:
+            # written by an attempt that failed before it checkpointed
+            stored = stored_comments(video, comments)
+        # each page is written with a single batched put and fanned out
+        # to a single analysis task
+        created = bulk_put([
+            update_comment(VideoComment(video=video), c)
+            for c in comments
+            if c['snippet']['topLevelComment']['id'] not in stored])
+        comment_pks = [comment.pk for comment in created]
+        update_comment_counts(
+            video.pk, Counter(comments_total=len(comment_pks)))
+        # along with any stored comments still waiting for analysis
+        comment_pks.extend(
+            c.pk for c in stored.values() if comment_counter(c) is None)
+        if comment_pks:
+            pipeline.fan_out(video.pk)
+            # the pages after the first few of a big import are backfill
+            lane = None
+            if page >= settings.YOUTUBE_COMMENTS_INTERACTIVE_PAGES:
+                lane = throttle.BACKGROUND
+            throttle.defer(
+                'language', cloudnlp_analyze_comments, comment_pks,
+                _queue='analyze', _lane=lane, _owner=video.owner_id)
+        # update rather than save so we dont clobber fields written by
+        # the transcript tasks running alongside us
+        Video.objects.filter(pk=video.pk).update(
+            comments_page_token=next_page_token or '')
+    Video.objects.filter(pk=video.pk).update(
+        comments_page_token='', comments_imported=True)
+    pipeline.finish(video.pk, pipeline.IMPORT_COMMENTS, started)
+    logger.info('Finished importing comment for video %r', video.youtube_id)
+
 
+@task('comments', on_failure=resync_failed)
+def youtube_resync_comments(video_pk):
+    """
+    Task to pick up new and edited YouTube comments for a video that has
+    already been imported. Comments are paged newest first and paging stops
+    once we reach comments published before the newest update we already
+    hold. Comments are upserted by their YouTube id and only those whose
+    text has changed are sent back for sentiment analysis. The watermark
+    is stored on the video when the resync starts, and the token of the
+    next page after each one, so that a retry carries on where the previous
+    attempt left off rather than working out a watermark from the comments
+    that attempt stored.
+    """
+    from .models import Video, VideoComment  # avoid circular imports
+    started = time.time()
     try:
-        client = youtube.Client()
-        comments = client.get_video_comments(video.youtube_id)
-    except Exception:
-        logger.exception(
-            'Error importing comments for video %r', video.youtube_id)
+        video = Video.objects.get(pk=video_pk)
+    except Video.DoesNotExist:
+        logger.info(
+            'Video %r no longer exists! Cant resync comments', video_pk)
         return
-    if comments:
+    if not video.comments_imported:
+        # the import picks up everything there is
+        logger.info(
+            'Comments still importing for video %r! Cant resync',
+            video.youtube_id)
+        pipeline.finish(video.pk, pipeline.RESYNC_COMMENTS, started)
+        return
+
+    if not video.comments_resyncing:
+        # default ordering is newest update first, which the index supports
+        latest = video.videocomment_set.first()
+        video.resync_watermark = latest.updated if latest else None
+        video.resync_page_token = ''
+        Video.objects.filter(pk=video.pk).update(
+            comments_resyncing=True, resync_watermark=video.resync_watermark,
+            resync_page_token='')
+    high_watermark = video.resync_watermark
+    client = youtube.Client()
+    pages = client.get_video_comments(
+        video.youtube_id,
+        max_results=settings.YOUTUBE_COMMENTS_PAGE_SIZE,
+        page_token=video.resync_page_token or None,
+        order="time",
+        max_pages=settings.YOUTUBE_COMMENTS_MAX_PAGES,
+        max_comments=settings.YOUTUBE_COMMENTS_MAX_RESULTS)
+    for comments, next_page_token in pages:
+        caught_up = False
+        comment_pks = []
+        created = []
+        counts = Counter()
+        stored = stored_comments(video, comments)
         for c in comments:
             data = c['snippet']['topLevelComment']['snippet']
             updated = parser.parse(data['updatedAt'])
             published = parser.parse(data['publishedAt'])
-            comment = VideoComment.objects.create(
-                video=video,
-                youtube_id=c['snippet']['topLevelComment']['id'],
-                author_display_name=data['authorDisplayName'],
-                author_profile_image_url=data['authorProfileImageUrl'],
-                comment_raw=data['textOriginal'],
-                comment_rich=data['textDisplay'],
-                published=published,
-                updated=updated)
-            deferred.defer(
-                cloudnlp_analyze_comment, comment.pk, _queue='analyze')
-    logger.info('Finished importing comment for video %r', video.youtube_id)
+            if high_watermark is not None:
+                if published <= high_watermark:
+                    caught_up = True
+                if updated <= high_watermark:
+                    continue
+            comment = stored.get(c['snippet']['topLevelComment']['id'])
+            if comment is None:
+                created.append(
+                    update_comment(VideoComment(video=video), c))
+                continue
+            changed = comment.comment_raw != data['textOriginal']
+            update_comment(comment, c)
+            if changed:
+                # back to waiting for analysis
+                count_transition(counts, comment_counter(comment), None)
+                comment.analyzed_comment = {}
+                comment.analysis_failed = False
+                comment.sentiment = 0
+                comment.magnitude = 0
+                comment_pks.append(comment.pk)
+            comment.save()
+        if created:
+            comment_pks.extend(c.pk for c in bulk_put(created))
+            counts['comments_total'] += len(created)
+        update_comment_counts(video.pk, counts)
+        if comment_pks:
+            pipeline.fan_out(video.pk)
+            throttle.defer(
+                'language', cloudnlp_analyze_comments, comment_pks,
+                _queue='analyze', _owner=video.owner_id)
+        if caught_up:
+            break
+        Video.objects.filter(pk=video.pk).update(
+            resync_page_token=next_page_token or '')
+    Video.objects.filter(pk=video.pk).update(
+        comments_resyncing=False, resync_watermark=None,
+        resync_page_token='')
+    pipeline.finish(video.pk, pipeline.RESYNC_COMMENTS, started)
+    logger.info('Finished resyncing comments for video %r', video.youtube_id)
 
 
+@task('videos', on_failure=transcript_import_failed)
 def youtube_import_transcript(video_pk):
     """
     Attempts to grab the transcript for the YouTube video.
     """
-    from .models import Video
+    from .models import Video, VideoTranscript  # avoid circular imports
+    started = time.time()
     try:
         video = Video.objects.get(pk=video_pk)
     except Video.DoesNotExist:
         logger.info('Video {} no longer exists! Cant import transcript')
         return
-    try:
-        client = youtube.Client()
-        transcript = client.get_video_transcript(video.youtube_id)
-    except Exception:
-        logger.exception(
-            'Error importing transcript for video %r', video.youtube_id)
-        return
-    if transcript:
-        video.transcript = transcript
-        video.save()
-        deferred.defer(
-            cloudnlp_analyze_transcript, video.pk, _queue='analyze')
+    client = youtube.Client()
+    captions = client.get_video_captions(video.youtube_id)
+    if captions and captions.transcript:
+        VideoTranscript(
+            video=video, text=captions.transcript,
+            cues=captions.to_dict()).save()
+        video.has_transcript = True
+        video.save(update_fields=['has_transcript'])
+        pipeline.fan_out(video.pk)
+        throttle.defer(
+            'language', cloudnlp_analyze_transcript, video.pk,
+            _queue='analyze', _owner=video.owner_id)
     else:
         video.transcript_failed = True
-        video.save()
+        video.save(update_fields=['transcript_failed'])
+    pipeline.finish(video.pk, pipeline.IMPORT_TRANSCRIPT, started)
@@ -17,3 +17,21 @@ def pie_chart(title, headers, values, width='100%', height='250px'):
         'width': width,
         'height': height,
     }
+
+
+@register.inclusion_tag('includes/timeline_chart.html')
+def timeline_chart(title, timeline, width='100%', height='250px'):
+    """
+    Returns a line chart of sentiment over time for the passed timeline, see
+    videos.utils.sentiment_timeline
+    """
+    window = timeline['window']
+    return {
+        'id': slugify(title),
+        'title': title,
+        'rows': [
+            (round(i * window / 60.0, 2), score)
+            for i, score in enumerate(timeline['score'])],
+        'width': width,
+        'height': height,
+    }
@@ -0,0 +1,173 @@
+import json
+
+from djangae.test import TestCase
+
+import mock
+
+from google.appengine.api import datastore, datastore_types
+
+from core.tests.factories import VideoCommentFactory, VideoFactory
+from projects.models import Project
+from projects.tasks import rebuild_project_summaries
+from videos import backfills, pipeline
+from videos.models import Video, VideoComment, VideoTranscript
+
+
+def strip_properties(instance, *columns):
+    """
+    Removes properties from the stored entity of the passed model instance,
+    as if it had been stored before they were added
+    """
+    key = datastore.Key.from_path(type(instance)._meta.db_table, instance.pk)
+    entity = datastore.Get(key)
+    for column in columns:
+        del entity[column]
+    datastore.Put(entity)
+
+
+def add_properties(instance, **properties):
+    """
+    Adds properties to the stored entity of the passed model instance, as
+    if it had been stored with fields that have since been removed
+    """
+    key = datastore.Key.from_path(type(instance)._meta.db_table, instance.pk)
+    entity = datastore.Get(key)
+    entity.update(properties)
+    datastore.Put(entity)
+
+
+def run_chain(func, *args, **kwargs):
+    """
+    Runs a chain of tasks that defer the next one, returning the deferred
+    calls that werent part of the chain
+    """
+    others = []
+    calls = [(func, args, kwargs)]
+    while calls:
+        func, args, kwargs = calls.pop(0)
+        with mock.patch('videos.backfills.deferred.defer') as mock_defer:
+            func(*args, **kwargs)
+        for call in mock_defer.call_args_list:
+            if call[0][0] is func:
+                kwargs = dict(
+                    (k, v) for k, v in call[1].items()
+                    if not k.startswith('_'))
+                calls.append((func, call[0][1:], kwargs))
+            else:
+                others.append(call)
+    return others
+
+
+@mock.patch('videos.backfills.BACKFILL_BATCH_SIZE', 2)
+class BackfillCommentCountsTestCase(TestCase):
+    def test_ok(self):
+        video = VideoFactory()
+        Video.objects.filter(pk=video.pk).update(
+            processing_state=pipeline.COMPLETE, pipeline_pending=0)
+        comments = [
+            VideoCommentFactory(
+                video=video, sentiment=0.5,
+                analyzed_comment={'v': 1, 'score': 0.5, 'magnitude': 0.5}),
+            VideoCommentFactory(
+                video=video, sentiment=-0.5,
+                analyzed_comment={'v': 1, 'score': -0.5, 'magnitude': 0.5}),
+            VideoCommentFactory(video=video, analysis_failed=True),
+        ]
+        for comment in comments:
+            strip_properties(comment, 'sentiment_label')
+        empty = VideoFactory()
+        self.assertEqual(0, len(VideoComment.objects.filter(
+            video=video).values_list('sentiment_label', flat=True)))
+
+        others = run_chain(backfills.backfill_comment_counts)
+
+        self.assertEqual(
+            [mock.call(rebuild_project_summaries, _queue='summaries')],
+            others)
+        self.assertEqual(
+            ['failed', 'negative', 'positive'],
+            sorted(VideoComment.objects.filter(video=video).values_list(
+                'sentiment_label', flat=True)))
+        video.refresh_from_db()
+        self.assertEqual(3, video.comments_total)
+        self.assertEqual(1, video.comments_positive)
+        self.assertEqual(1, video.comments_negative)
+        self.assertEqual(1, video.comments_failed)
+        self.assertTrue(video.comment_analysis_complete)
+        # complete videos are rolled up straight away
+        self.assertIsNone(video.comment_counts_pending)
+        self.assertEqual(
+            3, Project.objects.get(pk=video.project_id).comments_total)
+        empty.refresh_from_db()
+        self.assertEqual(0, empty.comments_total)
+
+    def test_in_progress_video(self):
+        video = VideoFactory()
+        VideoCommentFactory(video=video)
+        run_chain(backfills.backfill_comment_counts)
+        video.refresh_from_db()
+        self.assertEqual(1, video.comments_total)
+        # left for the pipeline run to roll up when it completes
+        self.assertEqual({'comments_total': 1}, video.comment_counts_pending)
+        self.assertEqual(
+            0, Project.objects.get(pk=video.project_id).comments_total)
+
+
+@mock.patch('videos.backfills.TRANSCRIPT_BATCH_SIZE', 1)
+class BackfillTranscriptsTestCase(TestCase):
+    def test_ok(self):
+        text = u'Great video. Awful sound!'
+        analysis = {
+            'documentSentiment': {'score': 0.1, 'magnitude': 1.6},
+            'sentences': [{
+                'text': {'content': u'Great video.', 'beginOffset': 0},
+                'sentiment': {'score': 0.9, 'magnitude': 0.9},
+            }, {
+                'text': {'content': u'Awful sound!', 'beginOffset': 13},
+                'sentiment': {'score': -0.7, 'magnitude': 0.7},
+            }],
+        }
+        cues = {
+            'start': [0.0, 90.0], 'duration': [2.0, 2.0], 'offset': [0, 13]}
+        video = VideoFactory(sentiment=0.1, magnitude=1.6)
+        add_properties(
+            video, transcript=datastore_types.Text(text),
+            transcript_cues=json.dumps(cues),
+            analyzed_transcript=json.dumps(analysis))
+        unanalyzed = VideoFactory()
+        add_properties(
+            unanalyzed, transcript=datastore_types.Text(text),
+            analyzed_transcript='')
+        untouched = VideoFactory()
+
+        others = run_chain(backfills.backfill_transcripts)
+
+        self.assertEqual(
+            [mock.call(rebuild_project_summaries, _queue='summaries')],
+            others)
+        transcript = VideoTranscript.objects.get(pk=video.pk)
+        self.assertEqual(text, transcript.text)
+        self.assertEqual(cues, transcript.cues)
+        self.assertEqual(analysis, transcript.analysis)
+        # stored packed
+        self.assertIn('v', transcript.analysis_data)
+        video = Video.objects.get(pk=video.pk)
+        self.assertTrue(video.has_transcript)
+        self.assertTrue(video.transcript_analyzed)
+        self.assertEqual(1, video.transcript_histogram['positive'])
+        self.assertEqual(1, video.transcript_histogram['negative'])
+        self.assertEqual([1, 1], video.transcript_timeline['count'])
+        for instance in (video, unanalyzed):
+            entity = datastore.Get(datastore.Key.from_path(
+                Video._meta.db_table, instance.pk))
+            for name in backfills.LEGACY_TRANSCRIPT_PROPERTIES:
+                self.assertNotIn(name, entity)
+
+        unanalyzed = Video.objects.get(pk=unanalyzed.pk)
+        self.assertTrue(unanalyzed.has_transcript)
+        self.assertFalse(unanalyzed.transcript_analyzed)
+        self.assertIsNone(
+            VideoTranscript.objects.get(pk=unanalyzed.pk).analysis)
+        self.assertFalse(Video.objects.get(pk=untouched.pk).has_transcript)
+        self.assertFalse(VideoTranscript.objects.filter(
+            pk=untouched.pk).exists())
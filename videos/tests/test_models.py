@@ -1,7 +1,11 @@
 # -*- coding: utf-8 -*-
 from djangae.test import TestCase
 
-from core.tests.factories import VideoCommentFactory, VideoFactory
+from core.tests.factories import (
+    VideoCommentFactory,
+    VideoFactory,
+    VideoTranscriptFactory
+)
 
 
 class VideoModelTestCase(TestCase):
@@ -10,31 +14,56 @@ class VideoModelTestCase(TestCase):
         self.assertEqual(video.__unicode__(), u'象は鼻が長')
 
     def test_can_be_analyze_property(self):
-        video = VideoFactory(transcript='')
+        video = VideoFactory()
         self.assertFalse(video.can_be_analyzed)
-        video.transcript = 'foo'
+        video.has_transcript = True
         video.save()
         self.assertTrue(video.can_be_analyzed)
 
     def test_analysis_complete_property(self):
-        video = VideoFactory(sentiment=0, magnitude=0, analyzed_transcript={})
+        video = VideoFactory(sentiment=0, magnitude=0)
         self.assertFalse(video.analysis_complete)
         video.sentiment = 0.8
         video.magnitude = 0.8
-        video.analyzed_transcript = {'foo': 'bar'}
+        video.transcript_analyzed = True
         video.save()
         self.assertTrue(video.analysis_complete)
 
     def test_comment_analysis_complete_property(self):
-        video = VideoFactory(sentiment=0, magnitude=0, analyzed_transcript={})
-        VideoCommentFactory(
-            video=video, analyzed_comment={'foo': 'foo'})
-        comment_2 = VideoCommentFactory(video=video, analyzed_comment={})
+        video = VideoFactory(
+            comments_total=3, comments_positive=1, comments_negative=1)
         self.assertFalse(video.comment_analysis_complete)
-        comment_2.analyzed_comment = {'bar': 'bar'}
-        comment_2.save()
+        video.comments_neutral = 1
+        video.save()
         self.assertTrue(video.comment_analysis_complete)
 
+    def test_comment_analysis_complete_with_failures(self):
+        video = VideoFactory(
+            comments_total=2, comments_positive=1, comments_failed=1)
+        self.assertFalse(video.comment_analysis_complete)
+
+
+class VideoTranscriptTestCase(TestCase):
+    def test_get_transcript(self):
+        video = VideoFactory()
+        self.assertEqual(None, video.get_transcript())
+        VideoTranscriptFactory(video=video, text=u'象は鼻が長')
+        self.assertEqual(u'象は鼻が長', video.get_transcript().text)
+
+    def test_payloads_round_trip(self):
+        analysis = {'documentSentiment': {'score': 0.5, 'magnitude': 1.0}}
+        transcript = VideoTranscriptFactory(
+            text=u'Hello world!', analysis=analysis,
+            cues={'start': [1.5], 'duration': [2.0], 'offset': [0]})
+        transcript.refresh_from_db()
+        self.assertEqual(u'Hello world!', transcript.text)
+        self.assertEqual(analysis, transcript.analysis)
+        self.assertEqual(1.5, transcript.captions.time_at(5))
+
+    def test_captions_without_cues(self):
+        transcript = VideoTranscriptFactory(text=u'Hello world!')
+        self.assertEqual(None, transcript.captions)
+
 
 class VideoCommentTestCase(TestCase):
     def test_unicode_method(self):
@@ -54,3 +83,31 @@ class VideoCommentTestCase(TestCase):
         comment.analyzed_comment = {'foo': 'bar'}
         comment.save()
         self.assertTrue(comment.analysis_complete)
+
+    def test_analysis_property(self):
+        analysis = {
+            'documentSentiment': {'score': 0.5, 'magnitude': 0.5},
+            'sentences': [{
+                'text': {'content': u'Hello!', 'beginOffset': 0},
+                'sentiment': {'score': 0.5, 'magnitude': 0.5},
+            }],
+        }
+        comment = VideoCommentFactory(comment_raw=u'Hello!')
+        comment.analysis = analysis
+        comment.save()
+        comment.refresh_from_db()
+        self.assertEqual([0], comment.analyzed_comment['offsets'])
+        self.assertEqual(analysis, comment.analysis)
+
+    def test_sentiment_label_set_on_save(self):
+        comment = VideoCommentFactory(analyzed_comment={})
+        self.assertEqual('pending', comment.sentiment_label)
+        comment.analyzed_comment = {'foo': 'bar'}
+        comment.sentiment = -0.5
+        comment.save()
+        comment.refresh_from_db()
+        self.assertEqual('negative', comment.sentiment_label)
+        comment.analysis_failed = True
+        comment.save(update_fields=['analysis_failed'])
+        comment.refresh_from_db()
+        self.assertEqual('failed', comment.sentiment_label)
@@ -0,0 +1,99 @@
+from djangae.test import TestCase
+
+import mock
+
+from core.tests.factories import VideoCommentFactory, VideoFactory
+from videos import pipeline
+from videos.models import Video
+
+
+class PipelineTestCase(TestCase):
+    def setUp(self):
+        super(PipelineTestCase, self).setUp()
+        self.video = VideoFactory()
+
+    def refresh(self):
+        return Video.objects.get(pk=self.video.pk)
+
+    def test_new_video_starts_pipeline(self):
+        video = self.refresh()
+        self.assertEqual(pipeline.PROCESSING, video.processing_state)
+        self.assertEqual(pipeline.INITIAL_TASKS, video.pipeline_pending)
+        self.assertIsNotNone(video.processing_started)
+        self.assertFalse(video.processing_complete)
+
+    def test_fan_in(self):
+        with mock.patch('videos.pipeline.deferred.defer') as mock_defer:
+            pipeline.fan_out(self.video.pk)
+            pipeline.finish(self.video.pk, pipeline.IMPORT_COMMENTS, 10)
+            pipeline.finish(self.video.pk, pipeline.IMPORT_TRANSCRIPT, 10)
+            self.assertFalse(mock_defer.called)
+            self.assertEqual(1, self.refresh().pipeline_pending)
+
+            pipeline.finish(self.video.pk, pipeline.ANALYZE_COMMENTS, 20)
+            # a duplicate task doesnt complete the video again
+            pipeline.finish(self.video.pk, pipeline.ANALYZE_COMMENTS, 20)
+        mock_defer.assert_called_once_with(
+            pipeline.complete, self.video.pk, _queue='videos',
+            _transactional=True)
+        video = self.refresh()
+        self.assertEqual(pipeline.FINALIZING, video.processing_state)
+        self.assertEqual(0, video.pipeline_pending)
+        self.assertEqual(
+            set([pipeline.IMPORT_COMMENTS, pipeline.IMPORT_TRANSCRIPT,
+                 pipeline.ANALYZE_COMMENTS]),
+            set(video.stage_timings))
+        timing = video.stage_timings[pipeline.ANALYZE_COMMENTS]
+        self.assertEqual(1, timing['tasks'])
+        self.assertEqual(20, timing['started'])
+
+    def test_start(self):
+        pipeline.start(self.video.pk, 1)
+        self.assertEqual(3, self.refresh().pipeline_pending)
+
+        # starting a finished video starts a new run
+        Video.objects.filter(pk=self.video.pk).update(
+            processing_state=pipeline.COMPLETE, pipeline_pending=0,
+            stage_timings={pipeline.IMPORT_COMMENTS: {}})
+        pipeline.start(self.video.pk, 1)
+        video = self.refresh()
+        self.assertEqual(pipeline.PROCESSING, video.processing_state)
+        self.assertEqual(1, video.pipeline_pending)
+        self.assertEqual({}, video.stage_timings)
+
+    def test_untracked_video(self):
+        Video.objects.filter(pk=self.video.pk).update(
+            processing_state='', pipeline_pending=0)
+        with mock.patch('videos.pipeline.deferred.defer') as mock_defer:
+            pipeline.fan_out(self.video.pk)
+            pipeline.finish(self.video.pk, pipeline.ANALYZE_COMMENTS, 10)
+        self.assertFalse(mock_defer.called)
+        self.assertEqual(0, self.refresh().pipeline_pending)
+
+    def test_complete(self):
+        VideoCommentFactory(video=self.video, analysis_failed=True)
+        VideoCommentFactory(
+            video=self.video, sentiment=0.5,
+            analyzed_comment={'v': 1, 'score': 0.5, 'magnitude': 0.5})
+        VideoCommentFactory(video=self.video)
+        # the running counts have drifted
+        Video.objects.filter(pk=self.video.pk).update(
+            processing_state=pipeline.FINALIZING, comments_total=2,
+            comments_positive=2)
+        pipeline.complete(self.video.pk)
+        video = self.refresh()
+        self.assertTrue(video.processing_complete)
+        self.assertIsNotNone(video.processing_completed)
+        self.assertEqual(3, video.comments_total)
+        self.assertEqual(1, video.comments_positive)
+        self.assertEqual(1, video.comments_failed)
+        self.assertFalse(video.comment_analysis_complete)
+        # the final counters are rolled up into the project
+        self.assertIsNone(video.comment_counts_pending)
+        project = video.project
+        self.assertEqual(1, project.comments_total)
+        self.assertEqual(1, project.comments_failed)
+
+    def test_complete_new_run_started(self):
+        pipeline.complete(self.video.pk)
+        self.assertEqual(pipeline.PROCESSING, self.refresh().processing_state)
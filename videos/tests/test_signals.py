@@ -2,7 +2,7 @@ from djangae.test import TestCase
 
 import mock
 
-from core.tests.factories import VideoFactory
+from core.tests.factories import ProjectFactory, VideoFactory
 from videos import tasks
 
 
@@ -17,6 +17,7 @@ class VideoPostSaveTestCase(TestCase):
                     mock.call(
                         tasks.youtube_import_comments,
                         video.pk,
+                        _countdown=mock.ANY,
                         _queue='comments'),
                     mock.call(
                         tasks.youtube_import_transcript,
@@ -30,3 +31,11 @@ class VideoPostSaveTestCase(TestCase):
             video.save()
             self.assertFalse(mock_defer.called)
             self.assertEqual(0, mock_defer.call_count)
+
+    def test_post_save_created_updates_project_summary(self):
+        project = ProjectFactory()
+        VideoFactory(project=project, thumbnail_high='first.jpg')
+        VideoFactory(project=project, thumbnail_high='second.jpg')
+        project.refresh_from_db()
+        self.assertEqual(2, project.video_count)
+        self.assertEqual('first.jpg', project.thumbnail)
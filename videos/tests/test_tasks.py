@@ -1,17 +1,55 @@
+import datetime
+from array import array
+
 from djangae.test import TestCase
+from django.test import override_settings
 
+import httplib2
 import mock
+import pytz
+from googleapiclient.errors import HttpError
 
-from core.tests.factories import VideoCommentFactory, VideoFactory
-from videos.models import VideoComment
+from core.tests.factories import (
+    VideoCommentFactory,
+    VideoFactory,
+    VideoTranscriptFactory
+)
+from services.models import DeadLetter
+from services.quota import QuotaExceeded
+from services.throttle import BACKGROUND
+from services.youtube import Captions
+from videos.models import Video, VideoComment
 from videos.tasks import (
     cloudnlp_analyze_comment,
+    cloudnlp_analyze_comments,
     cloudnlp_analyze_transcript,
     youtube_import_comments,
-    youtube_import_transcript
+    youtube_import_transcript,
+    youtube_resync_comments
 )
 
 
+def comment_thread(youtube_id, text, published, updated):
+    """
+    Builds a minimal commentThread resource for the passed comment
+    """
+    return {
+        u'snippet': {
+            u'topLevelComment': {
+                u'snippet': {
+                    u'authorDisplayName': u'Some display name',
+                    u'authorProfileImageUrl': u'http://sample.com/pic.jpg',
+                    u'publishedAt': published,
+                    u'updatedAt': updated,
+                    u'textOriginal': text,
+                    u'textDisplay': text,
+                },
+                u'id': youtube_id
+            },
+        },
+    }
+
+
 class YoutubeImportCommentsTestCase(TestCase):
     def test_video_does_not_exist(self):
         resp = youtube_import_comments(9999)
@@ -31,7 +69,7 @@ class YoutubeImportCommentsTestCase(TestCase):
     def test_no_comments_returned(self):
         video = VideoFactory()
         service = mock.Mock()
-        service.get_video_comments.return_value = []
+        service.get_video_comments.return_value = iter([])
         with mock.patch('videos.tasks.youtube.Client') as mock_yt:
             mock_yt.return_value = service
             resp = youtube_import_comments(video.pk)
@@ -73,12 +111,292 @@ class YoutubeImportCommentsTestCase(TestCase):
         }]
         video = VideoFactory()
         service = mock.Mock()
-        service.get_video_comments.return_value = expected_comments
+        service.get_video_comments.return_value = iter(
+            [(expected_comments, None)])
         with mock.patch('videos.tasks.youtube.Client') as mock_yt:
             mock_yt.return_value = service
             resp = youtube_import_comments(video.pk)
             self.assertEqual(None, resp)
         self.assertEqual(1, len(VideoComment.objects.all()))
+        video.refresh_from_db()
+        self.assertEqual('', video.comments_page_token)
+        self.assertTrue(video.comments_imported)
+        self.assertEqual(1, video.comments_total)
+        self.assertFalse(video.comment_analysis_complete)
+
+    def test_single_fan_out_per_page(self):
+        video = VideoFactory()
+        service = mock.Mock()
+        service.get_video_comments.return_value = iter([([
+            comment_thread(
+                'comment1', 'First!',
+                '2018-01-01T00:00:00.000Z', '2018-01-01T00:00:00.000Z'),
+            comment_thread(
+                'comment2', 'Second!',
+                '2018-01-01T00:00:00.000Z', '2018-01-01T00:00:00.000Z'),
+        ], None)])
+        with mock.patch('videos.tasks.youtube.Client') as mock_yt:
+            mock_yt.return_value = service
+            with mock.patch('videos.tasks.throttle.defer') as mock_defer:
+                youtube_import_comments(video.pk)
+        comments = VideoComment.objects.filter(video=video)
+        self.assertEqual(2, len(comments))
+        self.assertEqual(1, mock_defer.call_count)
+        args, kwargs = mock_defer.call_args
+        self.assertEqual(('language', cloudnlp_analyze_comments), args[:2])
+        # the batch is made up of the pks of the stored comments
+        self.assertNotIn(None, args[2])
+        self.assertEqual(sorted(c.pk for c in comments), sorted(args[2]))
+        self.assertEqual(
+            ['First!', 'Second!'],
+            sorted(VideoComment.objects.get(pk=pk).comment_raw
+                   for pk in args[2]))
+        self.assertEqual(
+            {'_queue': 'analyze', '_lane': None, '_owner': video.owner_id},
+            kwargs)
+
+    @override_settings(YOUTUBE_COMMENTS_INTERACTIVE_PAGES=1)
+    def test_later_pages_are_background(self):
+        video = VideoFactory()
+        service = mock.Mock()
+        service.get_video_comments.return_value = iter([
+            ([comment_thread(
+                'comment1', 'First!',
+                '2018-01-01T00:00:00.000Z', '2018-01-01T00:00:00.000Z')],
+             'page2'),
+            ([comment_thread(
+                'comment2', 'Second!',
+                '2018-01-01T00:00:00.000Z', '2018-01-01T00:00:00.000Z')],
+             None),
+        ])
+        with mock.patch('videos.tasks.youtube.Client') as mock_yt:
+            mock_yt.return_value = service
+            with mock.patch('videos.tasks.throttle.defer') as mock_defer:
+                youtube_import_comments(video.pk)
+        self.assertEqual(
+            [None, BACKGROUND],
+            [c[1]['_lane'] for c in mock_defer.call_args_list])
+
+    def test_quota_exceeded(self):
+        video = VideoFactory()
+        service = mock.Mock()
+        service.get_video_comments.side_effect = QuotaExceeded(
+            'youtube', 'commentThreads.list', 30)
+        with mock.patch('videos.tasks.youtube.Client') as mock_yt:
+            mock_yt.return_value = service
+            with mock.patch('services.tasks.deferred.defer') as mock_defer:
+                youtube_import_comments(video.pk)
+        mock_defer.assert_called_once_with(
+            youtube_import_comments, video.pk, _attempt=1, _countdown=30,
+            _queue='comments')
+
+    def test_checkpoints_page_token(self):
+        # a failure part way through keeps the token of the next page
+        video = VideoFactory()
+
+        def pages():
+            yield [], 'page2'
+            raise Exception
+
+        service = mock.Mock()
+        service.get_video_comments.return_value = pages()
+        with mock.patch('videos.tasks.youtube.Client') as mock_yt:
+            mock_yt.return_value = service
+            youtube_import_comments(video.pk)
+        video.refresh_from_db()
+        self.assertEqual('page2', video.comments_page_token)
+        self.assertFalse(video.comments_imported)
+
+    def test_resumes_from_page_token(self):
+        video = VideoFactory(comments_page_token='page2')
+        service = mock.Mock()
+        service.get_video_comments.return_value = iter([])
+        with mock.patch('videos.tasks.youtube.Client') as mock_yt:
+            mock_yt.return_value = service
+            youtube_import_comments(video.pk)
+        self.assertEqual(
+            'page2',
+            service.get_video_comments.call_args[1]['page_token'])
+
+    def test_retried_page_not_duplicated(self):
+        # an earlier attempt wrote the page but didnt checkpoint
+        video = VideoFactory(comments_total=1)
+        analyzed = VideoCommentFactory(
+            video=video, youtube_id='comment1',
+            analyzed_comment={'foo': 'bar'})
+        pending = VideoCommentFactory(video=video, youtube_id='comment2')
+        service = mock.Mock()
+        service.get_video_comments.return_value = iter([([
+            comment_thread(
+                'comment1', 'First!',
+                '2018-01-01T00:00:00.000Z', '2018-01-01T00:00:00.000Z'),
+            comment_thread(
+                'comment2', 'Second!',
+                '2018-01-01T00:00:00.000Z', '2018-01-01T00:00:00.000Z'),
+            comment_thread(
+                'comment3', 'Third!',
+                '2018-01-01T00:00:00.000Z', '2018-01-01T00:00:00.000Z'),
+        ], None)])
+        with mock.patch('videos.tasks.youtube.Client') as mock_yt:
+            mock_yt.return_value = service
+            with mock.patch('videos.tasks.throttle.defer') as mock_defer:
+                youtube_import_comments(video.pk)
+        self.assertEqual(3, VideoComment.objects.filter(video=video).count())
+        new = VideoComment.objects.get(youtube_id='comment3')
+        self.assertEqual(
+            sorted([pending.pk, new.pk]), sorted(mock_defer.call_args[0][2]))
+        self.assertNotIn(analyzed.pk, mock_defer.call_args[0][2])
+        video.refresh_from_db()
+        self.assertEqual(2, video.comments_total)
+
+    def test_already_imported(self):
+        video = VideoFactory(comments_imported=True)
+        with mock.patch('videos.tasks.youtube.Client') as mock_yt:
+            youtube_import_comments(video.pk)
+            self.assertFalse(mock_yt.called)
+
+
+class YoutubeResyncCommentsTestCase(TestCase):
+    def setUp(self):
+        super(YoutubeResyncCommentsTestCase, self).setUp()
+        self.video = VideoFactory(comments_imported=True)
+        self.existing = VideoCommentFactory(
+            video=self.video, youtube_id='comment1', comment_raw='Old text',
+            analyzed_comment={'foo': 'bar'}, sentiment=0.5,
+            published=datetime.datetime(2018, 1, 1, tzinfo=pytz.UTC),
+            updated=datetime.datetime(2018, 1, 1, tzinfo=pytz.UTC))
+
+    def resync(self, pages):
+        service = mock.Mock()
+        service.get_video_comments.return_value = iter(pages)
+        with mock.patch('videos.tasks.youtube.Client') as mock_yt:
+            mock_yt.return_value = service
+            with mock.patch('videos.tasks.throttle.defer') as mock_defer:
+                youtube_resync_comments(self.video.pk)
+        return service, mock_defer
+
+    def test_video_does_not_exist(self):
+        resp = youtube_resync_comments(9999)
+        self.assertEqual(None, resp)
+
+    def test_import_not_finished(self):
+        Video.objects.filter(pk=self.video.pk).update(
+            comments_imported=False)
+        with mock.patch('videos.tasks.pipeline.finish') as mock_finish:
+            service, mock_defer = self.resync([])
+        self.assertFalse(service.get_video_comments.called)
+        mock_finish.assert_called_once_with(
+            self.video.pk, 'resync_comments', mock.ANY)
+
+    def test_new_comment(self):
+        service, mock_defer = self.resync([([
+            comment_thread(
+                'comment2', 'New text',
+                '2018-02-01T00:00:00.000Z', '2018-02-01T00:00:00.000Z'),
+            comment_thread(
+                'comment1', 'Old text',
+                '2018-01-01T00:00:00.000Z', '2018-01-01T00:00:00.000Z'),
+        ], 'page2')])
+        self.assertEqual(
+            'time', service.get_video_comments.call_args[1]['order'])
+        self.assertEqual(2, VideoComment.objects.count())
+        new = VideoComment.objects.get(youtube_id='comment2')
+        self.assertIsNotNone(new.pk)
+        mock_defer.assert_called_once_with(
+            'language', cloudnlp_analyze_comments, [new.pk],
+            _queue='analyze', _owner=self.video.owner_id)
+
+    def test_edited_comment(self):
+        _, mock_defer = self.resync([([
+            comment_thread(
+                'comment1', 'Edited text',
+                '2018-01-01T00:00:00.000Z', '2018-03-01T00:00:00.000Z'),
+        ], None)])
+        self.assertEqual(1, VideoComment.objects.count())
+        self.existing.refresh_from_db()
+        self.assertEqual('Edited text', self.existing.comment_raw)
+        self.assertEqual({}, self.existing.analyzed_comment)
+        self.assertEqual(0, self.existing.sentiment)
+        mock_defer.assert_called_once_with(
+            'language', cloudnlp_analyze_comments, [self.existing.pk],
+            _queue='analyze', _owner=self.video.owner_id)
+
+    def test_updated_without_text_change(self):
+        _, mock_defer = self.resync([([
+            comment_thread(
+                'comment1', 'Old text',
+                '2018-01-01T00:00:00.000Z', '2018-03-01T00:00:00.000Z'),
+        ], None)])
+        self.existing.refresh_from_db()
+        self.assertEqual({'foo': 'bar'}, self.existing.analyzed_comment)
+        self.assertFalse(mock_defer.called)
+
+    def test_retry_keeps_watermark(self):
+        # an earlier attempt started from the existing comment and stored a
+        # newer one from its first page before failing
+        self.video.comments_resyncing = True
+        self.video.resync_watermark = self.existing.updated
+        self.video.resync_page_token = 'page2'
+        self.video.save()
+        VideoCommentFactory(
+            video=self.video, youtube_id='comment3',
+            published=datetime.datetime(2018, 3, 1, tzinfo=pytz.UTC),
+            updated=datetime.datetime(2018, 3, 1, tzinfo=pytz.UTC))
+        service, mock_defer = self.resync([([
+            comment_thread(
+                'comment2', 'New text',
+                '2018-02-01T00:00:00.000Z', '2018-02-01T00:00:00.000Z'),
+        ], None)])
+        self.assertEqual(
+            'page2', service.get_video_comments.call_args[1]['page_token'])
+        new = VideoComment.objects.get(youtube_id='comment2')
+        mock_defer.assert_called_once_with(
+            'language', cloudnlp_analyze_comments, [new.pk],
+            _queue='analyze', _owner=self.video.owner_id)
+        self.video.refresh_from_db()
+        self.assertFalse(self.video.comments_resyncing)
+        self.assertIsNone(self.video.resync_watermark)
+        self.assertEqual('', self.video.resync_page_token)
+
+    def test_checkpoints_resync(self):
+        def pages():
+            yield [comment_thread(
+                'comment2', 'New text',
+                '2018-02-01T00:00:00.000Z', '2018-02-01T00:00:00.000Z'),
+            ], 'page2'
+            raise HttpError(httplib2.Response({'status': 503}), '')
+
+        with mock.patch('services.tasks.deferred.defer'):
+            self.resync(pages())
+        self.video.refresh_from_db()
+        self.assertTrue(self.video.comments_resyncing)
+        self.assertEqual(self.existing.updated, self.video.resync_watermark)
+        self.assertEqual('page2', self.video.resync_page_token)
+
+    def test_failure_clears_resync(self):
+        def pages():
+            yield [], 'page2'
+            raise ValueError
+
+        self.resync(pages())
+        self.video.refresh_from_db()
+        # the next resync starts afresh
+        self.assertFalse(self.video.comments_resyncing)
+        self.assertEqual('', self.video.resync_page_token)
+
+    def test_stops_at_high_watermark(self):
+        fetched = []
+
+        def pages():
+            yield [comment_thread(
+                'comment1', 'Old text',
+                '2018-01-01T00:00:00.000Z', '2018-01-01T00:00:00.000Z'),
+            ], 'page2'
+            fetched.append('page2')
+
+        _, mock_defer = self.resync(pages())
+        self.assertEqual([], fetched)
+        self.assertFalse(mock_defer.called)
 
 
 class YoutubeImportTranscriptTestCase(TestCase):
@@ -87,40 +405,53 @@ class YoutubeImportTranscriptTestCase(TestCase):
         self.assertEqual(None, resp)
 
     def test_youtube_client_exception(self):
-        video = VideoFactory(transcript='')
+        video = VideoFactory()
         service = mock.Mock()
-        service.get_video_transcript.side_effect = Exception
+        service.get_video_captions.side_effect = Exception
         with mock.patch('videos.tasks.youtube.Client') as mock_yt:
             mock_yt.return_value = service
             resp = youtube_import_transcript(video.pk)
             self.assertEqual(None, resp)
         video.refresh_from_db()
-        self.assertEqual('', video.transcript)
-        self.assertEqual(False, video.transcript_failed)
+        self.assertEqual(False, video.has_transcript)
+        self.assertEqual(None, video.get_transcript())
+        self.assertEqual(True, video.transcript_failed)
+        self.assertEqual(
+            'videos.tasks.youtube_import_transcript',
+            DeadLetter.objects.get().task)
 
     def test_no_transcript_returned(self):
-        video = VideoFactory(transcript='')
+        video = VideoFactory()
         service = mock.Mock()
-        service.get_video_transcript.return_value = None
+        service.get_video_captions.return_value = None
         with mock.patch('videos.tasks.youtube.Client') as mock_yt:
             mock_yt.return_value = service
             resp = youtube_import_transcript(video.pk)
             self.assertEqual(None, resp)
         video.refresh_from_db()
-        self.assertEqual('', video.transcript)
+        self.assertEqual(False, video.has_transcript)
+        self.assertEqual(None, video.get_transcript())
         self.assertEqual(True, video.transcript_failed)
 
     def test_ok(self):
-        video = VideoFactory(transcript='')
+        video = VideoFactory()
         service = mock.Mock()
-        service.get_video_transcript.return_value = 'Im a transcript.'
+        service.get_video_captions.return_value = Captions(
+            u'Im a transcript.', array('d', [1.5]), array('d', [2.0]),
+            array('l', [0]))
         with mock.patch('videos.tasks.youtube.Client') as mock_yt:
             mock_yt.return_value = service
             resp = youtube_import_transcript(video.pk)
             self.assertEqual(None, resp)
         video.refresh_from_db()
-        self.assertEqual(video.transcript, 'Im a transcript.')
+        self.assertEqual(True, video.has_transcript)
         self.assertEqual(False, video.transcript_failed)
+        transcript = video.get_transcript()
+        self.assertEqual(transcript.text, 'Im a transcript.')
+        self.assertEqual(
+            {'start': [1.5], 'duration': [2.0], 'offset': [0]},
+            transcript.cues)
+        self.assertEqual(1.5, transcript.captions.time_at(5))
 
 
 class CloudnlpAnalyzeTranscriptTestCase(TestCase):
@@ -129,24 +460,27 @@ class CloudnlpAnalyzeTranscriptTestCase(TestCase):
         self.assertEqual(None, resp)
 
     def test_video_does_not_have_transcript(self):
-        video = VideoFactory(transcript='')
+        video = VideoFactory()
         resp = cloudnlp_analyze_transcript(video.pk)
         self.assertEqual(None, resp)
         video.refresh_from_db()
-        self.assertEqual({}, video.analyzed_transcript)
+        self.assertEqual(False, video.transcript_analyzed)
         self.assertEqual(0, video.sentiment)
         self.assertEqual(0, video.magnitude)
 
     def test_cloudnlp_client_exception(self):
-        video = VideoFactory(transcript='Hello world!')
+        transcript = VideoTranscriptFactory(text='Hello world!')
         service = mock.Mock()
         service.analyze_sentiment.side_effect = Exception
-        with mock.patch('videos.tasks.cloudnlp.Client') as mock_cloudnlp:
+        with mock.patch('videos.tasks.sentiment.get_client') as mock_cloudnlp:
             mock_cloudnlp.return_value = service
-            resp = cloudnlp_analyze_transcript(video.pk)
+            resp = cloudnlp_analyze_transcript(transcript.video_id)
             self.assertEqual(None, resp)
+        transcript.refresh_from_db()
+        self.assertEqual(None, transcript.analysis)
+        video = transcript.video
         video.refresh_from_db()
-        self.assertEqual({}, video.analyzed_transcript)
+        self.assertEqual(False, video.transcript_analyzed)
         self.assertEqual(0, video.sentiment)
         self.assertEqual(0, video.magnitude)
 
@@ -157,17 +491,49 @@ class CloudnlpAnalyzeTranscriptTestCase(TestCase):
                 'magnitude': 17.0
             }
         }
-        video = VideoFactory(transcript='Hello world!')
+        transcript = VideoTranscriptFactory(text='Hello world!')
         service = mock.Mock()
         service.analyze_sentiment.return_value = mock_analysis
-        with mock.patch('videos.tasks.cloudnlp.Client') as mock_cloudnlp:
+        with mock.patch('videos.tasks.sentiment.get_client') as mock_cloudnlp:
             mock_cloudnlp.return_value = service
-            resp = cloudnlp_analyze_transcript(video.pk)
+            resp = cloudnlp_analyze_transcript(transcript.video_id)
             self.assertEqual(None, resp)
+        service.analyze_sentiment.assert_called_once_with('Hello world!')
+        transcript.refresh_from_db()
+        self.assertEqual(mock_analysis, transcript.analysis)
+        video = transcript.video
         video.refresh_from_db()
-        self.assertEqual(mock_analysis, video.analyzed_transcript)
+        self.assertEqual(True, video.transcript_analyzed)
         self.assertEqual(-0.8, video.sentiment)
         self.assertEqual(17.0, video.magnitude)
+        self.assertEqual(None, video.transcript_timeline)
+        self.assertEqual(0, video.transcript_histogram['positive'])
+        project = video.project
+        project.refresh_from_db()
+        self.assertEqual(1, project.videos_analyzed)
+        self.assertAlmostEqual(-0.8, project.sentiment)
+
+    def test_stores_timeline(self):
+        mock_analysis = {
+            'documentSentiment': {'score': 0.5, 'magnitude': 0.5},
+            'sentences': [{
+                'text': {'content': 'Hello world!', 'beginOffset': 0},
+                'sentiment': {'score': 0.5, 'magnitude': 0.5},
+            }],
+        }
+        transcript = VideoTranscriptFactory(
+            text='Hello world!',
+            cues={'start': [1.5], 'duration': [2.0], 'offset': [0]})
+        service = mock.Mock()
+        service.analyze_sentiment.return_value = mock_analysis
+        with mock.patch('videos.tasks.sentiment.get_client') as mock_cloudnlp:
+            mock_cloudnlp.return_value = service
+            cloudnlp_analyze_transcript(transcript.video_id)
+        video = transcript.video
+        video.refresh_from_db()
+        self.assertEqual(
+            {'window': 60, 'score': [0.5], 'magnitude': [0.5], 'count': [1]},
+            video.transcript_timeline)
 
 
 class CloudnlpAnalyzeCommentTestCase(TestCase):
@@ -179,7 +545,7 @@ class CloudnlpAnalyzeCommentTestCase(TestCase):
         comment = VideoCommentFactory(comment_raw='Hello world!')
         service = mock.Mock()
         service.analyze_sentiment.side_effect = Exception
-        with mock.patch('videos.tasks.cloudnlp.Client') as mock_cloudnlp:
+        with mock.patch('videos.tasks.sentiment.get_client') as mock_cloudnlp:
             mock_cloudnlp.return_value = service
             resp = cloudnlp_analyze_comment(comment.pk)
             self.assertEqual(None, resp)
@@ -189,6 +555,21 @@ class CloudnlpAnalyzeCommentTestCase(TestCase):
         self.assertEqual(0, comment.magnitude)
         self.assertEqual(True, comment.analysis_failed)
 
+    def test_quota_exceeded(self):
+        comment = VideoCommentFactory(comment_raw='Hello world!')
+        service = mock.Mock()
+        service.analyze_sentiment.side_effect = QuotaExceeded(
+            'language', 'documents.analyzeSentiment', 5)
+        with mock.patch('videos.tasks.sentiment.get_client') as mock_client:
+            mock_client.return_value = service
+            with mock.patch('services.tasks.deferred.defer') as mock_defer:
+                cloudnlp_analyze_comment(comment.pk)
+        mock_defer.assert_called_once_with(
+            cloudnlp_analyze_comment, comment.pk, _attempt=1, _countdown=5,
+            _queue='analyze')
+        comment.refresh_from_db()
+        self.assertEqual(False, comment.analysis_failed)
+
     def test_ok(self):
         mock_analysis = {
             'documentSentiment': {
@@ -199,12 +580,151 @@ class CloudnlpAnalyzeCommentTestCase(TestCase):
         comment = VideoCommentFactory(comment_raw='Hello world!')
         service = mock.Mock()
         service.analyze_sentiment.return_value = mock_analysis
-        with mock.patch('videos.tasks.cloudnlp.Client') as mock_cloudnlp:
+        with mock.patch('videos.tasks.sentiment.get_client') as mock_cloudnlp:
             mock_cloudnlp.return_value = service
             resp = cloudnlp_analyze_comment(comment.pk)
             self.assertEqual(None, resp)
         comment.refresh_from_db()
-        self.assertEqual(mock_analysis, comment.analyzed_comment)
+        self.assertEqual(mock_analysis, comment.analysis)
         self.assertEqual(-0.8, comment.sentiment)
         self.assertEqual(17.0, comment.magnitude)
         self.assertEqual(False, comment.analysis_failed)
+        video = comment.video
+        video.refresh_from_db()
+        self.assertEqual(1, video.comments_negative)
+        self.assertEqual(0, video.comments_positive)
+
+
+class CloudnlpAnalyzeCommentsTestCase(TestCase):
+    def test_comments_do_not_exist(self):
+        resp = cloudnlp_analyze_comments([9999])
+        self.assertEqual(None, resp)
+
+    def test_cloudnlp_client_exception(self):
+        comment = VideoCommentFactory(comment_raw='Hello world!')
+        service = mock.Mock()
+        service.analyze_sentiment_batch.side_effect = Exception
+        service.analyze_sentiment.side_effect = Exception
+        with mock.patch('videos.tasks.sentiment.get_client') as mock_cloudnlp:
+            mock_cloudnlp.return_value = service
+            cloudnlp_analyze_comments([comment.pk])
+        service.analyze_sentiment.assert_called_once_with('Hello world!')
+        comment.refresh_from_db()
+        self.assertEqual({}, comment.analyzed_comment)
+        self.assertEqual(True, comment.analysis_failed)
+        video = comment.video
+        video.refresh_from_db()
+        self.assertEqual(1, video.comments_failed)
+
+    def test_batch_permanent_error_falls_back(self):
+        analysis = {'documentSentiment': {'score': 0.5, 'magnitude': 0.5}}
+        comment_1 = VideoCommentFactory(comment_raw='Hello world!')
+        comment_2 = VideoCommentFactory(
+            video=comment_1.video, comment_raw='Goodbye world')
+        service = mock.Mock()
+        service.analyze_sentiment_batch.side_effect = HttpError(
+            httplib2.Response({'status': 400}), '')
+        service.analyze_sentiment.return_value = analysis
+        with mock.patch('videos.tasks.sentiment.get_client') as mock_client:
+            mock_client.return_value = service
+            cloudnlp_analyze_comments([comment_1.pk, comment_2.pk])
+        self.assertEqual(2, service.analyze_sentiment.call_count)
+        video = comment_1.video
+        video.refresh_from_db()
+        self.assertEqual(2, video.comments_positive)
+        self.assertFalse(DeadLetter.objects.exists())
+
+    def test_batch_transient_error_retried(self):
+        comment = VideoCommentFactory(comment_raw='Hello world!')
+        service = mock.Mock()
+        service.analyze_sentiment_batch.side_effect = HttpError(
+            httplib2.Response({'status': 503}), '')
+        with mock.patch('videos.tasks.sentiment.get_client') as mock_client:
+            mock_client.return_value = service
+            with mock.patch('services.tasks.deferred.defer') as mock_defer:
+                cloudnlp_analyze_comments([comment.pk])
+        self.assertTrue(mock_defer.called)
+        self.assertFalse(service.analyze_sentiment.called)
+
+    def test_transient_error_retries_batch(self):
+        analysis = {'documentSentiment': {'score': 0.5, 'magnitude': 0.5}}
+        comment_1 = VideoCommentFactory(comment_raw='Hello world!')
+        comment_2 = VideoCommentFactory(
+            video=comment_1.video, comment_raw='Goodbye world')
+        service = mock.Mock()
+        service.analyze_sentiment_batch.side_effect = lambda texts: [
+            analysis if t == 'Hello world!' else None for t in texts]
+        service.analyze_sentiment.side_effect = HttpError(
+            httplib2.Response({'status': 503}), '')
+        pks = [comment_1.pk, comment_2.pk]
+        with mock.patch('videos.tasks.sentiment.get_client') as mock_client:
+            mock_client.return_value = service
+            with mock.patch('services.tasks.deferred.defer') as mock_defer:
+                cloudnlp_analyze_comments(pks)
+        mock_defer.assert_called_once_with(
+            cloudnlp_analyze_comments, pks, _attempt=2,
+            _countdown=mock.ANY, _queue='analyze')
+        comment_2.refresh_from_db()
+        self.assertFalse(comment_2.analysis_failed)
+        # the comment analyzed before the error is counted, and skipped
+        # when the batch is retried
+        video = comment_1.video
+        video.refresh_from_db()
+        self.assertEqual(1, video.comments_positive)
+        service.analyze_sentiment.side_effect = None
+        service.analyze_sentiment.return_value = analysis
+        with mock.patch('videos.tasks.sentiment.get_client') as mock_client:
+            mock_client.return_value = service
+            cloudnlp_analyze_comments(pks, _attempt=2)
+        service.analyze_sentiment_batch.assert_called_with(['Goodbye world'])
+        video.refresh_from_db()
+        self.assertEqual(2, video.comments_positive)
+
+    def test_ok_with_fallback(self):
+        batched = {'documentSentiment': {'score': 0.5, 'magnitude': 0.5}}
+        single = {'documentSentiment': {'score': -0.8, 'magnitude': 17.0}}
+        comment_1 = VideoCommentFactory(comment_raw='Hello world!')
+        comment_2 = VideoCommentFactory(comment_raw='Goodbye world')
+        service = mock.Mock()
+        service.analyze_sentiment_batch.side_effect = lambda texts: [
+            batched if t == 'Hello world!' else None for t in texts]
+        service.analyze_sentiment.return_value = single
+        with mock.patch('videos.tasks.sentiment.get_client') as mock_cloudnlp:
+            mock_cloudnlp.return_value = service
+            cloudnlp_analyze_comments([comment_1.pk, comment_2.pk])
+        service.analyze_sentiment.assert_called_once_with('Goodbye world')
+        comment_1.refresh_from_db()
+        comment_2.refresh_from_db()
+        self.assertEqual(batched, comment_1.analysis)
+        self.assertEqual(0.5, comment_1.sentiment)
+        self.assertEqual(single, comment_2.analysis)
+        self.assertEqual(-0.8, comment_2.sentiment)
+        self.assertEqual(17.0, comment_2.magnitude)
+
+    def test_updates_counters_once(self):
+        video = VideoFactory(comments_total=3, comments_failed=1)
+        comments = [
+            VideoCommentFactory(video=video, comment_raw='Great!'),
+            VideoCommentFactory(video=video, comment_raw='Awful!'),
+            VideoCommentFactory(
+                video=video, comment_raw='Meh', analysis_failed=True),
+        ]
+        service = mock.Mock()
+        service.analyze_sentiment_batch.return_value = [
+            {'documentSentiment': {'score': score, 'magnitude': 0.5}}
+            for score in (0.5, -0.5, 0.0)]
+        with mock.patch('videos.tasks.sentiment.get_client') as mock_client:
+            mock_client.return_value = service
+            with mock.patch(
+                    'videos.tasks.update_comment_counts') as mock_update:
+                cloudnlp_analyze_comments([c.pk for c in comments])
+        self.assertEqual(1, mock_update.call_count)
+        args, _ = mock_update.call_args
+        self.assertEqual(video.pk, args[0])
+        self.assertEqual({
+            'comments_positive': 1,
+            'comments_negative': 1,
+            'comments_neutral': 1,
+            'comments_failed': -1,
+            None: -2,
+        }, dict(args[1]))
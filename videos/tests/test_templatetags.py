@@ -1,7 +1,7 @@
 from djangae.test import TestCase
 
+from videos.templatetags.charts import pie_chart, timeline_chart
 from videos.templatetags.sentiment import sentiment_display
-from videos.templatetags.charts import pie_chart
 
 
 class SentimentDisplayTagTestCase(TestCase):
@@ -32,3 +32,22 @@ class PieChartTagTestCase(TestCase):
             'height': '400px',
         }
         self.assertEqual(expected_context, resp)
+
+
+class TimelineChartTagTestCase(TestCase):
+    def test_chart_ok(self):
+        timeline = {
+            'window': 30,
+            'score': [0.5, None, -0.25],
+            'magnitude': [0.5, 0.0, 0.25],
+            'count': [1, 0, 1],
+        }
+        resp = timeline_chart('Foo Bar', timeline, height='400px')
+        expected_context = {
+            'id': 'foo-bar',
+            'title': 'Foo Bar',
+            'rows': [(0.0, 0.5), (0.5, None), (1.0, -0.25)],
+            'width': '100%',
+            'height': '400px',
+        }
+        self.assertEqual(expected_context, resp)
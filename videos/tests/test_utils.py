@@ -0,0 +1,361 @@
+import datetime
+import pickle
+from array import array
+from collections import Counter
+
+from djangae.test import TestCase
+
+import mock
+import pytz
+
+from core.tests.factories import (
+    AuthenticatedUserFactory,
+    ProjectFactory,
+    VideoCommentFactory,
+    VideoFactory
+)
+from services.youtube import Captions
+from videos import pipeline, tasks
+from videos.models import Video, VideoComment
+from videos.utils import (
+    ANALYSIS_FORMAT,
+    bulk_put,
+    comment_counter,
+    count_transition,
+    create_videos,
+    decode_cursor,
+    encode_cursor,
+    pack_analysis,
+    page_comments,
+    roll_up_comment_counts,
+    sentence_histogram,
+    sentiment_timeline,
+    unpack_analysis,
+    update_comment_counts
+)
+
+
+def sentence(content, offset, score, magnitude):
+    return {
+        'text': {'content': content, 'beginOffset': offset},
+        'sentiment': {'score': score, 'magnitude': magnitude},
+    }
+
+
+class SentimentTimelineTestCase(TestCase):
+    def setUp(self):
+        self.captions = Captions(
+            u'Good start. Bad middle. Great end.',
+            array('d', [0.0, 70.0, 130.0]), array('d', [5.0, 5.0, 5.0]),
+            array('l', [0, 12, 24]))
+
+    def test_buckets_by_window(self):
+        analysis = {'sentences': [
+            sentence(u'Good start.', 0, 0.5, 0.5),
+            sentence(u'Bad middle.', 12, -0.5, 1.0),
+            sentence(u'Great end.', 24, 1.0, 1.0),
+        ]}
+        self.assertEqual({
+            'window': 60,
+            'score': [0.5, -0.5, 1.0],
+            'magnitude': [0.5, 1.0, 1.0],
+            'count': [1, 1, 1],
+        }, sentiment_timeline(analysis, self.captions))
+
+    def test_empty_windows(self):
+        analysis = {'sentences': [
+            sentence(u'Good start.', 0, 0.5, 0.5),
+            sentence(u'Great end.', 24, 1.0, 1.0),
+        ]}
+        timeline = sentiment_timeline(analysis, self.captions, window=30)
+        self.assertEqual([0.5, None, None, None, 1.0], timeline['score'])
+        self.assertEqual([1, 0, 0, 0, 1], timeline['count'])
+
+    def test_missing_offsets(self):
+        analysis = {'sentences': [
+            sentence(u'Good start.', -1, 0.5, 0.5),
+            sentence(u'Bad middle.', -1, -0.5, 1.0),
+        ]}
+        timeline = sentiment_timeline(analysis, self.captions)
+        self.assertEqual([0.5, -0.5], timeline['score'])
+
+    def test_no_sentences(self):
+        self.assertEqual(
+            {'window': 60, 'score': [], 'magnitude': [], 'count': []},
+            sentiment_timeline({}, self.captions))
+
+
+class SentenceHistogramTestCase(TestCase):
+    def test_ok(self):
+        analysis = {'sentences': [
+            sentence(u'Great!', 0, 1.0, 1.0),
+            sentence(u'Good.', 7, 0.3, 0.3),
+            sentence(u'Bad.', 13, -0.6, 0.6),
+            sentence(u'Okay.', 18, 0.0, 0.0),
+        ]}
+        self.assertEqual({
+            'positive': 2,
+            'negative': 1,
+            'neutral': 1,
+            'distribution': [1, 0, 2, 1],
+        }, sentence_histogram(analysis, bins=4))
+
+    def test_no_sentences(self):
+        histogram = sentence_histogram({})
+        self.assertEqual(0, histogram['positive'])
+        self.assertEqual([0] * 20, histogram['distribution'])
+
+
+class CommentCountsTestCase(TestCase):
+    def test_comment_counter(self):
+        comment = VideoCommentFactory(analyzed_comment={})
+        self.assertEqual(None, comment_counter(comment))
+        comment.analyzed_comment = {'foo': 'bar'}
+        comment.sentiment = 0.5
+        self.assertEqual('comments_positive', comment_counter(comment))
+        comment.sentiment = -0.5
+        self.assertEqual('comments_negative', comment_counter(comment))
+        comment.sentiment = 0
+        self.assertEqual('comments_neutral', comment_counter(comment))
+        comment.analysis_failed = True
+        self.assertEqual('comments_failed', comment_counter(comment))
+
+    def test_count_transition(self):
+        counts = Counter()
+        count_transition(counts, None, 'comments_positive')
+        count_transition(counts, 'comments_positive', 'comments_positive')
+        self.assertEqual({None: -1, 'comments_positive': 1}, dict(counts))
+
+    def test_update_comment_counts(self):
+        video = VideoFactory(comments_total=2, comments_failed=1)
+        update_comment_counts(video.pk, Counter({
+            'comments_positive': 2, 'comments_failed': -1, None: -1}))
+        video.refresh_from_db()
+        self.assertEqual(2, video.comments_positive)
+        self.assertEqual(0, video.comments_failed)
+        self.assertEqual(2, video.comments_total)
+        # the project is left alone until the changes are rolled up
+        self.assertEqual(
+            {'comments_positive': 2, 'comments_failed': -1},
+            video.comment_counts_pending)
+        project = video.project
+        project.refresh_from_db()
+        self.assertEqual(0, project.comments_positive)
+
+    def test_update_comment_counts_outside_run(self):
+        video = VideoFactory()
+        Video.objects.filter(pk=video.pk).update(
+            processing_state=pipeline.COMPLETE, pipeline_pending=0)
+        update_comment_counts(video.pk, Counter(
+            comments_total=1, comments_negative=1))
+        video.refresh_from_db()
+        self.assertEqual(1, video.comments_negative)
+        # no run will roll the changes up so they are rolled up straight away
+        self.assertIsNone(video.comment_counts_pending)
+        project = video.project
+        project.refresh_from_db()
+        self.assertEqual(1, project.comments_total)
+        self.assertEqual(1, project.comments_negative)
+
+    def test_update_comment_counts_video_does_not_exist(self):
+        update_comment_counts(9999, Counter(comments_total=1))
+
+    def test_roll_up_comment_counts(self):
+        video = VideoFactory()
+        update_comment_counts(video.pk, Counter(
+            comments_total=3, comments_positive=2, comments_failed=-1))
+        update_comment_counts(video.pk, Counter(comments_negative=1))
+        roll_up_comment_counts(video.pk)
+        video.refresh_from_db()
+        self.assertIsNone(video.comment_counts_pending)
+        project = video.project
+        project.refresh_from_db()
+        self.assertEqual(3, project.comments_total)
+        self.assertEqual(2, project.comments_positive)
+        self.assertEqual(1, project.comments_negative)
+        self.assertEqual(0, project.comments_failed)
+        # rolling up again doesnt count anything twice
+        roll_up_comment_counts(video.pk)
+        project.refresh_from_db()
+        self.assertEqual(3, project.comments_total)
+
+
+class PackAnalysisTestCase(TestCase):
+    def setUp(self):
+        self.text = u'Great video. Awful sound!'
+        self.analysis = {
+            'documentSentiment': {'score': 0.1, 'magnitude': 1.6},
+            'language': 'en',
+            'sentences': [
+                sentence(u'Great video.', 0, 0.9, 0.9),
+                sentence(u'Awful sound!', 13, -0.7, 0.7),
+            ],
+        }
+
+    def test_pack(self):
+        self.assertEqual({
+            'v': ANALYSIS_FORMAT,
+            'score': 0.1,
+            'magnitude': 1.6,
+            'language': 'en',
+            'offsets': [0, 13],
+            'lengths': [12, 12],
+            'scores': [0.9, -0.7],
+            'magnitudes': [0.9, 0.7],
+        }, pack_analysis(self.analysis, self.text))
+
+    def test_round_trip(self):
+        packed = pack_analysis(self.analysis, self.text)
+        self.assertEqual(self.analysis, unpack_analysis(packed, self.text))
+
+    def test_missing_offsets(self):
+        for s in self.analysis['sentences']:
+            s['text']['beginOffset'] = -1
+        packed = pack_analysis(self.analysis, self.text)
+        self.assertEqual([0, 13], packed['offsets'])
+
+    def test_unlocatable_sentences_kept_verbatim(self):
+        self.analysis['sentences'].append(sentence(u'Missing.', 30, 0, 0))
+        packed = pack_analysis(self.analysis, self.text)
+        self.assertEqual(self.analysis, packed)
+        self.assertEqual(self.analysis, unpack_analysis(packed, self.text))
+
+    def test_no_sentences(self):
+        analysis = {'documentSentiment': {'score': 0.1, 'magnitude': 1.6}}
+        packed = pack_analysis(analysis, self.text)
+        self.assertNotIn('offsets', packed)
+        self.assertEqual(analysis, unpack_analysis(packed, self.text))
+
+    def test_empty(self):
+        self.assertEqual({}, pack_analysis({}, self.text))
+        self.assertEqual(None, unpack_analysis(None, self.text))
+
+
+class PageCommentsTestCase(TestCase):
+    def setUp(self):
+        self.video = VideoFactory()
+        base = datetime.datetime(2018, 1, 1, tzinfo=pytz.UTC)
+        # two comments share an update time to exercise the tie breaking
+        for minutes in (5, 4, 4, 3, 2):
+            VideoCommentFactory(
+                video=self.video,
+                updated=base + datetime.timedelta(minutes=minutes),
+                published=base)
+        self.queryset = VideoComment.objects.filter(video=self.video)
+
+    def test_pages_through_every_comment_once(self):
+        expected = [c.pk for c in self.queryset]
+        seen = []
+        cursor = None
+        while True:
+            comments, cursor = page_comments(
+                self.queryset, cursor, page_size=2)
+            seen.extend(c.pk for c in comments)
+            if cursor is None:
+                break
+        self.assertEqual(expected, seen)
+
+    def test_last_page(self):
+        comments, cursor = page_comments(self.queryset, page_size=5)
+        self.assertEqual(5, len(comments))
+        self.assertEqual(None, cursor)
+
+    def test_cursor_round_trip(self):
+        comment = self.queryset[0]
+        self.assertEqual(
+            (comment.updated, comment.published, comment.pk),
+            decode_cursor(encode_cursor(comment)))
+
+    def test_invalid_cursor(self):
+        with self.assertRaises(ValueError):
+            decode_cursor('foo')
+
+
+class BulkPutTestCase(TestCase):
+    def test_ok(self):
+        video = VideoFactory()
+        comments = bulk_put([
+            VideoComment(
+                video=video, youtube_id='comment{}'.format(i),
+                comment_raw='Comment {}'.format(i),
+                published=datetime.datetime(2018, 1, 1, tzinfo=pytz.utc),
+                updated=datetime.datetime(2018, 1, 1, tzinfo=pytz.utc))
+            for i in range(3)])
+        pks = [comment.pk for comment in comments]
+        self.assertNotIn(None, pks)
+        self.assertEqual(3, len(set(pks)))
+        for comment in comments:
+            stored = VideoComment.objects.get(pk=comment.pk)
+            self.assertEqual(comment.youtube_id, stored.youtube_id)
+            self.assertEqual('pending', stored.sentiment_label)
+
+    def test_empty(self):
+        self.assertEqual([], bulk_put([]))
+
+    def test_registers_with_consistency(self):
+        project = ProjectFactory()
+        with mock.patch('videos.utils.handle_post_save') as mock_handle:
+            videos = bulk_put([
+                Video(
+                    owner=project.owner, project=project,
+                    youtube_id='video{}'.format(i),
+                    published=datetime.datetime(2018, 1, 1, tzinfo=pytz.utc))
+                for i in range(2)])
+        self.assertEqual(
+            [mock.call(Video, video, created=True) for video in videos],
+            mock_handle.call_args_list)
+
+
+class CreateVideosTestCase(TestCase):
+    def video(self, youtube_id):
+        return {
+            'youtube_id': youtube_id,
+            'name': youtube_id,
+            'published': datetime.datetime(2018, 1, 1, tzinfo=pytz.utc),
+            'thumbnail_default': 'default.jpg',
+            'thumbnail_medium': 'medium.jpg',
+            'thumbnail_high': '{}.jpg'.format(youtube_id),
+        }
+
+    def test_ok(self):
+        owner = AuthenticatedUserFactory()
+        project = ProjectFactory(owner=owner)
+        with mock.patch('services.tasks.taskqueue.Queue') as mock_queue, \
+                mock.patch('google.appengine.ext.deferred.defer') as defer:
+            created = create_videos(
+                owner, project, [self.video('video1'), self.video('video2')])
+        self.assertFalse(defer.called)
+        self.assertEqual(2, Video.objects.filter(project=project).count())
+        # the tasks are queued for the stored videos
+        pks = [video.pk for video in created]
+        self.assertNotIn(None, pks)
+        self.assertEqual(2, len(set(pks)))
+        self.assertEqual(
+            ['video1', 'video2'],
+            [Video.objects.get(pk=pk).youtube_id for pk in pks])
+        self.assertEqual(
+            [mock.call('comments'), mock.call('videos')],
+            mock_queue.call_args_list)
+        self.assertEqual(2, mock_queue().add_async.call_count)
+        self.assertEqual(2, mock_queue().add_async().get_result.call_count)
+        tasks_added = mock_queue().add_async.call_args_list[0][0][0]
+        self.assertEqual(2, len(tasks_added))
+        self.assertEqual(
+            [(tasks.youtube_import_comments, (video.pk,), {})
+             for video in created],
+            [pickle.loads(task.payload) for task in tasks_added])
+        tasks_added = mock_queue().add_async.call_args_list[1][0][0]
+        self.assertEqual(
+            [(tasks.youtube_import_transcript, (video.pk,), {})
+             for video in created],
+            [pickle.loads(task.payload) for task in tasks_added])
+
+        project.refresh_from_db()
+        self.assertEqual(2, project.video_count)
+        self.assertEqual('video1.jpg', project.thumbnail)
+
+    def test_no_videos(self):
+        project = ProjectFactory()
+        with mock.patch('services.tasks.taskqueue.Queue') as mock_queue:
+            self.assertEqual([], create_videos(project.owner, project, []))
+        self.assertFalse(mock_queue.called)
@@ -0,0 +1,443 @@
+import base64
+import json
+import uuid
+from collections import Counter
+
+from djangae.contrib.consistency.consistency import handle_post_save
+from djangae.db import transaction
+from djangae.db.utils import django_instance_to_entities
+from django.conf import settings
+from django.db import connections, router
+
+from dateutil import parser
+
+from google.appengine.api import datastore, memcache
+
+from accounts.utils import do_with_retry
+from projects.utils import apply_summary_counts, update_project_summary
+from services.tasks import defer_batch
+
+# version of the compact analysis format written by pack_analysis
+ANALYSIS_FORMAT = 1
+SEARCH_NAMESPACE = 'video-search'
+
+
+def pack_analysis(analysis, text):
+    """
+    Packs a sentiment analysis into a compact format for storage. Sentences
+    are kept as parallel lists of offsets, lengths, scores and magnitudes,
+    with their text referenced by offset into the analyzed `text` rather
+    than repeated. Analyses whose sentences cant be located in the text are
+    returned unchanged.
+    """
+    if not analysis:
+        return analysis
+    packed = {
+        'v': ANALYSIS_FORMAT,
+        'score': analysis['documentSentiment']['score'],
+        'magnitude': analysis['documentSentiment']['magnitude'],
+    }
+    if 'language' in analysis:
+        packed['language'] = analysis['language']
+    if 'sentences' not in analysis:
+        return packed
+    offsets = []
+    lengths = []
+    scores = []
+    magnitudes = []
+    position = 0
+    for sentence in analysis['sentences']:
+        content = sentence['text']['content']
+        offset = sentence['text'].get('beginOffset', -1)
+        if offset < 0 or text[offset:offset + len(content)] != content:
+            offset = text.find(content, position)
+            if offset < 0:
+                return analysis
+        position = offset + len(content)
+        offsets.append(offset)
+        lengths.append(len(content))
+        scores.append(sentence['sentiment']['score'])
+        magnitudes.append(sentence['sentiment']['magnitude'])
+    packed.update(
+        offsets=offsets, lengths=lengths, scores=scores,
+        magnitudes=magnitudes)
+    return packed
+
+
+def unpack_analysis(packed, text):
+    """
+    Rebuilds the Cloud Natural Language API response shape from an analysis
+    stored by pack_analysis. Analyses stored verbatim are returned as is.
+    """
+    if not packed or 'v' not in packed:
+        return packed
+    analysis = {
+        'documentSentiment': {
+            'score': packed['score'],
+            'magnitude': packed['magnitude'],
+        },
+    }
+    if 'language' in packed:
+        analysis['language'] = packed['language']
+    if 'offsets' in packed:
+        analysis['sentences'] = [{
+            'text': {
+                'content': text[offset:offset + length],
+                'beginOffset': offset,
+            },
+            'sentiment': {'score': score, 'magnitude': magnitude},
+        } for offset, length, score, magnitude in zip(
+            packed['offsets'], packed['lengths'], packed['scores'],
+            packed['magnitudes'])]
+    return analysis
+
+
+def bulk_put(objs):
+    """
+    Saves a list of new instances of a model with a single multi entity
+    datastore put and returns them with the pks the datastore gave them.
+    djangae runs bulk_create as one put per instance and never sets the pks,
+    so anything queued for the new instances has to be written this way. As
+    with bulk_create no signals are sent, though the instances are still
+    registered with djangae's consistency app as their post_save would, and
+    the model cant have unique constraints or special indexes.
+    """
+    if not objs:
+        return objs
+    model = type(objs[0])
+    connection = connections[router.db_for_write(model)]
+    entities = [
+        django_instance_to_entities(
+            connection, model._meta.concrete_fields, False, obj)[0]
+        for obj in objs]
+    keys = datastore.Put(entities)
+    for obj, key in zip(objs, keys):
+        obj.pk = key.id()
+        obj._state.adding = False
+        obj._state.db = connection.alias
+        # so that improve_queryset_consistency includes the new instances
+        handle_post_save(model, obj, created=True)
+    return objs
+
+
+def project_youtube_ids(project_pk):
+    """
+    Returns the set of YouTube ids of the videos already in a project, read
+    with a projection query so the videos themselves arent loaded.
+    """
+    from .models import Video  # avoid circular imports
+    # unordered so that the (project_id, youtube_id) index serves the query
+    videos = Video.objects.filter(project=project_pk).order_by()
+    return set(videos.values_list('youtube_id', flat=True))
+
+
+def search_result_fields(result):
+    """
+    Returns the Video field values for a YouTube video resource
+    """
+    snippet = result['snippet']
+    statistics = result.get('statistics', {})
+    return {
+        'youtube_id': result['id'],
+        'name': snippet['title'],
+        'description': snippet.get('description', u''),
+        'published': parser.parse(snippet['publishedAt']),
+        'thumbnail_default': snippet['thumbnails']['default']['url'],
+        'thumbnail_medium': snippet['thumbnails']['medium']['url'],
+        'thumbnail_high': snippet['thumbnails']['high']['url'],
+        'likes': int(statistics.get('likeCount', 0)),
+        'dislikes': int(statistics.get('dislikeCount', 0)),
+        'comment_count': int(statistics.get('commentCount', 0)),
+    }
+
+
+def save_search(user_pk, project_pk, videos):
+    """
+    Stores the Video field values of a set of search results in memcache for
+    `VIDEO_SEARCH_TIMEOUT` seconds, returning the token they are stored
+    under.
+    """
+    token = uuid.uuid4().hex
+    memcache.set(token, {
+        'user': user_pk,
+        'project': project_pk,
+        'videos': videos,
+    }, time=settings.VIDEO_SEARCH_TIMEOUT, namespace=SEARCH_NAMESPACE)
+    return token
+
+
+def load_search(token, user_pk, project_pk):
+    """
+    Returns the Video field values of the search results stored under the
+    token, or None if it has expired or belongs to another user or project.
+    """
+    search = memcache.get(token, namespace=SEARCH_NAMESPACE)
+    if search is None:
+        return None
+    if search['user'] != user_pk or search['project'] != project_pk:
+        return None
+    return search['videos']
+
+
+def create_videos(owner, project, videos):
+    """
+    Creates Video objects in a project from a list of field value dicts with
+    a single bulk put. Bulk puts dont send post_save so the comment and
+    transcript imports the signal handlers would have started are deferred
+    here, with one batched add per queue, and the project summary is updated
+    once for all of the videos. The videos are created with their processing
+    pipeline already started.
+    """
+    # avoid circular imports
+    from . import pipeline
+    from .models import Video
+    from .tasks import youtube_import_comments, youtube_import_transcript
+    created = bulk_put([
+        Video(
+            owner=owner, project=project,
+            **dict(fields, **pipeline.initial_fields()))
+        for fields in videos])
+    if not created:
+        return created
+    rpcs = defer_batch(
+        [(youtube_import_comments, (video.pk,)) for video in created],
+        'comments', api='youtube', owner=owner.pk)
+    rpcs += defer_batch(
+        [(youtube_import_transcript, (video.pk,)) for video in created],
+        'videos')
+    update_project_summary(
+        project.pk, Counter(video_count=len(created)),
+        thumbnail=created[0].thumbnail_high)
+    for rpc in rpcs:
+        rpc.get_result()
+    return created
+
+
+def sentiment_timeline(analysis, captions, window=60):
+    """
+    Buckets the sentence level sentiment of a transcript analysis into fixed
+    time windows of `window` seconds, using the caption cue timings to work
+    out when each sentence is spoken. Returns parallel lists of the mean
+    score (None for windows without any sentences), total magnitude and
+    sentence count per window.
+    """
+    scores = []
+    magnitudes = []
+    counts = []
+    position = 0
+    for sentence in analysis.get('sentences', []):
+        content = sentence['text']['content']
+        offset = sentence['text'].get('beginOffset', -1)
+        if offset < 0:
+            # analysis without offsets, find the sentence in the transcript
+            offset = captions.transcript.find(content, position)
+            if offset < 0:
+                continue
+        position = offset + len(content)
+        bucket = int(captions.time_at(offset) // window)
+        while len(counts) <= bucket:
+            scores.append(0.0)
+            magnitudes.append(0.0)
+            counts.append(0)
+        scores[bucket] += sentence['sentiment']['score']
+        magnitudes[bucket] += sentence['sentiment']['magnitude']
+        counts[bucket] += 1
+    return {
+        'window': window,
+        'score': [
+            round(score / count, 3) if count else None
+            for score, count in zip(scores, counts)],
+        'magnitude': [round(magnitude, 3) for magnitude in magnitudes],
+        'count': counts,
+    }
+
+
+def sentence_histogram(analysis, bins=20):
+    """
+    Counts the positive, negative and neutral sentences of an analysis, along
+    with a finer grained distribution of sentence scores over `bins` equal
+    width bins spanning -1 to 1.
+    """
+    histogram = {
+        'positive': 0,
+        'negative': 0,
+        'neutral': 0,
+        'distribution': [0] * bins,
+    }
+    for sentence in analysis.get('sentences', []):
+        score = sentence['sentiment']['score']
+        if score > 0:
+            histogram['positive'] += 1
+        elif score < 0:
+            histogram['negative'] += 1
+        else:
+            histogram['neutral'] += 1
+        bucket = int((score + 1) / 2.0 * bins)
+        histogram['distribution'][min(max(bucket, 0), bins - 1)] += 1
+    return histogram
+
+
+def comment_counter(comment):
+    """
+    Returns the name of the Video counter field the passed comment is
+    counted under, or None if it is still waiting to be analyzed.
+    """
+    label = comment.get_sentiment_label()
+    if label == 'pending':
+        return None
+    return 'comments_' + label
+
+
+def count_transition(counts, before, after):
+    """
+    Records a comment moving from the `before` counter to the `after` one
+    in the passed Counter of deltas.
+    """
+    if before != after:
+        counts[before] -= 1
+        counts[after] += 1
+    return counts
+
+
+def comment_count_corrections(video, labels):
+    """
+    Returns a Counter of the deltas that bring the comment counters on the
+    passed video in line with a Counter of the sentiment labels of all of
+    its comments
+    """
+    counts = Counter(
+        comments_total=sum(labels.values()) - video.comments_total)
+    for label in ('positive', 'negative', 'neutral', 'failed'):
+        field = 'comments_' + label
+        counts[field] = labels[label] - getattr(video, field)
+    return counts
+
+
+def _update_comment_counts(video_pk, counts):
+    """
+    Returns whether the changes need rolling up now, as no pipeline run
+    will do it
+    """
+    from .models import Video  # avoid circular imports
+    from .pipeline import IN_PROGRESS  # avoid circular imports
+    with transaction.atomic():
+        try:
+            video = Video.objects.get(pk=video_pk)
+        except Video.DoesNotExist:
+            return False
+        pending = Counter(video.comment_counts_pending or {})
+        for field, delta in counts.items():
+            value = max(0, getattr(video, field) + delta)
+            pending[field] += value - getattr(video, field)
+            setattr(video, field, value)
+        video.comment_counts_pending = dict(
+            (field, delta) for field, delta in pending.items() if delta)
+        video.save(update_fields=list(counts) + ['comment_counts_pending'])
+        return video.processing_state not in IN_PROGRESS
+
+
+def update_comment_counts(video_pk, counts):
+    """
+    Applies a Counter of deltas to the comment counters on a video in a
+    single transaction. Comments waiting to be analyzed (None) arent
+    counted. During a pipeline run the changes are kept on the video until
+    the run completes and rolls them up into its project's summary, so that
+    the project isnt written by every batch of every video. Changes made
+    outside of a run, such as by replayed tasks, are rolled up straight
+    away.
+    """
+    counts = Counter(dict(
+        (field, delta) for field, delta in counts.items()
+        if field is not None and delta))
+    if not counts:
+        return
+    if do_with_retry(_update_comment_counts, video_pk, counts):
+        roll_up_comment_counts(video_pk)
+
+
+def _roll_up_comment_counts(video_pk):
+    from projects.models import Project  # avoid circular imports
+    from .models import Video
+    with transaction.atomic(xg=True):
+        try:
+            video = Video.objects.get(pk=video_pk)
+        except Video.DoesNotExist:
+            return
+        if not video.comment_counts_pending:
+            return
+        try:
+            project = Project.objects.get(pk=video.project_id)
+        except Project.DoesNotExist:
+            return
+        project.save(update_fields=apply_summary_counts(
+            project, Counter(video.comment_counts_pending)))
+        video.comment_counts_pending = None
+        video.save(update_fields=['comment_counts_pending'])
+
+
+def roll_up_comment_counts(video_pk):
+    """
+    Adds the changes to a video's comment counters since they were last
+    rolled up to its project's summary. Called once per pipeline run, when
+    the video is complete, and for changes made outside of a run.
+    """
+    do_with_retry(_roll_up_comment_counts, video_pk)
+
+
+def encode_cursor(comment):
+    """
+    Returns an opaque cursor marking the position of the passed comment in
+    the newest update first comment ordering.
+    """
+    marker = [
+        comment.updated.isoformat(), comment.published.isoformat(),
+        comment.pk]
+    return base64.urlsafe_b64encode(json.dumps(marker))
+
+
+def decode_cursor(cursor):
+    """
+    Returns the (updated, published, pk) marker of a cursor made by
+    encode_cursor. Raises ValueError for cursors that arent valid.
+    """
+    try:
+        updated, published, pk = json.loads(
+            base64.urlsafe_b64decode(str(cursor)))
+        return parser.parse(updated), parser.parse(published), pk
+    except (TypeError, ValueError):
+        raise ValueError('Invalid cursor {!r}'.format(cursor))
+
+
+def page_comments(queryset, cursor=None, page_size=50):
+    """
+    Returns a page of comments from the passed queryset, which must be in
+    the default newest update first ordering, along with the cursor of the
+    next page (None if this is the last page). Pages start after the comment
+    the cursor marks, using an inequality on `updated` so that the existing
+    (video, -updated, -published) index serves every page.
+    """
+    marker = None
+    if cursor:
+        marker = decode_cursor(cursor)
+        queryset = queryset.filter(updated__lte=marker[0])
+
+    def after_marker(comment):
+        if marker is None or comment.updated < marker[0]:
+            return True
+        # comments updated at the same instant as the marker
+        return (comment.published, -comment.pk) < (marker[1], -marker[2])
+
+    comments = []
+    offset = 0
+    # room for the marker itself and one comment to tell if there's more
+    batch = page_size + 2
+    while len(comments) <= page_size:
+        fetched = list(queryset[offset:offset + batch])
+        comments.extend(c for c in fetched if after_marker(c))
+        if len(fetched) < batch:
+            break
+        offset += batch
+    next_cursor = None
+    if len(comments) > page_size:
+        next_cursor = encode_cursor(comments[page_size - 1])
+    return comments[:page_size], next_cursor